@@ -1,18 +1,18 @@
 from fastapi import APIRouter, HTTPException, Depends
 from app.schemas.bots import BotRequest, BotResponse
-from app.schemas.restaurants import CreateRestaurant
 from app.services.openai import gpt_query, request_rewriting
-from app.services.places_api import search_nearby_restaurants
-from app.crud.restaurants import bulk_insert
+from app.services.nearby import get_nearby_places
 from app.crud.diaries import recommend_diary
 from app.dependencies.db import get_db
+from app.dependencies.redis import get_redis_client
 from app.dependencies.auth import get_current_user
 router = APIRouter(prefix="/api/v1/bots", tags=["bots"])
 
 @router.post("/question", response_model=BotResponse)
 async def question(
     user_data: BotRequest, db = Depends(get_db),
-    user = Depends(get_current_user)
+    user = Depends(get_current_user),
+    redis = Depends(get_redis_client)
 ):
     position = user_data.position
     request = user_data.req
@@ -20,10 +20,8 @@ async def question(
     keyword, error = request_rewriting(request)
     if error:
         raise HTTPException(status_code=500, detail="Internal Server Error")
-    restaurants = search_nearby_restaurants(keyword, position.lat, position.lng)
+    restaurants = await get_nearby_places(db, redis, keyword, position.lat, position.lng)
     diaries = recommend_diary(db, user.userId)
-    db_restaurants = [CreateRestaurant(**restaurant) for restaurant in restaurants]
-    bulk_insert(db, db_restaurants)
 
     filtered_restaurants = [
         {
@@ -1,40 +1,75 @@
-from fastapi import APIRouter, Depends, Path, Query, HTTPException
+from fastapi import APIRouter, Depends, Path, Query, HTTPException, Response
 from typing import List, Optional 
 
 from app.schemas.diaries import (
     DiaryCreate, DiaryUpdate, DiaryDisplay, DiaryResponse, SimplifiedDiary)
 from app.dependencies.auth import get_current_user, get_optional_user
 from app.schemas.users import UserLoginInfo
+from app.schemas.tags import TagCount
 from app.dependencies.db import get_db
+from app.dependencies.redis import get_redis_client
+from app.services.diary_cache import get_diary_detail
+from app.services.tag_facets import FACET_SIZE, get_tag_facets
+from app.services.count_cache import cached_count
+from app.services import timeline
+from app.core.tags import TAG_MODES, parse_tags
 import app.crud.diaries as crud_diary 
 router = APIRouter(prefix="/api/v1/diaries", tags=["diaries"])
 
 
 @router.get("", response_model=List[SimplifiedDiary])
 async def get_diaries(
-    orderBy: str = Query("createTime", enum=["collectCount", "createTime"]),
+    orderBy: str = Query("createTime", enum=["collectCount", "createTime", "relevance"]),
     tags: Optional[List[str]] = Query(None),
+    tagMode: str = Query("any", enum=TAG_MODES),
     offset: int = Query(0, ge=0),
     limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
     q: Optional[str] = Query(None),
     following: Optional[bool] = Query(False),
+    response: Response = None,
     user: Optional[UserLoginInfo] = Depends(get_optional_user),
-    db = Depends(get_db)
+    db = Depends(get_db),
+    redis = Depends(get_redis_client)
 ):  
     query_params = {
         "orderBy": orderBy,
         "offset": offset,
         "limit": limit,
         "q": q,
+        "cursor": cursor,
+        "tags": parse_tags(tags),
+        "tagMode": tagMode,
         "following": following 
     }
     if following and not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
     user_id = user.userId if user else -1
-    count, diaries = crud_diary.get_diaries(db, user_id, query_params)
+    feed_ids = None
+    if following and orderBy == "createTime" and not (q or cursor or query_params["tags"]):
+        feed_ids = timeline.feed_page(db, redis, user_id, offset, limit)
+    if feed_ids is not None:
+        diaries, next_cursor = crud_diary.get_diaries_by_ids(db, feed_ids, limit)
+    else:
+        diaries, next_cursor = crud_diary.get_diaries(db, user_id, query_params)
+    count_scope = {k: v for k, v in query_params.items() if k in ("q", "tags", "tagMode", "following")}
+    if following:
+        count_scope["user"] = user_id
+    response.headers["X-Total-Count"] = str(cached_count(redis, "diaries", count_scope, lambda: crud_diary.count_diaries(db, user_id, query_params)))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return diaries
 
 
+@router.get("/tags", response_model=List[TagCount])
+async def get_diary_tags(
+    limit: int = Query(20, ge=1, le=FACET_SIZE),
+    db = Depends(get_db),
+    redis = Depends(get_redis_client)
+):
+    return get_tag_facets(db, redis, "diaries", limit)
+
+
 # --- Diary_Create ---
 @router.post("", response_model=DiaryResponse, status_code=201)
 async def create_diary(
@@ -55,10 +90,11 @@ async def create_diary(
 async def get_single_diary(
     id: int = Path(...), 
     user: Optional[UserLoginInfo] = Depends(get_optional_user),
-    db = Depends(get_db)
+    db = Depends(get_db),
+    redis = Depends(get_redis_client)
 ):
     userId = user.userId if user else -1
-    diary = crud_diary.get_diary(db, id, userId)
+    diary = get_diary_detail(db, redis, id, userId)
     return diary
 
 # --- Diary_Update ---
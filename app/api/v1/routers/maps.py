@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, Query, Path
+from fastapi import APIRouter, Depends, Query, Path, Request, Response
 from typing import List, Optional
 import logging
 from fastapi.exceptions import HTTPException
@@ -16,7 +16,15 @@ from app.schemas.maps import (
 from app.dependencies.auth import get_current_user, get_optional_user
 from app.schemas.users import UserLoginInfo
 from app.schemas.restaurants import PaginatedRestaurantResponse
+from app.schemas.tags import TagCount
 from app.dependencies.db import get_db
+from app.dependencies.redis import get_redis_client
+from app.core import compact
+from app.core.tags import TAG_MODES, parse_tags
+from app.services.tag_facets import FACET_SIZE, get_tag_facets
+from app.jobs.view_counts import record_view
+from app.services import leaderboard
+from app.services.count_cache import cached_count
 import app.crud.maps as crud_map
 import app.crud.users as crud_user
 
@@ -26,26 +34,50 @@ logger.setLevel(logging.DEBUG)
 
 @router.get("", response_model=PaginatedMapResponse)
 async def get_maps(
-    orderBy: str = Query("favCount", enum=["favCount", "createTime"]),
+    orderBy: str = Query("favCount", enum=["favCount", "createTime", "relevance", "trending"]),
     tags: Optional[List[str]] = Query(None),
+    tagMode: str = Query("any", enum=TAG_MODES),
     offset: int = Query(0, ge=0),
     limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
     reverse: bool = Query(False),
     q: Optional[str] = Query(None),
     user: Optional[UserLoginInfo] = Depends(get_optional_user),
-    db = Depends(get_db)
+    db = Depends(get_db),
+    redis = Depends(get_redis_client)
 ):
     query_params = {
         "orderBy": orderBy,
         "offset": offset,
         "limit": limit,
         "q": q,
+        "cursor": cursor,
+        "reverse": reverse,
+        "tags": parse_tags(tags),
+        "tagMode": tagMode,
         "auth_user_id": user.userId if user else -1
     }
-    map_list = crud_map.get_maps(db, query_params)
-    if reverse:
-        map_list = map_list[::-1]
-    return PaginatedMapResponse(total=len(map_list), maps=map_list[offset:offset+limit], limit=limit, offset=offset)
+    # Unfiltered rankings come from the Redis leaderboards, hydrated by primary key
+    if not (q or query_params["tags"] or cursor):
+        if orderBy == "trending":
+            total, ids = leaderboard.trending_page(redis, "maps", offset, limit, reverse)
+            map_list, _ = crud_map.get_maps_by_ids(db, [int(map_id) for map_id in ids], query_params)
+            return PaginatedMapResponse(total=total, maps=map_list, limit=limit, offset=offset, nextCursor=None)
+        if orderBy == "favCount":
+            ids = leaderboard.collect_page(redis, offset, limit, reverse)
+            if ids is not None:
+                map_list, next_cursor = crud_map.get_maps_by_ids(db, ids, query_params)
+                return PaginatedMapResponse(total=cached_count(redis, "maps", {}, lambda: crud_map.count_maps(db)), maps=map_list, limit=limit, offset=offset, nextCursor=next_cursor)
+    total, map_list, next_cursor = crud_map.get_maps(db, query_params)
+    return PaginatedMapResponse(total=total, maps=map_list, limit=limit, offset=offset, nextCursor=next_cursor)
+
+@router.get("/tags", response_model=List[TagCount])
+async def get_map_tags(
+    limit: int = Query(20, ge=1, le=FACET_SIZE),
+    db = Depends(get_db),
+    redis = Depends(get_redis_client)
+):
+    return get_tag_facets(db, redis, "maps", limit)
 
 # --- Create_Map ---
 @router.post("", response_model=PostResponse, status_code=201)
@@ -69,42 +101,62 @@ async def create_map(
 async def get_single_map(
     id: int = Path(...), 
     user: Optional[UserLoginInfo] = Depends(get_optional_user),
-    db = Depends(get_db)
+    db = Depends(get_db),
+    redis = Depends(get_redis_client)
 ):
     map = crud_map.get_map(db, id, user.userId if user else -1)
     if not map:
         raise HTTPException(status_code=404, detail="Map not found")
+    record_view(redis, "maps", id)
     return map
 
 @router.get("/{id}/restaurants", response_model=PaginatedRestaurantResponse)
 async def get_restaurants(
     id: int = Path(...),
-    orderBy: str = Query("favCount", enum=["favCount", "createTime"]),
+    orderBy: str = Query("favCount", enum=["favCount", "createTime", "relevance"]),
     tags: Optional[List[str]] = Query(None),
+    tagMode: str = Query("any", enum=TAG_MODES),
     offset: int = Query(0, ge=0),
     limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
     reverse: bool = Query(False),
     q: Optional[str] = Query(None),
-    sw: Optional[str] = Query(None),
-    ne: Optional[str] = Query(None),
+    sw: Optional[str] = Query(None, description="lat,lng of the south-west corner"),
+    ne: Optional[str] = Query(None, description="lat,lng of the north-east corner"),
+    request: Request = None,
+    response: Response = None,
     user: Optional[UserLoginInfo] = Depends(get_optional_user),
     db = Depends(get_db)
 ):
     if id == 0:
         raise HTTPException(status_code=307, detail="Temporary Redirect", headers={"Location": "/api/v1/restaurants"})
     
+    media_type = compact.negotiate(request)
+    response.headers["Vary"] = "Accept"
     query_params = {
         "orderBy": orderBy,
+        "offset": offset,
+        "limit": limit,
+        "cursor": cursor,
+        "reverse": reverse,
         "q": q,
+        "tags": parse_tags(tags),
+        "tagMode": tagMode,
+        "compact": media_type is not None,
     }
+    if sw and ne:
+        try:
+            query_params["sw_lat"], query_params["sw_lng"] = map(float, sw.split(","))
+            query_params["ne_lat"], query_params["ne_lng"] = map(float, ne.split(","))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="sw and ne must be lat,lng")
 
     if user:
         query_params["auth_user_id"] = user.userId
-    total, restaurants_list = crud_map.get_restaurants(db=db, map_id=id, query_params=query_params)
-    if reverse:
-        restaurants_list = restaurants_list[::-1]
-    restaurants_list = restaurants_list[offset:offset+limit]
-    return PaginatedRestaurantResponse(total=total, restaurants=restaurants_list, limit=limit, offset=offset)
+    total, restaurants_list, next_cursor = crud_map.get_restaurants(db=db, map_id=id, query_params=query_params)
+    if media_type:
+        return compact.restaurant_page(media_type, restaurants_list, total=total, limit=limit, offset=offset, nextCursor=next_cursor)
+    return PaginatedRestaurantResponse(total=total, restaurants=restaurants_list, limit=limit, offset=offset, nextCursor=next_cursor)
 
 # --- Modify_Map ---
 @router.put("/{id}", response_model=PutResponse)
@@ -124,7 +176,7 @@ async def modify_map(
     if map_data.tags:
         update_dict["tags"] = map_data.tags
     if map_data.restaurants:
-        update_dict["rest_ids"] = map_data.restaurants
+        update_dict["restaurants"] = map_data.restaurants
 
     logger.info(f"update_dict: {update_dict}")
     update_result = crud_map.update_map(db, id, update_dict, user.userId)
@@ -139,9 +191,10 @@ async def modify_map(
 
 # --- Delete_Map ---
 @router.delete("/{id}", response_model=PostResponse)
-async def delete_map(id: int = Path(...), user: UserLoginInfo = Depends(get_current_user), db = Depends(get_db)):
+async def delete_map(id: int = Path(...), user: UserLoginInfo = Depends(get_current_user), db = Depends(get_db), redis = Depends(get_redis_client)):
     try:
         map_delete = crud_map.delete_map(db,id)
+        leaderboard.remove_map(redis, id)
         logger.info(f"{map_delete} deleted successfully")
         return {
             "success": True,
@@ -155,12 +208,16 @@ async def delete_map(id: int = Path(...), user: UserLoginInfo = Depends(get_curr
 async def collect_map(
     id: int = Path(...), 
     user: UserLoginInfo = Depends(get_current_user),
-    db = Depends(get_db)
+    db = Depends(get_db),
+    redis = Depends(get_redis_client)
 ):
     try:
-        crud_map.collect_map(db, user.userId, id)
+        inserted = crud_map.collect_map(db, user.userId, id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if inserted:
+        leaderboard.record_map_collect(redis, id, 1)
+        leaderboard.bump_trending(redis, "maps", {id: 1}, "collect")
     return {
         "success": True, 
         "message": f"User {user.userId} collected map {id}"
@@ -171,12 +228,15 @@ async def collect_map(
 async def uncollect_map(
     id: int = Path(...), 
     user: UserLoginInfo = Depends(get_current_user),
-    db = Depends(get_db)
+    db = Depends(get_db),
+    redis = Depends(get_redis_client)
 ):
     try:
-        crud_map.uncollect_map(db, user.userId, id)
+        removed = crud_map.uncollect_map(db, user.userId, id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if removed:
+        leaderboard.record_map_collect(redis, id, -1)
     return {
         "success": True,
         "message": f"{user.userId} has uncollected map number {id}",
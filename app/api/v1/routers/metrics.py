@@ -0,0 +1,9 @@
+from fastapi import APIRouter, Depends
+from app.dependencies.redis import get_redis_client
+from app.services.metrics import get_metrics
+
+router = APIRouter(prefix="/api/v1/metrics", tags=["metrics"])
+
+@router.get("")
+async def read_metrics(redis = Depends(get_redis_client)):
+    return get_metrics(redis)
@@ -1,36 +1,70 @@
-from fastapi import APIRouter, Path, Depends, HTTPException, Query
-from app.schemas.restaurants import Restaurant, PaginatedRestaurantResponse, PostResponse
+import logging
+from fastapi import APIRouter, Path, Depends, HTTPException, Query, Request, Response
+from starlette.concurrency import run_in_threadpool
+from app.core import compact
+from app.schemas.restaurants import Restaurant, PaginatedRestaurantResponse, PostResponse, RestaurantClusterResponse
+from app.core.geo import cluster_cell_size
+from app.core.tags import TAG_MODES, parse_tags
 from app.services.places_api import get_place_details
 from app.schemas.users import UserLoginInfo
 from typing import Optional, List
 from app.dependencies.auth import get_optional_user, get_current_user
-from app.services.places_api import search_nearby_restaurants
-from app.schemas.restaurants import CreateRestaurant
-from app.crud.restaurants import bulk_insert, create_update_restaurant, get_restaurant
+from app.services.nearby import get_nearby_places
+from app.crud.restaurants import create_update_restaurant
+from app.services.restaurant_cache import get_restaurant_detail
 from app.dependencies.db import get_db
 from app.dependencies.redis import get_redis_client
-from app.services.redis_query import need_query_position, need_query_place
+from app.services.redis_query import need_query_place, mark_place_queried
+from app.services.single_flight import single_flight
+from app.jobs.place_refresh import enqueue_place_refresh
+from app.jobs.view_counts import record_view
+from app.services import leaderboard
 import app.crud.restaurants as crud_rest 
 
 router = APIRouter(prefix="/api/v1/restaurants", tags=["restaurants"])
+logger = logging.getLogger(__name__)
+
+def restaurant_page(db, redis, query_params: dict, reverse: bool, media_type):
+    """One page of GET /api/v1/restaurants. Blocking database work: call it through run_in_threadpool."""
+    offset, limit = query_params["offset"], query_params["limit"]
+    if query_params["orderBy"] == "trending" and not (
+        query_params["q"] or query_params["tags"] or "sw_lat" in query_params or query_params["cursor"]
+    ):
+        # Straight from the leaderboard, hydrated by primary key
+        total, ids = leaderboard.trending_page(redis, "restaurants", offset, limit, reverse)
+        restaurants_list = crud_rest.get_restaurants_by_ids(db, ids, query_params.get("auth_user_id", -1), query_params["compact"])
+        if media_type:
+            return compact.restaurant_page(media_type, restaurants_list, total=total, limit=limit, offset=offset)
+        return PaginatedRestaurantResponse(total=total, restaurants=restaurants_list, limit=limit, offset=offset)
+    
+    total, restaurants_list, next_cursor = crud_rest.query_restaurants(db, {**query_params, "reverse": reverse})
+    if media_type:
+        return compact.restaurant_page(media_type, restaurants_list, total=total, limit=limit, offset=offset, nextCursor=next_cursor)
+    return PaginatedRestaurantResponse(total=total, restaurants=restaurants_list, limit=limit, offset=offset, nextCursor=next_cursor)
 
 @router.get("", response_model=PaginatedRestaurantResponse)
-def get_restaurants(
-    orderBy: str = Query("collectCount", enum=["collectCount", "createTime"]),
+async def get_restaurants(
+    orderBy: str = Query("collectCount", enum=["collectCount", "createTime", "relevance", "distance", "trending"]),
     tags: Optional[List[str]] = Query(None),
+    tagMode: str = Query("any", enum=TAG_MODES),
     offset: int = Query(0, ge=0),
     limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
     reverse: bool = Query(False),
     q: Optional[str] = Query(None),
     lat: float = Query(25.013686),
     lng: float = Query(121.540535),
-    distance: int = Query(1000),
+    distance: int = Query(1000, ge=1, le=50000),
     sw: Optional[str] = Query(None),
     ne: Optional[str] = Query(None),
+    request: Request = None,
+    response: Response = None,
     user: Optional[UserLoginInfo] = Depends(get_optional_user),
     db = Depends(get_db),
     redis = Depends(get_redis_client)
 ):
+    media_type = compact.negotiate(request)
+    response.headers["Vary"] = "Accept"
     if sw and ne:
         sw = sw.split(",")
         ne = ne.split(",")
@@ -41,16 +75,24 @@ def get_restaurants(
         lat = (sw_lat + ne_lat) / 2
         lng = (sw_lng + ne_lng) / 2
         
-    if need_query_position(redis, lat, lng):
-        nearby_restaurants = search_nearby_restaurants(q, lat, lng)
-        db_restaurants = [CreateRestaurant(**restaurant) for restaurant in nearby_restaurants]
-        bulk_insert(db, db_restaurants)
+    try:
+        await get_nearby_places(db, redis, q, lat, lng, distance)
+    except Exception as e:
+        # Google being down should not fail the listing; serve what the database already has
+        logger.warning(f"Nearby search failed, listing from the database only: {e}")
 
     query_params = {
         "orderBy": orderBy,
         "offset": offset,
         "limit": limit,
         "q": q,
+        "cursor": cursor,
+        "lat": lat,
+        "lng": lng,
+        "distance": distance,
+        "tags": parse_tags(tags),
+        "tagMode": tagMode,
+        "compact": media_type is not None,
     }
 
     if sw and ne:
@@ -61,11 +103,26 @@ def get_restaurants(
 
     if user:
         query_params["auth_user_id"] = user.userId
-    
-    total, restaurants_list = crud_rest.query_restaurants(db, query_params)
-    if reverse:
-        restaurants_list = restaurants_list[::-1]
-    return PaginatedRestaurantResponse(total=total, restaurants=restaurants_list, limit=limit, offset=offset)
+
+    # The page is synchronous SQLAlchemy work; keep it off the event loop
+    return await run_in_threadpool(restaurant_page, db, redis, query_params, reverse, media_type)
+
+@router.get("/clusters", response_model=RestaurantClusterResponse)
+async def get_restaurant_clusters(
+    sw: str = Query(..., description="lat,lng of the south-west corner"),
+    ne: str = Query(..., description="lat,lng of the north-east corner"),
+    zoom: int = Query(..., ge=0, le=22),
+    q: Optional[str] = Query(None),
+    db = Depends(get_db)
+):
+    try:
+        sw_lat, sw_lng = map(float, sw.split(","))
+        ne_lat, ne_lng = map(float, ne.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="sw and ne must be lat,lng")
+    cell_size = cluster_cell_size(zoom, sw_lat, sw_lng, ne_lat, ne_lng)
+    clusters = crud_rest.cluster_restaurants(db, sw_lat, sw_lng, ne_lat, ne_lng, cell_size, q)
+    return RestaurantClusterResponse(zoom=zoom, cellSize=cell_size, clusters=clusters)
 
 @router.get("/{place_id}", response_model=Restaurant)
 async def get_single_restaurant(
@@ -74,26 +131,41 @@ async def get_single_restaurant(
     db = Depends(get_db),
     redis = Depends(get_redis_client)
 ):
-    if need_query_place(redis, place_id):
-        try:
-            restaurant = await get_place_details(place_id)
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=str(e))
-        create_update_restaurant(db, restaurant)
-
-    restaurant = get_restaurant(db, place_id, user.userId if user else -1)
+    # The database work is blocking, so it runs in the threadpool like the listing's
+    if not await run_in_threadpool(crud_rest.has_place_details, db, place_id):
+        # Nothing to serve yet, so this first view has to wait for Google
+        async def fetch():
+            try:
+                restaurant = await get_place_details(place_id)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            await run_in_threadpool(create_update_restaurant, db, restaurant)
+            mark_place_queried(redis, place_id)
+            return True
+
+        await single_flight(redis, "place_details", f"place:{place_id}", fetch)
+        if not await run_in_threadpool(crud_rest.has_place_details, db, place_id):
+            raise HTTPException(status_code=503, detail=f"Details of place {place_id} are still being fetched")
+    elif need_query_place(redis, place_id):
+        enqueue_place_refresh(redis, place_id)
+
+    restaurant = await run_in_threadpool(get_restaurant_detail, db, redis, place_id, user.userId if user else -1)
+    record_view(redis, "restaurants", place_id)
     return restaurant
  
 @router.post("/{place_id}/collect", response_model=PostResponse, status_code=201)
 async def collect_restaurant(
     place_id: str = Path(...),
     user: UserLoginInfo = Depends(get_current_user),
-    db = Depends(get_db)
+    db = Depends(get_db),
+    redis = Depends(get_redis_client)
 ):  
     try:
-        crud_rest.collect_restaurant(db, user.userId, place_id)
+        inserted = crud_rest.collect_restaurant(db, user.userId, place_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if inserted:
+        leaderboard.bump_trending(redis, "restaurants", {place_id: 1}, "collect")
     return {
         "success": True, 
         "message": f"User {user.userId} collected place {place_id}"
@@ -119,12 +191,15 @@ async def uncollect_restaurant(
 async def like_restaurant(
     place_id: str = Path(...),
     user: UserLoginInfo = Depends(get_current_user),
-    db = Depends(get_db)
+    db = Depends(get_db),
+    redis = Depends(get_redis_client)
 ):  
     try:
-        crud_rest.like_restaurant(db, user.userId, place_id)
+        inserted = crud_rest.like_restaurant(db, user.userId, place_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if inserted:
+        leaderboard.bump_trending(redis, "restaurants", {place_id: 1}, "like")
     return {
         "success": True, 
         "message": f"User {user.userId} liked restaurant number {place_id}"
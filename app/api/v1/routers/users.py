@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, Path, Query, HTTPException
+from fastapi import APIRouter, Depends, Path, Query, HTTPException, Response
 from fastapi import UploadFile, File
 from typing import Optional, List
 from app.schemas.users import UserLogin, UserUpdate, UserPostResult, UserLoginInfo, UserDisplay
@@ -13,11 +13,13 @@ router = APIRouter(prefix="/api/v1/users", tags=["user"])
 
 @router.get("", response_model=List[UserDisplay])
 async def get_users_detail(
-    orderBy: str = Query("createTime", enum=["following", "createTime"]),
+    orderBy: str = Query("createTime", enum=["following", "createTime", "relevance"]),
     offset: int = Query(0, ge=0),
     limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
     reverse: bool = Query(False),
     q: Optional[str] = Query(None),
+    response: Response = None,
     user: Optional[UserLoginInfo] = Depends(get_optional_user),
     db = Depends(get_db)
 ):
@@ -26,11 +28,13 @@ async def get_users_detail(
         "offset": offset,
         "limit": limit,
         "q": q,
+        "cursor": cursor,
+        "reverse": reverse,
         "auth_user_id": user.userId if user else -1 
     }
-    user_list = crud_user.get_users(db, query_params)
-    if reverse:
-        user_list = user_list[::-1]
+    user_list, next_cursor = crud_user.get_users(db, query_params)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return user_list
 
 
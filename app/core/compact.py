@@ -0,0 +1,76 @@
+"""
+Opt-in compact encodings for restaurant pages, chosen through the Accept header.
+
+The rows are laid out column by column: one array per field instead of one object
+per restaurant, location split into lat/lng arrays and the three user flags packed
+into one bitmask. Clients asking for COLUMNAR_JSON get that as JSON, clients asking
+for MSGPACK get it as MessagePack. Rows are encoded straight from the database
+rows, without building a Pydantic model per restaurant.
+
+The compact types are opt-in: only a media range naming them exactly selects them,
+wildcards only ever match the regular JSON. Since the body depends on Accept, the
+listings send Vary: Accept whichever encoding they pick.
+"""
+import json
+import msgpack
+from fastapi import Request, Response
+
+COLUMNAR_JSON = "application/vnd.restaurants.columnar+json"
+MSGPACK = "application/msgpack"
+JSON = "application/json"
+MEDIA_ALIASES = {"application/x-msgpack": MSGPACK}
+
+RESTAURANT_COLUMNS = ["placeId", "name", "lat", "lng", "rating", "photoUrl", "viewCount", "collectCount", "likeCount", "dislikeCount"]
+FLAG_BITS = {"hasCollected": 1, "hasLiked": 2, "hasDisliked": 4}
+
+def accepted_ranges(accept: str) -> dict[str, float]:
+    """The media ranges of an Accept header with their q-values, e.g. {"application/json": 1.0, "*/*": 0.1}."""
+    ranges = {}
+    for media_range in accept.split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        if not media_type:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = min(max(float(value), 0.0), 1.0)
+                except ValueError:
+                    quality = 0.0
+        media_type = media_type.lower()
+        media_type = MEDIA_ALIASES.get(media_type, media_type)
+        ranges[media_type] = max(quality, ranges.get(media_type, 0.0))
+    return ranges
+
+def negotiate(request: Request) -> str:
+    """The compact media type the client prefers, or None for the regular JSON response."""
+    accept = request.headers.get("accept")
+    if not accept:
+        return None
+    ranges = accepted_ranges(accept)
+    # The most specific range matching JSON decides its quality
+    json_quality = next((ranges[media_range] for media_range in (JSON, "application/*", "*/*") if media_range in ranges), 0.0)
+    # Ties go to the compact types, which a client only names when it wants them
+    quality, media_type = max((ranges.get(MSGPACK, 0.0), MSGPACK), (ranges.get(COLUMNAR_JSON, 0.0), COLUMNAR_JSON), key=lambda offer: offer[0])
+    if quality > 0 and quality >= json_quality:
+        return media_type
+    return None
+
+def restaurant_columns(rows: list[dict]) -> dict[str, list]:
+    columns = {column: [row[column] for row in rows] for column in RESTAURANT_COLUMNS}
+    columns["flags"] = [
+        sum(bit for flag, bit in FLAG_BITS.items() if row[flag]) for row in rows
+    ]
+    if rows and "distance" in rows[0]:
+        columns["distance"] = [row["distance"] for row in rows]
+    return columns
+
+def restaurant_page(media_type: str, rows, **page) -> Response:
+    """Encode a page of restaurant rows (selected with compact=True, flags merged) plus the page fields."""
+    content = {**page, "flagBits": FLAG_BITS, "restaurants": restaurant_columns(rows)}
+    if media_type == MSGPACK:
+        body = msgpack.packb(content)
+    else:
+        body = json.dumps(content, ensure_ascii=False, separators=(",", ":"))
+    return Response(content=body, media_type=media_type, headers={"Vary": "Accept"})
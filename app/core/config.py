@@ -10,6 +10,8 @@ class Config:
     DATABASE_URL = os.getenv('DATABASE_URL')
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     REDIS_URL = os.getenv('REDIS_URL')
+    PLACES_API_URL = os.getenv('PLACES_API_URL', 'https://maps.googleapis.com/maps/api/place')
+    SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'auto')  # auto, trgm or bigram, see app.core.search
     @staticmethod
     def init_app(app):
         pass
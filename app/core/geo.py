@@ -0,0 +1,66 @@
+import math
+from typing import Optional
+
+# Restaurants are bucketed into a fixed 0.01° grid (~1.1 km at Taipei's latitude),
+# the same resolution used by the Places query cache in services.redis_query.
+TILE_SIZE = 0.01
+TILE_COLS = 36000  # 360 / TILE_SIZE
+MAX_COVER_ROWS = 200  # viewports taller than ~2° fall back to a plain lat/lng range scan
+EARTH_RADIUS = 6371008.8  # meters, mean radius
+CLUSTER_PX = 64  # on-screen size of a cluster cell, in 256px web map tile pixels
+MAX_CLUSTER_GRID = 32  # cluster cells per viewport side, bounds the response size
+
+def tile_row(lat: float) -> int:
+    return math.floor((lat + 90) / TILE_SIZE)
+
+def tile_col(lng: float) -> int:
+    return math.floor((lng + 180) / TILE_SIZE)
+
+def tile_key(lat: Optional[float], lng: Optional[float]) -> Optional[int]:
+    """
+    Encode a coordinate as a single integer cell id.
+    Keys are row-major, so the cells of one grid row form a contiguous key range.
+    None for a place without coordinates: it is stored without a key and bbox
+    queries never match it.
+    """
+    if lat is None or lng is None:
+        return None
+    return tile_row(lat) * TILE_COLS + tile_col(lng)
+
+def tile_center(lat: float, lng: float) -> tuple[float, float]:
+    """Center of the grid cell containing the coordinate."""
+    return (
+        (tile_row(lat) + 0.5) * TILE_SIZE - 90,
+        (tile_col(lng) + 0.5) * TILE_SIZE - 180
+    )
+
+def covering_ranges(sw_lat: float, sw_lng: float, ne_lat: float, ne_lng: float) -> Optional[list[tuple[int, int]]]:
+    """
+    Return the (first_key, last_key) range of every grid row intersecting the box,
+    or None if the box spans too many rows for a range scan per row to pay off;
+    callers then filter on plain lat/lng bounds instead (see crud.restaurants.bbox_filter).
+    """
+    row_lo, row_hi = tile_row(min(sw_lat, ne_lat)), tile_row(max(sw_lat, ne_lat))
+    col_lo, col_hi = tile_col(min(sw_lng, ne_lng)), tile_col(max(sw_lng, ne_lng))
+    if row_hi - row_lo + 1 > MAX_COVER_ROWS:
+        return None
+    return [
+        (row * TILE_COLS + col_lo, row * TILE_COLS + col_hi)
+        for row in range(row_lo, row_hi + 1)
+    ]
+
+def radius_bbox(lat: float, lng: float, meters: float) -> tuple[float, float, float, float]:
+    """(sw_lat, sw_lng, ne_lat, ne_lng) of a box containing the circle of `meters` around the point."""
+    dlat = math.degrees(meters / EARTH_RADIUS)
+    dlng = math.degrees(meters / (EARTH_RADIUS * max(math.cos(math.radians(lat)), 1e-6)))
+    return max(lat - dlat, -90), max(lng - dlng, -180), min(lat + dlat, 90), min(lng + dlng, 180)
+
+def cluster_cell_size(zoom: int, sw_lat: float, sw_lng: float, ne_lat: float, ne_lng: float) -> float:
+    """
+    Side of the cluster cells for a viewport, in degrees: about CLUSTER_PX on screen at
+    this zoom, but never more than MAX_CLUSTER_GRID cells across the viewport. Sizes are
+    TILE_SIZE times a power of two, so cells stay put while the user pans at a given zoom.
+    """
+    size = 360 / 2 ** zoom * CLUSTER_PX / 256
+    size = max(size, abs(ne_lat - sw_lat) / MAX_CLUSTER_GRID, abs(ne_lng - sw_lng) / MAX_CLUSTER_GRID)
+    return TILE_SIZE * 2 ** max(0, math.ceil(math.log2(size / TILE_SIZE)))
@@ -0,0 +1,61 @@
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import DateTime, and_, literal, or_, tuple_
+
+def encode_cursor(order_by: str, value, last_id) -> str:
+    payload = json.dumps([order_by, value, last_id], default=lambda v: v.isoformat(), ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, order_by: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_order, value, last_id = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if cursor_order != order_by:
+        raise HTTPException(status_code=400, detail=f"Cursor was issued for orderBy={cursor_order}")
+    return value, last_id
+
+def keyset(stmt, order_by: str, sort_key, pk, descending: bool = True, cursor: str = None, aggregate: bool = False):
+    """
+    Order stmt by (sort_key, pk) and, given the cursor of the previous page, seek past it.
+    The primary key breaks ties so pages never overlap or skip rows with equal sort values.
+    Set aggregate when sort_key is an aggregate, so the seek goes into HAVING instead of WHERE.
+    The sort values are selected as sortKey/sortId for next_cursor to read off the last row.
+    NULL sort values keep Postgres' default place (first when descending, last when
+    ascending, which is what plain indexes return) and are seeked explicitly, since a
+    row comparison against NULL matches nothing.
+    """
+    stmt = stmt.add_columns(sort_key.label('sortKey'), pk.label('sortId'))
+    if descending:
+        stmt = stmt.order_by(sort_key.desc(), pk.desc())
+    else:
+        stmt = stmt.order_by(sort_key.asc(), pk.asc())
+    if cursor:
+        value, last_id = decode_cursor(cursor, order_by)
+        if value is not None and isinstance(sort_key.type, DateTime):
+            value = datetime.fromisoformat(value)
+        after = (lambda a, b: a < b) if descending else (lambda a, b: a > b)
+        if value is None:
+            seek = and_(sort_key.is_(None), after(pk, literal(last_id, pk.type)))
+            if descending:
+                seek = or_(seek, sort_key.is_not(None))
+        else:
+            seek = after(tuple_(sort_key, pk), tuple_(literal(value, sort_key.type), literal(last_id, pk.type)))
+            if not descending and not aggregate:
+                seek = or_(seek, sort_key.is_(None))
+        stmt = stmt.having(seek) if aggregate else stmt.where(seek)
+    return stmt
+
+def sort_tag(order_by: str, reverse: bool = False) -> str:
+    """Cursor tag of an ordering; the reversed ordering gets its own so their cursors cannot be mixed up."""
+    return f"{order_by}:reverse" if reverse else order_by
+
+def next_cursor(rows, limit: int, order_by: str) -> str:
+    """Cursor pointing after the last row, or None when this was the last page."""
+    if not rows or len(rows) < limit or 'sortKey' not in rows[-1]._mapping:
+        return None
+    last = rows[-1]._mapping
+    return encode_cursor(order_by, last['sortKey'], last['sortId'])
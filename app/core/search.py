@@ -0,0 +1,93 @@
+"""
+Name search shared by every `q` filter.
+
+Two index types back the substring match:
+- a GIN index over search_tokens(name), the lower-cased characters and character
+  bigrams of the name. It only needs core PostgreSQL and suits Chinese names, where
+  typical queries are one or two characters long and have no word boundaries.
+- pg_trgm GIN indexes (gin_trgm_ops), created when the extension can be installed.
+  They are used for queries of three or more characters, and for CJK text only if
+  the database locale lets pg_trgm extract trigrams from it.
+
+Either way the candidates are rechecked with ILIKE, so results are the same as a
+plain substring search. SEARCH_BACKEND=bigram|trgm overrides the detection.
+"""
+from sqlalchemy import Text, case, cast, func, literal, text
+from sqlalchemy.dialects.postgresql import ARRAY, DOUBLE_PRECISION
+from app.core.config import Config
+from app.db.database import engine
+
+# Indexed name columns as (table, column); kept in sync by init_db
+SEARCH_COLUMNS = [("restaurants", "rest_name"), ("maps", "map_name"), ("users", "user_name")]
+
+SEARCH_FUNCTIONS = [
+    """
+    CREATE OR REPLACE FUNCTION search_tokens(name text) RETURNS text[] AS $$
+        SELECT coalesce(array_agg(DISTINCT token), '{}') FROM (
+            SELECT substr(lower(name), i, 1) AS token FROM generate_series(1, char_length(name)) AS i
+            UNION ALL
+            SELECT substr(lower(name), i, 2) FROM generate_series(1, char_length(name) - 1) AS i
+        ) AS tokens
+    $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE
+    """,
+    # Every bigram of the query, or the query itself when it is a single character
+    """
+    CREATE OR REPLACE FUNCTION search_query_tokens(q text) RETURNS text[] AS $$
+        SELECT CASE WHEN char_length(q) = 1 THEN ARRAY[lower(q)] ELSE (
+            SELECT coalesce(array_agg(DISTINCT substr(lower(q), i, 2)), '{}')
+            FROM generate_series(1, char_length(q) - 1) AS i
+        ) END
+    $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE
+    """,
+]
+
+TRGM_MIN_LENGTH = 3
+
+_trigram = None
+
+def trigram_support() -> tuple[bool, bool]:
+    """(pg_trgm usable, pg_trgm usable for CJK text), detected once per process."""
+    global _trigram
+    if _trigram is None:
+        backend = Config.SEARCH_BACKEND
+        if backend == "bigram":
+            _trigram = (False, False)
+        elif backend == "trgm":
+            _trigram = (True, True)
+        else:
+            with engine.connect() as conn:
+                available = conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar() is not None
+                cjk = available and conn.execute(text("SELECT cardinality(show_trgm('台北車站')) > 0")).scalar()
+            _trigram = (available, bool(cjk))
+    return _trigram
+
+def use_trigram(q: str) -> bool:
+    available, cjk = trigram_support()
+    return available and len(q) >= TRGM_MIN_LENGTH and (q.isascii() or cjk)
+
+def like_pattern(q: str) -> str:
+    return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def name_match(column, q: str):
+    """Case-insensitive substring match of q in column, answerable from the search indexes."""
+    contains = column.ilike(f"%{like_pattern(q)}%")
+    if use_trigram(q):
+        return contains
+    tokens = func.search_tokens(column, type_=ARRAY(Text))
+    return tokens.contains(func.search_query_tokens(literal(q, Text), type_=ARRAY(Text))) & contains
+
+def relevance(column, q: str):
+    """
+    Ranking score for name_match results: exact matches first, then prefixes, then
+    by trigram similarity (or, without pg_trgm, the share of the name the query covers).
+    """
+    if use_trigram(q):
+        # similarity() returns real; widen it so the value a cursor carries compares equal
+        closeness = cast(func.similarity(column, q), DOUBLE_PRECISION)
+    else:
+        closeness = cast(len(q), DOUBLE_PRECISION) / func.greatest(func.char_length(column), 1, type_=DOUBLE_PRECISION)
+    return cast(case(
+        (func.lower(column) == func.lower(q), 2.0),
+        (column.ilike(f"{like_pattern(q)}%"), 1.0),
+        else_=0.0
+    ), DOUBLE_PRECISION) + closeness
@@ -0,0 +1,28 @@
+"""
+Tag filters shared by the map, restaurant and diary listings.
+
+Map.tags and Diary.items have GIN indexes, so both modes are index scans:
+- any: the row has at least one of the tags (&&)
+- all: the row has every tag (@>)
+Restaurants have no tags of their own; they match through the items of their diaries.
+"""
+from sqlalchemy import String, exists, select, type_coerce
+from sqlalchemy.dialects.postgresql import ARRAY
+from app.models.dbModel import Diary, Restaurant
+
+TAG_MODES = ["any", "all"]
+
+def parse_tags(tags: list[str] | None) -> list[str]:
+    """Accept both repeated ?tags=a&tags=b and comma separated ?tags=a,b."""
+    if not tags:
+        return []
+    return list(dict.fromkeys(tag.strip() for value in tags for tag in value.split(",") if tag.strip()))
+
+def tag_filter(column, tags: list[str], mode: str = "any"):
+    # The models declare the generic ARRAY, which lacks the PostgreSQL containment operators
+    column = type_coerce(column, ARRAY(String))
+    return column.contains(tags) if mode == "all" else column.overlap(tags)
+
+def restaurant_tag_filter(tags: list[str], mode: str = "any"):
+    """Restaurants with a diary whose items match the tags."""
+    return exists(select(Diary.diary_id).where(Diary.rest_id == Restaurant.google_place_id, tag_filter(Diary.items, tags, mode)))
@@ -5,13 +5,15 @@ from app.models.dbModel import User, Map, Restaurant, Diary, UserMapCollect, Use
 from app.schemas.maps import SimplifiedMap
 from app.schemas.diaries import SimplifiedDiary
 from app.schemas.restaurants import SimplifiedRestaurant
+from app.core.search import name_match
+from app.crud.flags import RESTAURANT_FLAGS, resolve_flags
 
 def get_user_map(db:Session, user_id:int, orderBy:str, offset:int, limit:int, q: str) -> list[SimplifiedMap]:
     maps = db.query(UserMapCollect).filter(UserMapCollect.user_id == user_id).all()
     map_ids = list(map(lambda x: x.map_id, maps))
     query = db.query(Map).filter(Map.map_id.in_(map_ids))
     if q != "":
-        query = query.filter(Map.map_name.ilike(f"%{q}%"))
+        query = query.filter(name_match(Map.map_name, q))
     if orderBy == "created":
         query = query.order_by(Map.created.desc())
     query = query.offset(offset).limit(limit)
@@ -40,11 +42,12 @@ def get_user_rest(db:Session, user_id:int, orderBy:str, offset:int, limit:int, q
     rest_ids = list(map(lambda x: x.rest_id, rests))
     query = db.query(Restaurant).filter(Restaurant.google_place_id.in_(rest_ids))
     if q != "":
-        query = query.filter(Restaurant.rest_name.ilike(f"%{q}%"))
+        query = query.filter(name_match(Restaurant.rest_name, q))
     if orderBy == "created":
         query = query.order_by(Restaurant.created.desc())
     query = query.offset(offset).limit(limit)
     rest_collections = query.all()
+    flags = resolve_flags(db, RESTAURANT_FLAGS, user_id, [rest_instance.google_place_id for rest_instance in rest_collections])
     simplified_rests = [
         SimplifiedRestaurant(
             name=rest_instance.rest_name,
@@ -52,12 +55,10 @@ def get_user_rest(db:Session, user_id:int, orderBy:str, offset:int, limit:int, q
             rating=rest_instance.rating,
             placeId=rest_instance.google_place_id,
             viewCount=rest_instance.view_cnt,
-            collectCount=db.query(UserRestCollect).filter(UserRestCollect.rest_id == rest_instance.google_place_id).count(),
-            likeCount=db.query(UserRestLike).filter(UserRestLike.rest_id == rest_instance.google_place_id).count(),
-            dislikeCount=db.query(UserRestDislike).filter(UserRestDislike.rest_id == rest_instance.google_place_id).count(),
-            hasCollected=True,
-            hasLiked=db.query(UserRestLike).filter(UserRestLike.user_id == user_id).first() is not None,
-            hasDisliked=db.query(UserRestDislike).filter(UserRestDislike.user_id == user_id).first() is not None,
+            collectCount=rest_instance.collect_cnt,
+            likeCount=rest_instance.like_cnt,
+            dislikeCount=rest_instance.dislike_cnt,
+            **flags[rest_instance.google_place_id],
         )
         for rest_instance in rest_collections
     ]
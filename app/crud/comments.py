@@ -1,10 +1,12 @@
 from sqlalchemy.orm import Session
 from app.models.dbModel import Comment
 from app.schemas.comments import CommentCreate, CommentUpdate, NewComment, CommentResponse
+from app.crud.stale import DIARY, mark_stale
 
 def create_comment(db: Session, user_id: int, comment_data: CommentCreate) -> NewComment:
     db_comment = Comment(author=user_id, diary_id=comment_data.diaryId, content=comment_data.content)
     db.add(db_comment)
+    mark_stale(db, DIARY, comment_data.diaryId)
     db.commit()
     db.refresh(db_comment)
     return NewComment(id=db_comment.comment_id)
@@ -12,6 +14,7 @@ def create_comment(db: Session, user_id: int, comment_data: CommentCreate) -> Ne
 def update_comment(db: Session, user_id: int, comment_id: int, comment_data: CommentUpdate) -> NewComment:
     comment = db.query(Comment).filter(Comment.comment_id == comment_id).first()
     if comment:
+        mark_stale(db, DIARY, comment.diary_id, comment_data.diaryId)
         setattr(comment, "diary_id", comment_data.diaryId)
         setattr(comment, "content", comment_data.content)
         db.commit()
@@ -22,5 +25,6 @@ def delete_comment(db: Session, user_id: int, comment_id: int) -> CommentRespons
     comment = db.query(Comment).filter(Comment.comment_id == comment_id).first()
     if comment:
         db.delete(comment)
+        mark_stale(db, DIARY, comment.diary_id)
         db.commit()
     return CommentResponse(success=True, message=f"User {user_id} deleted comment {comment_id}")
\ No newline at end of file
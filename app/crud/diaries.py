@@ -1,55 +1,117 @@
 from sqlalchemy.orm import Session, aliased
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy import desc, asc, select, func, select, distinct, exists
 from app.models.dbModel import Diary, UserDiaryCollect, UserDiaryLike, Restaurant, UserFollow, User, Comment
-from app.schemas.diaries import DiaryCreate, DiaryUpdate, SimplifiedDiary, DiaryDisplay, Reply
+from app.schemas.diaries import DiaryCreate, DiaryUpdate, SimplifiedDiary, DiaryDisplay
 from sqlalchemy.sql import text
-from typing import List
+from typing import Iterator, List
+from datetime import datetime
 from fastapi import HTTPException
+from app.core.pagination import keyset, next_cursor
+from app.core.search import name_match, relevance
+from app.core.tags import tag_filter
+from app.crud.flags import DIARY_FLAGS, resolve_flags
+from app.crud.follow import follower_ids
+from app.crud.stale import DIARY, RESTAURANT, mark_stale, on_commit
+from app.services import timeline
+
+def filter_diaries(
+    stmt,
+    auth_user_id: int = -1,
+    following: bool = False,
+    q: str = None,
+    author_id: int = None,
+    tags: list[str] = None,
+    tag_mode: str = "any"
+):
+    """The listing filters; q needs stmt to be joined to restaurants."""
+    if following:
+        stmt = stmt.join(UserFollow, UserFollow.be_followed == Diary.user_id) \
+        .where(UserFollow.follow == auth_user_id)
+    
+    if author_id:
+        stmt = stmt.where(Diary.user_id == author_id)
+
+    if tags:
+        stmt = stmt.where(tag_filter(Diary.items, tags, tag_mode))
+
+    if q:
+        stmt = stmt.where(name_match(Restaurant.rest_name, q))
+    return stmt
 
 def simplified_query(
     auth_user_id: int = -1, 
     order_by: str = None, 
     following: bool = False, 
     q: str = None,
-    author_id: int = None
+    author_id: int = None,
+    cursor: str = None,
+    tags: list[str] = None,
+    tag_mode: str = "any"
 ):
     stmt = select(
         Diary.diary_id.label('id'),
         Restaurant.rest_name.label('restaurantName'),
         Diary.photos[1].label('imageUrl'),
     ).outerjoin(Restaurant, Restaurant.google_place_id == Diary.rest_id)
+    stmt = filter_diaries(stmt, auth_user_id, following, q, author_id, tags, tag_mode)
 
-    if following:
-        stmt = stmt.join(UserFollow, UserFollow.be_followed == Diary.user_id) \
-        .where(UserFollow.follow == auth_user_id)
-    
-    if author_id:
-        stmt = stmt.where(Diary.user_id == author_id)
-
-    if order_by == "collectCount":
-        stmt = stmt.outerjoin(UserDiaryCollect, UserDiaryCollect.diary_id == Diary.diary_id) \
-            .order_by(func.count(distinct(UserDiaryCollect.user_id)).desc())
+    if order_by == "relevance" and q:
+        stmt = keyset(stmt, order_by, relevance(Restaurant.rest_name, q), Diary.diary_id, cursor=cursor)
+    elif order_by == "collectCount":
+        stmt = stmt.outerjoin(UserDiaryCollect, UserDiaryCollect.diary_id == Diary.diary_id)
+        stmt = keyset(stmt, order_by, func.count(distinct(UserDiaryCollect.user_id)), Diary.diary_id, cursor=cursor, aggregate=True)
     elif order_by == "createTime":
-        stmt = stmt.order_by(Diary.created.desc())
-
-    if q:
-        stmt = stmt.where(Restaurant.rest_name.like(f"%{q}%"))
+        stmt = keyset(stmt, order_by, Diary.created, Diary.diary_id, cursor=cursor)
     
     stmt = stmt.group_by(Diary.diary_id, Restaurant.rest_name)
     return stmt
 
-def get_diaries(db: Session, user_id: int, query: dict) -> List[SimplifiedDiary]:
-    stmt = simplified_query(
+def listing_query(user_id: int, query: dict):
+    return simplified_query(
         auth_user_id=user_id, 
         order_by=query["orderBy"], 
         following=query["following"],
-        q=query["q"]
+        q=query["q"],
+        cursor=query.get("cursor"),
+        tags=query.get("tags"),
+        tag_mode=query.get("tagMode", "any")
     )
+
+def get_diaries(db: Session, user_id: int, query: dict) -> tuple[List[SimplifiedDiary], str]:
+    """One page of diaries, by keyset when a cursor is given and by OFFSET otherwise."""
+    limit = query["limit"]
+    stmt = listing_query(user_id, query).limit(limit)
+    if not query.get("cursor"):
+        stmt = stmt.offset(query["offset"])
     result = db.execute(stmt).all()
     diaries = [SimplifiedDiary(**diary._asdict()) for diary in result]
-    offset = query["offset"]
-    limit = query["limit"]
-    return len(diaries), diaries[offset:offset+limit]
+    return diaries, next_cursor(result, limit, query["orderBy"])
+
+def count_diaries(db: Session, user_id: int, query: dict) -> int:
+    stmt = select(func.count(Diary.diary_id))
+    if query["q"]:
+        stmt = stmt.join(Restaurant, Restaurant.google_place_id == Diary.rest_id)
+    stmt = filter_diaries(
+        stmt, user_id, query["following"], query["q"], tags=query.get("tags"), tag_mode=query.get("tagMode", "any")
+    )
+    return db.execute(stmt).scalar()
+
+def stream_diaries(db: Session, user_id: int, query: dict, batch_size: int = 1000) -> Iterator[SimplifiedDiary]:
+    """
+    Every diary of a listing, in order, for batch consumers. Rows are fetched from a
+    server-side cursor batch_size at a time, so memory stays bounded.
+    """
+    stmt = listing_query(user_id, {**query, "cursor": None}).execution_options(yield_per=batch_size)
+    for diary in db.execute(stmt):
+        yield SimplifiedDiary(**diary._asdict())
+
+def get_diaries_by_ids(db: Session, ids: list[int], limit: int) -> tuple[List[SimplifiedDiary], str]:
+    """A createTime page of the given diaries, e.g. a timeline page; its cursor continues in SQL."""
+    stmt = simplified_query(order_by="createTime").where(Diary.diary_id.in_(ids))
+    result = db.execute(stmt).all()
+    diaries = [SimplifiedDiary(**diary._asdict()) for diary in result]
+    return diaries, next_cursor(result, limit, "createTime")
 
 def create_diary(db: Session, diary: DiaryCreate, user_id: int) -> Diary:
     if not diary.photos:
@@ -62,61 +124,64 @@ def create_diary(db: Session, diary: DiaryCreate, user_id: int) -> Diary:
         photos=diary.photos
     )
     db.add(db_diary)
+    db.flush()
+    mark_stale(db, RESTAURANT, diary.restaurantId)
+    on_commit(db, timeline.fan_out, user_id, follower_ids(db, user_id), db_diary.diary_id, db_diary.created)
     db.commit()
     db.refresh(db_diary)
     return db_diary
 
-def full_query(diary_id: int, auth_user_id: int):
-    Favorites = aliased(UserDiaryLike)
-    Collects = aliased(UserDiaryCollect)
+def reply_list(diary_id):
+    """The diary's replies as one JSON array, oldest first."""
+    Author = aliased(User)
+    reply = func.json_build_object(
+        'id', Comment.comment_id,
+        'authorId', Comment.author,
+        'username', Author.user_name,
+        'avatarUrl', func.coalesce(Author.avatar_url, ''),
+        'content', Comment.content,
+        'createdAt', Comment.created
+    )
+    return select(
+        func.coalesce(func.json_agg(aggregate_order_by(reply, Comment.created, Comment.comment_id)), text("'[]'::json"))
+    ).join(Author, Author.user_id == Comment.author) \
+     .where(Comment.diary_id == diary_id) \
+     .correlate(Diary) \
+     .scalar_subquery()
 
+def full_query(diary_id: int):
+    """The whole diary detail in one statement: counts and replies come from correlated subqueries, not joins."""
+    fav_count = select(func.count()).where(UserDiaryLike.diary_id == Diary.diary_id).scalar_subquery()
+    collect_count = select(func.count()).where(UserDiaryCollect.diary_id == Diary.diary_id).scalar_subquery()
     stmt = select(
         Diary.diary_id.label('id'),
         User.user_name.label('username'),
         Diary.user_id.label('userId'),
         Diary.rest_id.label('restaurantId'),
         Restaurant.rest_name.label('restaurantName'),
-        User.avatar_url.label('avatarUrl'),
+        func.coalesce(User.avatar_url, '').label('avatarUrl'),
         Diary.photos,
         Diary.items,
         Diary.content,
         Diary.created.label('createdAt'),
-        func.count(Favorites.user_id).label('favCount'),
-        func.count(Collects.user_id).label('collectCount'),
-        exists(select(1).where(UserDiaryCollect.user_id == auth_user_id, UserDiaryCollect.diary_id == Diary.diary_id)).label('hasCollected'),
-        exists(select(1).where(UserDiaryLike.user_id == auth_user_id, UserDiaryLike.diary_id == Diary.diary_id)).label('hasFavorited')    
-    ).outerjoin(Collects, Collects.diary_id == Diary.diary_id) \
-     .outerjoin(Favorites, Favorites.diary_id == Diary.diary_id) \
-     .outerjoin(Restaurant, Restaurant.google_place_id == Diary.rest_id) \
+        fav_count.label('favCount'),
+        collect_count.label('collectCount'),
+        reply_list(Diary.diary_id).label('replies')
+    ).outerjoin(Restaurant, Restaurant.google_place_id == Diary.rest_id) \
      .outerjoin(User, User.user_id == Diary.user_id) \
-     .group_by(Diary.diary_id, User.user_name, User.avatar_url, Restaurant.rest_name) \
      .where(Diary.diary_id == diary_id)
     return stmt
 
-def get_replies_query(diary_id: int):
-    stmt = select(
-        Comment.comment_id.label('id'),
-        Comment.author.label('authorId'),
-        User.user_name.label('username'),
-        User.avatar_url.label('avatarUrl'),
-        Comment.content,
-        Comment.created.label('createdAt')
-    ).join(User, User.user_id == Comment.author) \
-     .where(Comment.diary_id == diary_id)
-    return stmt
-
-def get_diary(db: Session, diary_id: int, auth_user_id: int) -> DiaryDisplay:
-    stmt = full_query(diary_id, auth_user_id)
-    result = db.execute(stmt).first()
+def get_diary_detail(db: Session, diary_id: int) -> DiaryDisplay:
+    """The user-independent part of a diary; every flag is False."""
+    result = db.execute(full_query(diary_id)).first()
     if not result:
         raise HTTPException(status_code=404, detail=f"Diary with id {diary_id} not found")
-    replies_stmt = get_replies_query(diary_id)
-    replies = db.execute(replies_stmt).all()
-    replies = [Reply(**{**reply._asdict(), 'avatarUrl': reply.avatarUrl or ''}) for reply in replies]
-    print(result._asdict())
-    diary = DiaryDisplay(**{**result._asdict(), 'avatarUrl': result.avatarUrl or ''})
-    diary.replies = replies
-    return diary
+    return DiaryDisplay(**result._asdict(), hasFavorited=False, hasCollected=False)
+
+def get_diary(db: Session, diary_id: int, auth_user_id: int) -> DiaryDisplay:
+    diary = get_diary_detail(db, diary_id)
+    return diary.model_copy(update=resolve_flags(db, DIARY_FLAGS, auth_user_id, [diary.id])[diary.id])
 
 def update_diary(db: Session, diary_id: int, user_id: int, updates: DiaryUpdate) -> Diary:
     diary = db.query(Diary).filter(Diary.diary_id == diary_id).first()
@@ -134,6 +199,8 @@ def update_diary(db: Session, diary_id: int, user_id: int, updates: DiaryUpdate)
     if diary:
         for key, value in upd_dict.items():
             setattr(diary, key, value)
+        mark_stale(db, DIARY, diary_id)
+        mark_stale(db, RESTAURANT, diary.rest_id)
         db.commit()
         db.refresh(diary)
     return diary
@@ -144,7 +211,11 @@ def delete_diary(db: Session, diary_id: int, user_id: int):
     #     raise HTTPException(status_code=403, detail="You are not authorized to delete this diary")
     if diary:
         db.delete(diary)
+        mark_stale(db, DIARY, diary_id)
+        mark_stale(db, RESTAURANT, diary.rest_id)
+        on_commit(db, timeline.retract, follower_ids(db, diary.user_id), diary_id)
         db.commit()
+    return diary
 
 def collect_diary(db: Session, user_id: int, diary_id: int) -> UserDiaryCollect:
     collection = db.query(UserDiaryCollect).filter(UserDiaryCollect.user_id == user_id, UserDiaryCollect.diary_id == diary_id).first()
@@ -152,6 +223,7 @@ def collect_diary(db: Session, user_id: int, diary_id: int) -> UserDiaryCollect:
         return collection
     collection = UserDiaryCollect(user_id=user_id, diary_id=diary_id)
     db.add(collection)
+    mark_stale(db, DIARY, diary_id)
     db.commit()
     return collection
 
@@ -159,6 +231,7 @@ def uncollect_diary(db: Session, user_id: int, diary_id: int):
     collection = db.query(UserDiaryCollect).filter(UserDiaryCollect.user_id == user_id, UserDiaryCollect.diary_id == diary_id).first()
     if collection:
         db.delete(collection)
+        mark_stale(db, DIARY, diary_id)
         db.commit()
 
 def favorite_diary(db: Session, user_id: int, diary_id: int) -> UserDiaryLike:
@@ -167,6 +240,7 @@ def favorite_diary(db: Session, user_id: int, diary_id: int) -> UserDiaryLike:
         return like
     like = UserDiaryLike(user_id=user_id, diary_id=diary_id)
     db.add(like)
+    mark_stale(db, DIARY, diary_id)
     db.commit()
     return like
 
@@ -174,6 +248,7 @@ def unfavorite_diary(db: Session, user_id: int, diary_id: int):
     like = db.query(UserDiaryLike).filter(UserDiaryLike.user_id == user_id, UserDiaryLike.diary_id == diary_id).first()
     if like:
         db.delete(like)
+        mark_stale(db, DIARY, diary_id)
         db.commit()
 
 def recommend_diary(db: Session, user_id: int):
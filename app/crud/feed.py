@@ -0,0 +1,28 @@
+"""
+Queries behind the following feed (app.services.timeline). Kept apart from
+app.crud.diaries and app.crud.follow, whose writes update the timelines on commit.
+"""
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.models.dbModel import Diary, UserFollow
+
+def author_diaries(db: Session, author_id: int, limit: int) -> list[tuple[int, datetime]]:
+    """(id, created) of an author's newest diaries."""
+    stmt = select(Diary.diary_id, Diary.created).where(Diary.user_id == author_id) \
+        .order_by(Diary.created.desc(), Diary.diary_id.desc()).limit(limit)
+    return [tuple(row) for row in db.execute(stmt)]
+
+def followed_diaries(
+    db: Session, user_id: int, limit: int, only: list[int] = None, exclude: list[int] = None
+) -> list[tuple[int, datetime]]:
+    """(id, created) of the newest diaries by the users user_id follows, limited to or excluding some authors."""
+    stmt = select(Diary.diary_id, Diary.created) \
+        .join(UserFollow, UserFollow.be_followed == Diary.user_id) \
+        .where(UserFollow.follow == user_id)
+    if only is not None:
+        stmt = stmt.where(Diary.user_id.in_(only))
+    if exclude:
+        stmt = stmt.where(Diary.user_id.not_in(exclude))
+    stmt = stmt.order_by(Diary.created.desc(), Diary.diary_id.desc()).limit(limit)
+    return [tuple(row) for row in db.execute(stmt)]
@@ -0,0 +1,48 @@
+"""
+Per-user interaction flags (hasCollected, hasLiked, ...) for a page of results.
+
+Listing queries select only user-independent columns; the flags of the whole page
+are then resolved in one query over the relation tables and merged into the rows.
+Anonymous requests never touch the database here: every flag is False.
+"""
+from sqlalchemy import literal, select, union_all
+from sqlalchemy.orm import Session
+from app.models.dbModel import (
+    UserRestCollect, UserRestLike, UserRestDislike, UserMapCollect, UserDiaryCollect, UserDiaryLike, UserFollow
+)
+
+# flag name -> (user column, target column) of the relation table
+RESTAURANT_FLAGS = {
+    "hasCollected": (UserRestCollect.user_id, UserRestCollect.rest_id),
+    "hasLiked": (UserRestLike.user_id, UserRestLike.rest_id),
+    "hasDisliked": (UserRestDislike.user_id, UserRestDislike.rest_id),
+}
+MAP_FLAGS = {
+    "hasCollected": (UserMapCollect.user_id, UserMapCollect.map_id),
+}
+DIARY_FLAGS = {
+    "hasCollected": (UserDiaryCollect.user_id, UserDiaryCollect.diary_id),
+    "hasFavorited": (UserDiaryLike.user_id, UserDiaryLike.diary_id),
+}
+USER_FLAGS = {
+    "isFollowing": (UserFollow.follow, UserFollow.be_followed),
+}
+
+def resolve_flags(db: Session, flags: dict, user_id: int, ids: list) -> dict:
+    """Map each id to its {flag: bool}, with one query for all flags and ids."""
+    resolved = {id_: dict.fromkeys(flags, False) for id_ in ids}
+    if user_id is None or user_id == -1 or not resolved:
+        return resolved
+    stmt = union_all(*(
+        select(literal(flag).label('flag'), target.label('target')).where(user == user_id, target.in_(list(resolved)))
+        for flag, (user, target) in flags.items()
+    ))
+    for flag, target in db.execute(stmt).all():
+        resolved[target][flag] = True
+    return resolved
+
+def merge_flags(db: Session, flags: dict, user_id: int, rows, id_field: str) -> list[dict]:
+    """The rows as dicts, each with the user's flags added."""
+    rows = [row._asdict() for row in rows]
+    resolved = resolve_flags(db, flags, user_id, [row[id_field] for row in rows])
+    return [{**row, **resolved[row[id_field]]} for row in rows]
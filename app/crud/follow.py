@@ -1,6 +1,10 @@
 from sqlalchemy.orm import Session
+from sqlalchemy import select
 from app.models.dbModel import UserFollow
 from fastapi import HTTPException
+from app.crud.feed import author_diaries
+from app.crud.stale import on_commit
+from app.services import timeline
 
 def create_follow(db: Session, follower: int, followee: int) -> UserFollow:
     db_follow = db.query(UserFollow).filter(UserFollow.follow == follower, UserFollow.be_followed == followee).first()
@@ -8,6 +12,7 @@ def create_follow(db: Session, follower: int, followee: int) -> UserFollow:
         return db_follow
     db_follow = UserFollow(follow=follower, be_followed=followee)
     db.add(db_follow)
+    on_commit(db, timeline.backfill, follower, followee, author_diaries(db, followee, timeline.TIMELINE_SIZE))
     db.commit()
     db.refresh(db_follow)
     return db_follow
@@ -18,6 +23,10 @@ def delete_follow(db: Session, follower: int, followee: int) -> UserFollow:
         raise HTTPException(status_code=404, detail=f"You are not following user {followee}")
     if db_follow:
         db.delete(db_follow)
+        on_commit(db, timeline.prune, follower, author_diaries(db, followee, timeline.TIMELINE_SIZE))
         db.commit()
     
     return db_follow 
+
+def follower_ids(db: Session, user_id: int) -> list[int]:
+    return list(db.execute(select(UserFollow.follow).where(UserFollow.be_followed == user_id)).scalars())
@@ -5,14 +5,29 @@ from app.schemas.maps import (
     SimplifiedMap, 
     CompleteMap, 
 )
-from sqlalchemy import func, select, and_, literal, distinct, exists, any_
+from sqlalchemy import func, select, and_, literal, distinct, exists, delete, update, values, column, Integer
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session, aliased
-from app.models.dbModel import User, Restaurant, UserRestCollect, UserRestLike, UserRestDislike, UserMapCollect
+from app.models.dbModel import User, Restaurant, UserRestCollect, UserRestLike, UserRestDislike, UserMapCollect, MapRestaurant
 from app.schemas.restaurants import SimplifiedRestaurant
 from app.schemas.users import UserLoginInfo
 from fastapi.exceptions import HTTPException
+from app.core.pagination import keyset, next_cursor, sort_tag
+from app.core import search
+from app.core.tags import tag_filter, restaurant_tag_filter
+from app.crud.restaurants import location_columns, bbox_filter, update_map_extent
+from app.crud.flags import MAP_FLAGS, RESTAURANT_FLAGS, merge_flags
 
-def query_sql(map_id = None, auth_user_id: int = -1, name_match: str = None, order_by: str = None):
+# orderBy -> (sort column, descending) of a map's restaurants; the place id breaks ties
+MAP_RESTAURANT_SORT_KEYS = {
+    "favCount": (Restaurant.collect_cnt, True),
+    "collectCount": (Restaurant.collect_cnt, True),
+    "createTime": (MapRestaurant.added_at, True),
+    "rating": (Restaurant.rating, True),
+    "name": (Restaurant.rest_name, False),
+}
+
+def query_sql(map_id = None, name_match: str = None, order_by: str = None, cursor: str = None, reverse: bool = False, tags: list[str] = None, tag_mode: str = "any"):
     Collect = aliased(UserMapCollect)
     stmt = select(
         Map.map_id.label('id'),
@@ -23,66 +38,103 @@ def query_sql(map_id = None, auth_user_id: int = -1, name_match: str = None, ord
         Map.view_cnt.label('viewCount'),
         Map.description,
         func.count(distinct(Collect.user_id)).label('collectCount'),
-        exists(
-            select(1).where(
-                UserMapCollect.user_id == auth_user_id, UserMapCollect.map_id == Map.map_id
-            )
-        ).label('hasCollected'),
-        func.json_build_object('lat', func.avg(Restaurant.lat), 'lng', func.avg(Restaurant.lng)).label('center')
+        func.json_build_object('lat', Map.lat, 'lng', Map.lng).label('center')
     ).outerjoin(User, Map.author == User.user_id) \
-    .outerjoin(Collect, Collect.map_id == Map.map_id) \
-    .outerjoin(Restaurant, Restaurant.google_place_id == any_(Map.rest_ids))
+    .outerjoin(Collect, Collect.map_id == Map.map_id)
 
     if map_id is not None:
         stmt = stmt.where(Map.map_id == map_id)
 
     if name_match:
-        stmt = stmt.where(User.user_name.like(f"%{name_match}%"))
+        stmt = stmt.where(search.name_match(User.user_name, name_match))
+
+    if tags:
+        stmt = stmt.where(tag_filter(Map.tags, tags, tag_mode))
     
     stmt = stmt.group_by(Map.map_id, User.user_name)
-    if order_by:
-        if order_by == "collectCount":
-            stmt = stmt.order_by(func.count(distinct(Collect.user_id)).desc())
-        elif order_by == "createTime":
-            stmt = stmt.order_by(Map.created.desc())
+    tag, descending = sort_tag(order_by, reverse), not reverse
+    if order_by == "relevance" and name_match:
+        stmt = keyset(stmt, tag, search.relevance(User.user_name, name_match), Map.map_id, descending, cursor)
+    elif order_by in ("collectCount", "favCount", "trending"):
+        stmt = keyset(stmt, tag, func.count(distinct(Collect.user_id)), Map.map_id, descending, cursor, aggregate=True)
+    elif order_by == "createTime":
+        stmt = keyset(stmt, tag, Map.created, Map.map_id, descending, cursor)
     return stmt
 
+def count_maps(db: Session, name_match: str = None, tags: list[str] = None, tag_mode: str = "any") -> int:
+    stmt = select(func.count(Map.map_id))
+    if name_match:
+        stmt = stmt.join(User, Map.author == User.user_id).where(search.name_match(User.user_name, name_match))
+    if tags:
+        stmt = stmt.where(tag_filter(Map.tags, tags, tag_mode))
+    return db.execute(stmt).scalar()
+
 
 def get_map(db: Session, map_id: int, auth_user_id: int) -> Map:
-    stmt = query_sql(map_id=map_id, auth_user_id=auth_user_id)
+    stmt = query_sql(map_id=map_id)
     result = db.execute(stmt).first()
     if not result:
         return None
     map = CompleteMap(
-        **{k: v for k, v in result._asdict().items() 
+        **{k: v for k, v in merge_flags(db, MAP_FLAGS, auth_user_id, [result], 'id')[0].items()
             if k != 'iconUrl' or v is not None
         }
     )
     return map
 
-def get_maps(db: Session, query: dict) -> list[Map]:
-    stmt = query_sql(auth_user_id=query["auth_user_id"], name_match=query["q"], order_by=query["orderBy"]).limit(query["limit"]).offset(query["offset"])
+def get_maps(db: Session, query: dict) -> tuple[int, list[SimplifiedMap], str]:
+    """
+    One page of maps and the total number of matching maps. In offset mode the total
+    comes with the page as a window count; a cursor page needs a separate count,
+    since the seek condition filters out the rows before the cursor.
+    """
+    cursor = query.get("cursor")
+    reverse = query.get("reverse", False)
+    tags, tag_mode = query.get("tags"), query.get("tagMode", "any")
+    stmt = query_sql(
+        name_match=query["q"], order_by=query["orderBy"], cursor=cursor, reverse=reverse, tags=tags, tag_mode=tag_mode
+    ).limit(query["limit"])
+    if not cursor:
+        stmt = stmt.add_columns(func.count().over().label('total')).offset(query["offset"])
     result = db.execute(stmt).all()
+    total = result[0].total if result and not cursor else count_maps(db, query["q"], tags, tag_mode)
+    maps = simplified_maps(db, result, query["auth_user_id"])
+    return total, maps, next_cursor(result, query["limit"], sort_tag(query["orderBy"], reverse))
+
+def get_maps_by_ids(db: Session, map_ids: list[int], query: dict) -> tuple[list[SimplifiedMap], str]:
+    """Maps by primary key in the order of map_ids, e.g. a leaderboard page, with the cursor past them."""
+    result = db.execute(query_sql(order_by=query["orderBy"]).where(Map.map_id.in_(map_ids))).all()
+    order = {map_id: i for i, map_id in enumerate(map_ids)}
+    result.sort(key=lambda row: order[row.id])
+    return simplified_maps(db, result, query["auth_user_id"]), next_cursor(result, query["limit"], query["orderBy"])
+
+def simplified_maps(db: Session, result, auth_user_id: int) -> list[SimplifiedMap]:
     return [
         SimplifiedMap(
-            **{k: v for k, v in map_._asdict().items() 
+            **{k: v for k, v in map_.items()
                 if k != 'iconUrl' or v is not None
             }
         ) 
-        for map_ in result
+        for map_ in merge_flags(db, MAP_FLAGS, auth_user_id, result, 'id')
     ]
 
+def collect_counts(db: Session) -> list[tuple[int, int]]:
+    """(map_id, collect count) of every map with at least one collect."""
+    stmt = select(UserMapCollect.map_id, func.count()).group_by(UserMapCollect.map_id)
+    return [tuple(row) for row in db.execute(stmt).all()]
+
 def create_map(db: Session, map_data: MapCreate, user: UserLoginInfo) -> Map:
     db_map = Map(
         map_name=map_data.name,
         icon_url=map_data.iconUrl,
         author=user.userId,  
         tags=map_data.tags,
-        rest_ids=map_data.restaurants,
         description=map_data.description
     )
     try:
         db.add(db_map)
+        db.flush()
+        set_map_restaurants(db, db_map.map_id, map_data.restaurants)
         db.commit()
         db.refresh(db_map)
         return db_map.map_id
@@ -91,6 +143,9 @@ def create_map(db: Session, map_data: MapCreate, user: UserLoginInfo) -> Map:
         raise HTTPException(status_code=500, detail=f"Failed to create map{e}")
 
 def update_map(db: Session, map_id: int, updates: dict, user_id: int) -> Map:
+    """Apply column updates to a map; the "restaurants" key replaces its list of place ids."""
+    updates = dict(updates)
+    restaurants = updates.pop("restaurants", None)
     map_obj = db.query(Map).filter(Map.map_id == map_id).first()
     if not map_obj:
         raise HTTPException(status_code=404, detail=f"Map with id {map_id} not found")
@@ -102,6 +157,8 @@ def update_map(db: Session, map_id: int, updates: dict, user_id: int) -> Map:
         else:
             raise HTTPException(status_code=400, detail=f"Invalid key {key}")
     try:
+        if restaurants is not None:
+            set_map_restaurants(db, map_id, restaurants)
         db.commit()
     except Exception as e:
         db.rollback()
@@ -111,6 +168,25 @@ def update_map(db: Session, map_id: int, updates: dict, user_id: int) -> Map:
 
     return map_obj
 
+def set_map_restaurants(db: Session, map_id: int, place_ids: list[str]):
+    """Make place_ids, in this order, the restaurants of a map; places already on it keep their added_at."""
+    place_ids = list(dict.fromkeys(place_ids))
+    db.execute(delete(MapRestaurant).where(MapRestaurant.map_id == map_id, MapRestaurant.place_id.not_in(place_ids)))
+    if place_ids:
+        stmt = insert(MapRestaurant).values([
+            {"map_id": map_id, "place_id": place_id, "position": position}
+            for position, place_id in enumerate(place_ids)
+        ])
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[MapRestaurant.map_id, MapRestaurant.place_id],
+            set_={"position": stmt.excluded.position}
+        ))
+    update_map_extent(db, map_id)
+
+def map_place_ids(db: Session, map_id: int) -> list[str]:
+    stmt = select(MapRestaurant.place_id).where(MapRestaurant.map_id == map_id).order_by(MapRestaurant.position, MapRestaurant.added_at)
+    return db.execute(stmt).scalars().all()
+
 def delete_map(db: Session, map_id: int):
     map_obj = db.query(Map).filter(Map.map_id == map_id).first()
     if map_obj != None:
@@ -119,75 +195,103 @@ def delete_map(db: Session, map_id: int):
         return True
     return False
 
+def add_view_counts(db: Session, deltas: dict[int, int]) -> int:
+    """Add buffered view deltas ({map_id: views}) to view_cnt in one statement."""
+    if not deltas:
+        return 0
+    views = values(column('map_id', Integer), column('delta', Integer), name='views').data(list(deltas.items()))
+    stmt = update(Map).where(Map.map_id == views.c.map_id).values(view_cnt=Map.view_cnt + views.c.delta)
+    result = db.execute(stmt)
+    db.commit()
+    return result.rowcount
+
 def get_maps_by_user(db: Session, user_id: int, skip: int = 0, limit: int = 100) -> list[Map]:
     return db.query(Map).filter(Map.author == user_id).offset(skip).limit(limit).all()
 
-def base_query(auth_user_id: int, map_id: int, order_by: str = None):
-    Collects = aliased(UserRestCollect)
-    Likes = aliased(UserRestLike)
-    Dislikes = aliased(UserRestDislike)
+def base_query(map_id: int, compact: bool = False):
     stmt = select(
         Restaurant.rest_name.label('name'),
-        func.json_build_object('lat', Restaurant.lat, 'lng', Restaurant.lng).label('location'),
+        *location_columns(compact),
         Restaurant.telephone,
         Restaurant.address,
         Restaurant.rating,
         Restaurant.google_place_id.label('placeId'),
         Restaurant.photo_url.label('photoUrl'),
-        literal(0).label('viewCount'), 
-        func.count(distinct(Collects.user_id)).label('collectCount'),
-        func.count(distinct(Likes.user_id)).label('likeCount'),
-        func.count(distinct(Dislikes.user_id)).label('dislikeCount'),
-        exists(
-            select(1).where(
-                UserRestCollect.user_id == auth_user_id, UserRestCollect.rest_id == Restaurant.google_place_id
-            )
-        ).label('hasCollected'),
-        exists(select(1).where(and_(UserRestLike.user_id == auth_user_id, UserRestLike.rest_id == Restaurant.google_place_id))).label('hasLiked'),
-        exists(select(1).where(and_(UserRestDislike.user_id == auth_user_id, UserRestDislike.rest_id == Restaurant.google_place_id))).label('hasDisliked')
+        Restaurant.view_cnt.label('viewCount'),
+        Restaurant.collect_cnt.label('collectCount'),
+        Restaurant.like_cnt.label('likeCount'),
+        Restaurant.dislike_cnt.label('dislikeCount')
     ).select_from(
-        Restaurant
+        MapRestaurant
     ).join(
-        Map, Map.map_id == map_id
+        Restaurant, Restaurant.google_place_id == MapRestaurant.place_id
     ).where(
-        Restaurant.google_place_id == any_(Map.rest_ids)  # Using the ANY function to filter by rest_ids array
-    ).outerjoin(Collects, Collects.rest_id == Restaurant.google_place_id) \
-     .outerjoin(Likes, Likes.rest_id == Restaurant.google_place_id) \
-     .outerjoin(Dislikes, Dislikes.rest_id == Restaurant.google_place_id) \
-     .group_by(Restaurant.google_place_id)
-    
-    if order_by:
-        if order_by == "rating":
-            stmt = stmt.order_by(Restaurant.rating.desc())
-        elif order_by == "name":
-            stmt = stmt.order_by(Restaurant.rest_name)
-        elif order_by == "collectCount":
-            stmt = stmt.order_by(func.count(distinct(Collects.user_id)).desc())
-
-    
+        MapRestaurant.map_id == map_id
+    )
     return stmt
 
 def get_restaurants(db: Session, map_id: int, query_params: dict):
+    """
+    One page of a map's restaurants, the number of matching restaurants and the next cursor.
+    Without an orderBy the restaurants come in the map's own order.
+    """
     order_by = query_params.get("orderBy")
+    offset = query_params.get("offset", 0)
+    limit = query_params.get("limit", 10)
+    cursor = query_params.get("cursor")
+    reverse = query_params.get("reverse", False)
     q = query_params.get("q")
     auth_user_id = query_params.get("auth_user_id", -1)
-    stmt = base_query(auth_user_id, map_id, order_by)
+    compact = query_params.get("compact", False)
+    tags = query_params.get("tags")
+    sw_lat = query_params.get("sw_lat")
+    sw_lng = query_params.get("sw_lng")
+    ne_lat = query_params.get("ne_lat")
+    ne_lng = query_params.get("ne_lng")
 
+    filters = []
+    if sw_lat is not None and sw_lng is not None and ne_lat is not None and ne_lng is not None:
+        filters.append(bbox_filter(sw_lat, sw_lng, ne_lat, ne_lng))
+    if tags:
+        filters.append(restaurant_tag_filter(tags, query_params.get("tagMode", "any")))
     if q:
-        stmt = stmt.where(Restaurant.rest_name.like(f"%{q}%"))
+        filters.append(search.name_match(Restaurant.rest_name, q))
+
+    if order_by == "relevance" and q:
+        sort_key, descending = search.relevance(Restaurant.rest_name, q), True
+    elif order_by in MAP_RESTAURANT_SORT_KEYS:
+        sort_key, descending = MAP_RESTAURANT_SORT_KEYS[order_by]
+    else:
+        order_by, sort_key, descending = "position", MapRestaurant.position, False
+    tag = sort_tag(order_by, reverse)
+    stmt = keyset(base_query(map_id, compact), tag, sort_key, MapRestaurant.place_id, descending != reverse, cursor)
+    if not cursor:
+        stmt = stmt.offset(offset)
+    results = db.execute(stmt.where(*filters).limit(limit)).all()
 
-    results = db.execute(stmt).all()
-    count = len(results)
-    restaurants = [SimplifiedRestaurant(**result._asdict()) for result in results]
-    return count, restaurants
+    count_query = select(func.count()).select_from(MapRestaurant) \
+        .join(Restaurant, Restaurant.google_place_id == MapRestaurant.place_id) \
+        .where(MapRestaurant.map_id == map_id, *filters)
+    count = db.execute(count_query).scalar()
+    rows = merge_flags(db, RESTAURANT_FLAGS, auth_user_id, results, 'placeId')
+    if compact:
+        return count, rows, next_cursor(results, limit, tag)
+    restaurants = [SimplifiedRestaurant(**row) for row in rows]
+    return count, restaurants, next_cursor(results, limit, tag)
 
-def collect_map(db: Session, user_id: int, map_id: int):
+def collect_map(db: Session, user_id: int, map_id: int) -> bool:
+    """Collect the map; True if it was not collected by the user before."""
+    if db.query(UserMapCollect).filter(UserMapCollect.user_id == user_id, UserMapCollect.map_id == map_id).first():
+        return False
     collection_entry = UserMapCollect(user_id=user_id, map_id=map_id)
     db.add(collection_entry)
     db.commit()
+    return True
 
-def uncollect_map(db: Session, user_id: int, map_id: str):
+def uncollect_map(db: Session, user_id: int, map_id: str) -> bool:
     collection_entry = db.query(UserMapCollect).filter(UserMapCollect.user_id == user_id, UserMapCollect.map_id == map_id).first()
     if collection_entry:
         db.delete(collection_entry)
         db.commit()
+        return True
+    return False
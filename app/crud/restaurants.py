@@ -1,91 +1,190 @@
+import math
 from sqlalchemy.orm import Session
-from sqlalchemy.dialects.postgresql import insert
-from app.models.dbModel import Restaurant, UserRestCollect, UserRestLike, UserRestDislike, Map, Diary
-from app.schemas.restaurants import CreateRestaurant, SimplifiedRestaurant, FullCreateRestaurant, Restaurant as ClientRestaurant
+from sqlalchemy.dialects.postgresql import insert, aggregate_order_by, ARRAY
+from app.models.dbModel import Restaurant, UserRestCollect, UserRestLike, UserRestDislike, Map, MapRestaurant, Diary
+from app.schemas.restaurants import CreateRestaurant, SimplifiedRestaurant, FullCreateRestaurant, Restaurant as ClientRestaurant, RestaurantCluster, ClusterRepresentative
 from app.schemas.diaries import SimplifiedDiary
-from sqlalchemy import func, select, and_, literal, distinct, exists
+from sqlalchemy import func, select, and_, or_, literal, literal_column, distinct, exists, update, delete, values, column, String, Float, Integer
 from sqlalchemy.orm import Session, aliased
+from app.core.geo import EARTH_RADIUS, tile_key, covering_ranges, radius_bbox
+from app.core.pagination import keyset, next_cursor, sort_tag
+from app.core.search import name_match, relevance
+from app.core.tags import restaurant_tag_filter
+from app.crud.flags import RESTAURANT_FLAGS, merge_flags, resolve_flags
+from app.crud.stale import RESTAURANT, mark_stale
 
-def base_query(auth_user_id: int, order_by: str = None):
-    Collects = aliased(UserRestCollect)
-    Likes = aliased(UserRestLike)
-    Dislikes = aliased(UserRestDislike)
+# orderBy -> (sort column, descending); the primary key is appended as tie-breaker.
+SORT_KEYS = {
+    "collectCount": (Restaurant.collect_cnt, True),
+    "trending": (Restaurant.collect_cnt, True),  # without the leaderboard (filtered listings)
+    "createTime": (Restaurant.created, True),
+    "rating": (Restaurant.rating, True),
+    "name": (Restaurant.rest_name, False),
+}
+
+def location_columns(compact: bool = False):
+    """The nested location object, or plain lat/lng columns for the compact encodings."""
+    if compact:
+        return [Restaurant.lat, Restaurant.lng]
+    return [func.json_build_object('lat', Restaurant.lat, 'lng', Restaurant.lng).label('location')]
+
+def base_query(order_by: str = None, cursor: str = None, compact: bool = False, reverse: bool = False):
+    """User-independent restaurant columns; the user's flags are merged in by app.crud.flags."""
     stmt = select(
         Restaurant.rest_name.label('name'),
-        func.json_build_object('lat', Restaurant.lat, 'lng', Restaurant.lng).label('location'),
+        *location_columns(compact),
         Restaurant.telephone,
         Restaurant.address,
         Restaurant.rating,
         Restaurant.google_place_id.label('placeId'),
         Restaurant.photo_url.label('photoUrl'),
-        literal(0).label('viewCount'), 
-        func.count(Collects.user_id).label('collectCount'),
-        func.count(Likes.user_id).label('likeCount'),
-        func.count(Dislikes.user_id).label('dislikeCount'),
-        exists(select(1).where(UserRestCollect.user_id == auth_user_id, UserRestCollect.rest_id == Restaurant.google_place_id)).label('hasCollected'),
-        exists(select(1).where(UserRestLike.user_id == auth_user_id, UserRestLike.rest_id == Restaurant.google_place_id)).label('hasLiked'),
-        exists(select(1).where(UserRestDislike.user_id == auth_user_id, UserRestDislike.rest_id == Restaurant.google_place_id)).label('hasDisliked')
-    ).outerjoin(Collects, Collects.rest_id == Restaurant.google_place_id) \
-     .outerjoin(Likes, Likes.rest_id == Restaurant.google_place_id) \
-     .outerjoin(Dislikes, Dislikes.rest_id == Restaurant.google_place_id) \
-     .group_by(Restaurant.google_place_id)
+        Restaurant.view_cnt.label('viewCount'),
+        Restaurant.collect_cnt.label('collectCount'),
+        Restaurant.like_cnt.label('likeCount'),
+        Restaurant.dislike_cnt.label('dislikeCount')
+    )
     
-    if order_by:
-        if order_by == "rating":
-            stmt = stmt.order_by(Restaurant.rating.desc())
-        elif order_by == "name":
-            stmt = stmt.order_by(Restaurant.rest_name)
-        elif order_by == "collectCount":
-            stmt = stmt.order_by(func.count(distinct(Collects.user_id)).desc())
+    if order_by in SORT_KEYS:
+        sort_key, descending = SORT_KEYS[order_by]
+        stmt = keyset(stmt, sort_tag(order_by, reverse), sort_key, Restaurant.google_place_id, descending != reverse, cursor)
 
     return stmt
 
+def bbox_filter(sw_lat: float, sw_lng: float, ne_lat: float, ne_lng: float):
+    """
+    Viewport predicate. Narrows the scan to the covering grid rows through the
+    (tile_key, lat, lng) index, then applies the exact bounds on the same index entries.
+    """
+    exact = and_(
+        Restaurant.lat.between(sw_lat, ne_lat),
+        Restaurant.lng.between(sw_lng, ne_lng)
+    )
+    ranges = covering_ranges(sw_lat, sw_lng, ne_lat, ne_lng)
+    if ranges is None:
+        return exact
+    return and_(
+        or_(*[Restaurant.tile_key.between(first, last) for first, last in ranges]),
+        exact
+    )
+
+def distance_from(lat: float, lng: float):
+    """Great-circle (haversine) distance in meters between each restaurant and the point."""
+    return 2 * EARTH_RADIUS * func.asin(func.sqrt(
+        func.power(func.sin(func.radians(Restaurant.lat - lat, type_=Float) * 0.5), 2) +
+        math.cos(math.radians(lat)) * func.cos(func.radians(Restaurant.lat)) *
+        func.power(func.sin(func.radians(Restaurant.lng - lng, type_=Float) * 0.5), 2)
+    ), type_=Float)
+
 def query_restaurants(session: Session, query_params: dict):
     order_by = query_params.get("orderBy")
     offset = query_params.get("offset", 0)
     limit = query_params.get("limit", 10)
     q = query_params.get("q")
+    cursor = query_params.get("cursor")
     auth_user_id = query_params.get("auth_user_id", -1)
+    compact = query_params.get("compact", False)
     sw_lat = query_params.get("sw_lat")
     sw_lng = query_params.get("sw_lng")
     ne_lat = query_params.get("ne_lat")
     ne_lng = query_params.get("ne_lng")
+    lat = query_params.get("lat")
+    lng = query_params.get("lng")
+    distance = query_params.get("distance")
+    tags = query_params.get("tags")
+    reverse = query_params.get("reverse", False)
+    tag = sort_tag(order_by, reverse)
 
-    stmt = base_query(auth_user_id, order_by)
+    stmt = base_query(order_by, cursor, compact, reverse)
+    filters = []
 
     if sw_lat and sw_lng and ne_lat and ne_lng:
-        stmt = stmt.where(
-            and_(
-                Restaurant.lat.between(sw_lat, ne_lat),
-                Restaurant.lng.between(sw_lng, ne_lng)
-            )
-        )
+        filters.append(bbox_filter(sw_lat, sw_lng, ne_lat, ne_lng))
+
+    if order_by == "distance" and lat is not None and lng is not None and distance:
+        # Nearest first within `distance` meters; the enclosing box narrows the scan to the covering grid rows
+        meters = distance_from(lat, lng)
+        filters += [bbox_filter(*radius_bbox(lat, lng, distance)), meters <= distance]
+        stmt = keyset(stmt.add_columns(meters.label('distance')), tag, meters, Restaurant.google_place_id, descending=reverse, cursor=cursor)
+
+    if tags:
+        filters.append(restaurant_tag_filter(tags, query_params.get("tagMode", "any")))
 
     if q:
-        stmt = stmt.where(Restaurant.rest_name.like(f"%{q}%"))
-    # Ordering
+        filters.append(name_match(Restaurant.rest_name, q))
+        if order_by == "relevance":
+            stmt = keyset(stmt, tag, relevance(Restaurant.rest_name, q), Restaurant.google_place_id, not reverse, cursor)
 
-    # Pagination
-    stmt = stmt.offset(offset).limit(limit)
-    count_query = select(func.count(Restaurant.google_place_id))
-    if sw_lat and sw_lng and ne_lat and ne_lng:
-        count_query = count_query.where(
-            and_(
-                Restaurant.lat.between(sw_lat, ne_lat),
-                Restaurant.lng.between(sw_lng, ne_lng)
-            )    
-        )
+    # Pagination: a cursor seeks past the previous page, otherwise fall back to OFFSET
+    if not cursor:
+        stmt = stmt.offset(offset)
+    stmt = stmt.where(*filters).limit(limit)
+    count_query = select(func.count(Restaurant.google_place_id)).where(*filters)
     count = session.execute(count_query).scalar()
     results = session.execute(stmt).all()
-    restaurants = [SimplifiedRestaurant(**result._asdict()) for result in results]
+    rows = merge_flags(session, RESTAURANT_FLAGS, auth_user_id, results, 'placeId')
+    if compact:
+        # Encoded straight from the rows by app.core.compact
+        return count, rows, next_cursor(results, limit, tag)
+    restaurants = [SimplifiedRestaurant(**row) for row in rows]
+
+    return count, restaurants, next_cursor(results, limit, tag)
 
-    return count, restaurants
+def get_restaurants_by_ids(session: Session, place_ids: list[str], auth_user_id: int = -1, compact: bool = False):
+    """Restaurants by primary key in the order of place_ids, e.g. a leaderboard page."""
+    results = session.execute(base_query(compact=compact).where(Restaurant.google_place_id.in_(place_ids))).all()
+    order = {place_id: i for i, place_id in enumerate(place_ids)}
+    results.sort(key=lambda row: order[row.placeId])
+    rows = merge_flags(session, RESTAURANT_FLAGS, auth_user_id, results, 'placeId')
+    if compact:
+        return rows
+    return [SimplifiedRestaurant(**row) for row in rows]
+
+def cluster_restaurants(session: Session, sw_lat: float, sw_lng: float, ne_lat: float, ne_lng: float, cell_size: float, q: str = None):
+    """
+    Aggregate the restaurants in the viewport per grid cell of cell_size degrees:
+    count, centroid and the top-rated restaurant of each cell.
+    """
+    cell_row = func.floor((Restaurant.lat + 90) / cell_size)
+    cell_col = func.floor((Restaurant.lng + 180) / cell_size)
+    top_rated = func.array_agg(
+        aggregate_order_by(Restaurant.google_place_id, Restaurant.rating.desc().nulls_last(), Restaurant.collect_cnt.desc()),
+        type_=ARRAY(String)
+    )[1]
+    stmt = select(
+        func.count().label('count'),
+        func.avg(Restaurant.lat).label('lat'),
+        func.avg(Restaurant.lng).label('lng'),
+        top_rated.label('placeId')
+    ).where(bbox_filter(sw_lat, sw_lng, ne_lat, ne_lng)).group_by(cell_row, cell_col)
+    if q:
+        stmt = stmt.where(name_match(Restaurant.rest_name, q))
+    cells = stmt.subquery()
+
+    stmt = select(
+        cells.c.count,
+        cells.c.lat,
+        cells.c.lng,
+        Restaurant.google_place_id.label('placeId'),
+        Restaurant.rest_name.label('name'),
+        Restaurant.rating,
+        Restaurant.photo_url.label('photoUrl')
+    ).join(Restaurant, Restaurant.google_place_id == cells.c.placeId)
+    return [
+        RestaurantCluster(
+            count=row.count,
+            center={"lat": row.lat, "lng": row.lng},
+            representative=ClusterRepresentative(placeId=row.placeId, name=row.name, rating=row.rating, photoUrl=row.photoUrl)
+        )
+        for row in session.execute(stmt).all()
+    ]
 
 def get_restaurant(db: Session, place_id: str, user_id: int) -> Restaurant:
-    stmt = base_query(user_id)
+    stmt = base_query()
     stmt = stmt.where(Restaurant.google_place_id == place_id)
     result = db.execute(stmt).first()
-    restaurant = ClientRestaurant(**result._asdict(), diaries=[])
+    if not result:
+        return None
+    restaurant = ClientRestaurant(**result._asdict(), **get_restaurant_flags(db, place_id, user_id), diaries=[])
     
     diary_stmt = select(
         Diary.diary_id.label('id'),
@@ -97,47 +196,82 @@ def get_restaurant(db: Session, place_id: str, user_id: int) -> Restaurant:
     restaurant.diaries = [SimplifiedDiary(**diary._asdict()) for diary in diaries]
     return restaurant
 
-def bulk_insert(db: Session, restaurants: list[CreateRestaurant]) -> list[Restaurant]:
+def get_restaurant_flags(db: Session, place_id: str, user_id: int) -> dict:
+    """The per-user flags of a restaurant detail, in one round trip."""
+    return resolve_flags(db, RESTAURANT_FLAGS, user_id, [place_id])[place_id]
+
+def get_view_count(db: Session, place_id: str) -> int:
+    return db.execute(select(Restaurant.view_cnt).where(Restaurant.google_place_id == place_id)).scalar() or 0
+
+def has_place_details(db: Session, place_id: str) -> bool:
+    """Whether the restaurant exists with its place details (only the Nearby Search fields are known otherwise)."""
+    stmt = select(Restaurant.address.is_not(None)).where(Restaurant.google_place_id == place_id)
+    return bool(db.execute(stmt).scalar())
+
+def bulk_insert(db: Session, restaurants: list[CreateRestaurant]) -> tuple[list[str], list[str]]:
+    """
+    Upsert a batch of restaurants in one statement. Address and telephone are
+    written too when every row carries place details (FullCreateRestaurant).
+    Rows whose values are unchanged are left alone, so repeated fetches of the
+    same area produce no dead tuples or WAL. Maps holding a restaurant that moved
+    get their extents recomputed. Returns the place ids that were inserted and the
+    ones that were updated.
+    """
     if not restaurants:
-        return []
-    db_restaurants = [{
+        return [], []
+    with_details = all(isinstance(restaurant, FullCreateRestaurant) for restaurant in restaurants)
+    # Keyed by place id: ON CONFLICT cannot touch the same row twice in one statement
+    db_restaurants = {restaurant.place_id: {
         "google_place_id": restaurant.place_id,
         "rest_name": restaurant.name,
         "lat": restaurant.location['lat'],
         "lng": restaurant.location['lng'],
+        "tile_key": tile_key(restaurant.location['lat'], restaurant.location['lng']),
         "rating": restaurant.rating,
-        "photo_url": restaurant.photo_url
-    } for restaurant in restaurants]
+        "photo_url": restaurant.photo_url,
+        **({"address": restaurant.address, "telephone": restaurant.telephone} if with_details else {})
+    } for restaurant in restaurants}
 
-    stmt = insert(Restaurant).values(db_restaurants)
+    stmt = insert(Restaurant).values(list(db_restaurants.values()))
+    columns = [column for column in next(iter(db_restaurants.values())) if column != "google_place_id"]
     stmt = stmt.on_conflict_do_update(
         constraint="restaurants_pkey",
-        set_= {
-            "rest_name": stmt.excluded.rest_name,
-            "lat": stmt.excluded.lat,
-            "lng": stmt.excluded.lng,
-            "rating": stmt.excluded.rating,
-            "photo_url": stmt.excluded.photo_url
-        }
-    )
-    db.execute(stmt)
+        set_={column: getattr(stmt.excluded, column) for column in columns},
+        where=or_(*(getattr(Restaurant, column).is_distinct_from(getattr(stmt.excluded, column)) for column in columns))
+    ).returning(Restaurant.google_place_id, literal_column("xmax = 0").label("inserted"))
+    old_locations = db.execute(
+        select(Restaurant.google_place_id, Restaurant.lat, Restaurant.lng).where(Restaurant.google_place_id.in_(db_restaurants))
+    ).all()
+    rows = db.execute(stmt).all()
+    inserted = [row.google_place_id for row in rows if row.inserted]
+    updated = [row.google_place_id for row in rows if not row.inserted]
+    mark_stale(db, RESTAURANT, *updated)
+    update_moved_extents(db, [
+        old.google_place_id for old in old_locations
+        if (old.lat, old.lng) != (db_restaurants[old.google_place_id]["lat"], db_restaurants[old.google_place_id]["lng"])
+    ])
     db.commit()
-    return db_restaurants
+    return inserted, updated
 
 def create_update_restaurant(db: Session, restaurant: FullCreateRestaurant) -> Restaurant:
     existing_restaurant = db.query(Restaurant).filter(Restaurant.google_place_id == restaurant.place_id).first()
     if existing_restaurant:
+        old_location = (existing_restaurant.lat, existing_restaurant.lng)
         updates = {
             "rest_name": restaurant.name,
             "address": restaurant.address,
             "lat": restaurant.location.get('lat', 0),
             "lng": restaurant.location.get('lng', 0),
+            "tile_key": tile_key(restaurant.location.get('lat', 0), restaurant.location.get('lng', 0)),
             "telephone": restaurant.telephone,
             "rating": restaurant.rating,
             "photo_url": restaurant.photo_url
         }
         for key, value in updates.items():
             setattr(existing_restaurant, key, value)
+        if (existing_restaurant.lat, existing_restaurant.lng) != old_location:
+            db.flush()
+            update_moved_extents(db, [restaurant.place_id])
         db_restaurant = existing_restaurant
     else:
         db_restaurant = Restaurant(
@@ -146,11 +280,13 @@ def create_update_restaurant(db: Session, restaurant: FullCreateRestaurant) -> R
             google_place_id=restaurant.place_id,
             lat=restaurant.location.get('lat', 0),
             lng=restaurant.location.get('lng', 0),
+            tile_key=tile_key(restaurant.location.get('lat', 0), restaurant.location.get('lng', 0)),
             telephone=restaurant.telephone,
             rating=restaurant.rating,
             photo_url=restaurant.photo_url
         )
         db.add(db_restaurant)
+    mark_stale(db, RESTAURANT, restaurant.place_id)
     db.commit()
     db.refresh(db_restaurant)
     return db_restaurant
@@ -160,6 +296,11 @@ def update_restaurant(db: Session, place_id: str, updates: dict) -> Restaurant:
     if restaurant:
         for key, value in updates.items():
             setattr(restaurant, key, value)
+        if "lat" in updates or "lng" in updates:
+            restaurant.tile_key = tile_key(restaurant.lat, restaurant.lng)
+            db.flush()
+            update_moved_extents(db, [place_id])
+        mark_stale(db, RESTAURANT, place_id)
         db.commit()
         db.refresh(restaurant)
     return restaurant
@@ -168,75 +309,219 @@ def delete_restaurant(db: Session, place_id: str):
     restaurant = db.query(Restaurant).filter(Restaurant.google_place_id == place_id).first()
     if restaurant:
         db.delete(restaurant)
+        mark_stale(db, RESTAURANT, place_id)
         db.commit()
 
-def collect_restaurant(db: Session, user_id: int, place_id: str):
+def adjust_counters(db: Session, place_id: str, **deltas):
+    """
+    Add deltas to the interaction counters of a restaurant, e.g. like_cnt=1, dislike_cnt=-1.
+    Runs inside the caller's transaction so the counters commit together with the relation rows.
+    """
+    values = {getattr(Restaurant, column): getattr(Restaurant, column) + delta for column, delta in deltas.items() if delta}
+    if values:
+        db.execute(update(Restaurant).where(Restaurant.google_place_id == place_id).values(values))
+        mark_stale(db, RESTAURANT, place_id)
+
+def add_view_counts(db: Session, deltas: dict[str, int]) -> int:
+    """Add buffered view deltas ({place_id: views}) to view_cnt in one statement."""
+    if not deltas:
+        return 0
+    views = values(column('place_id', String), column('delta', Integer), name='views').data(list(deltas.items()))
+    stmt = update(Restaurant).where(Restaurant.google_place_id == views.c.place_id) \
+        .values(view_cnt=Restaurant.view_cnt + views.c.delta)
+    result = db.execute(stmt)
+    db.commit()
+    return result.rowcount
+
+EXTENT_COLUMNS = ('lat', 'lng', 'min_lat', 'min_lng', 'max_lat', 'max_lng', 'extent_cnt')
+
+def update_map_extent(db: Session, map_id: int):
+    """
+    Recompute the centroid (lat/lng) and bounding box of a map from all its restaurants, so
+    map listings can read them off the row. Call it in the transaction that changes the map's restaurants.
+    O(map size): single additions and removals go through extend_map_extent/shrink_map_extent.
+    """
+    extent = select(
+        Map.map_id,
+        func.avg(Restaurant.lat).label('lat'),
+        func.avg(Restaurant.lng).label('lng'),
+        func.min(Restaurant.lat).label('min_lat'),
+        func.min(Restaurant.lng).label('min_lng'),
+        func.max(Restaurant.lat).label('max_lat'),
+        func.max(Restaurant.lng).label('max_lng'),
+        func.count(Restaurant.lat).label('extent_cnt')
+    ).outerjoin(
+        MapRestaurant, MapRestaurant.map_id == Map.map_id
+    ).outerjoin(
+        Restaurant, and_(
+            Restaurant.google_place_id == MapRestaurant.place_id,
+            Restaurant.lat.is_not(None),
+            Restaurant.lng.is_not(None)
+        )
+    ).where(Map.map_id == map_id).group_by(Map.map_id).subquery()
+    db.execute(
+        update(Map).where(Map.map_id == extent.c.map_id)
+        .values({column: extent.c[column] for column in EXTENT_COLUMNS})
+    )
+
+def update_moved_extents(db: Session, place_ids: list[str]):
+    """Recompute the extents of the maps holding places whose lat/lng just changed."""
+    if not place_ids:
+        return
+    map_ids = db.execute(
+        select(distinct(MapRestaurant.map_id)).where(MapRestaurant.place_id.in_(place_ids))
+    ).scalars().all()
+    for map_id in map_ids:
+        update_map_extent(db, map_id)
+
+def place_location(db: Session, place_id: str):
+    return db.execute(select(Restaurant.lat, Restaurant.lng).where(Restaurant.google_place_id == place_id)).first()
+
+def extend_map_extent(db: Session, map_id: int, place_id: str):
+    """Fold a place just added to the map into its centroid and bounding box, in O(1)."""
+    location = place_location(db, place_id)
+    if location is None or location.lat is None or location.lng is None:
+        return
+    n = Map.extent_cnt + 1
+    db.execute(update(Map).where(Map.map_id == map_id).values(
+        # SET expressions read the old row, so lat/lng move the running mean by one sample
+        lat=func.coalesce(Map.lat, 0.0) + (location.lat - func.coalesce(Map.lat, 0.0)) / n,
+        lng=func.coalesce(Map.lng, 0.0) + (location.lng - func.coalesce(Map.lng, 0.0)) / n,
+        min_lat=func.least(Map.min_lat, location.lat),
+        min_lng=func.least(Map.min_lng, location.lng),
+        max_lat=func.greatest(Map.max_lat, location.lat),
+        max_lng=func.greatest(Map.max_lng, location.lng),
+        extent_cnt=n
+    ))
+
+def shrink_map_extent(db: Session, map_id: int, place_id: str):
+    """
+    Take a place just removed from the map out of its centroid in O(1). Only when the
+    place lay on the bounding box does the box need a full update_map_extent. The map
+    row is locked while deciding, so concurrent removals cannot both start from the
+    same extent.
+    """
+    location = place_location(db, place_id)
+    if location is None or location.lat is None or location.lng is None:
+        return
+    extent = db.execute(
+        select(Map.min_lat, Map.min_lng, Map.max_lat, Map.max_lng, Map.extent_cnt).where(Map.map_id == map_id).with_for_update()
+    ).first()
+    if extent is None:
+        return
+    on_box = location.lat in (extent.min_lat, extent.max_lat) or location.lng in (extent.min_lng, extent.max_lng)
+    if on_box or extent.extent_cnt <= 1:
+        update_map_extent(db, map_id)
+        return
+    n = Map.extent_cnt - 1
+    db.execute(update(Map).where(Map.map_id == map_id).values(
+        lat=(Map.lat * Map.extent_cnt - location.lat) / n,
+        lng=(Map.lng * Map.extent_cnt - location.lng) / n,
+        extent_cnt=n
+    ))
+
+def add_map_restaurant(db: Session, map_id: int, place_id: str) -> bool:
+    """Append a place to the end of a map, returning whether it was not on the map yet."""
+    position = select(func.coalesce(func.max(MapRestaurant.position) + 1, 0)).where(MapRestaurant.map_id == map_id).scalar_subquery()
+    stmt = insert(MapRestaurant).values(map_id=map_id, place_id=place_id, position=position).on_conflict_do_nothing()
+    return db.execute(stmt).rowcount > 0
+
+def remove_map_restaurant(db: Session, map_id: int, place_id: str) -> bool:
+    result = db.execute(delete(MapRestaurant).where(MapRestaurant.map_id == map_id, MapRestaurant.place_id == place_id))
+    return result.rowcount > 0
+
+def remove_relation(db: Session, model, user_id: int, place_id: str) -> bool:
+    """Delete a user-restaurant relation row, returning whether a row was actually removed."""
+    result = db.execute(delete(model).where(model.user_id == user_id, model.rest_id == place_id))
+    return result.rowcount > 0
+
+def rebuild_counters(db: Session) -> int:
+    """
+    Recompute every restaurant's counters from the relation tables.
+    Returns the number of restaurants whose counters had drifted.
+    """
+    def counts(model):
+        return select(model.rest_id, func.count().label('n')).group_by(model.rest_id).subquery()
+    collects, likes, dislikes = counts(UserRestCollect), counts(UserRestLike), counts(UserRestDislike)
+    actual = select(
+        Restaurant.google_place_id.label('place_id'),
+        func.coalesce(collects.c.n, 0).label('collects'),
+        func.coalesce(likes.c.n, 0).label('likes'),
+        func.coalesce(dislikes.c.n, 0).label('dislikes')
+    ).outerjoin(collects, collects.c.rest_id == Restaurant.google_place_id) \
+     .outerjoin(likes, likes.c.rest_id == Restaurant.google_place_id) \
+     .outerjoin(dislikes, dislikes.c.rest_id == Restaurant.google_place_id) \
+     .subquery()
+    stmt = update(Restaurant).where(
+        Restaurant.google_place_id == actual.c.place_id,
+        or_(
+            Restaurant.collect_cnt != actual.c.collects,
+            Restaurant.like_cnt != actual.c.likes,
+            Restaurant.dislike_cnt != actual.c.dislikes
+        )
+    ).values(
+        collect_cnt=actual.c.collects,
+        like_cnt=actual.c.likes,
+        dislike_cnt=actual.c.dislikes
+    ).returning(Restaurant.google_place_id)
+    fixed = db.execute(stmt).scalars().all()
+    mark_stale(db, RESTAURANT, *fixed)
+    db.commit()
+    return len(fixed)
+
+def collect_restaurant(db: Session, user_id: int, place_id: str) -> bool:
+    """Collect the place; True if it was not collected by the user before."""
     collection_entry = db.query(UserRestCollect).filter(UserRestCollect.user_id == user_id, UserRestCollect.rest_id == place_id).first()
-    if not collection_entry:
+    inserted = collection_entry is None
+    if inserted:
         collection_entry = UserRestCollect(user_id=user_id, rest_id=place_id)
         db.add(collection_entry)
+        adjust_counters(db, place_id, collect_cnt=1)
         db.commit()
     
-    map = db.query(Map).filter(Map.author == user_id).first()
-    if map:
-        if isinstance(map.rest_ids, list):
-            restaurants = map.rest_ids.copy()
-        else:
-            restaurants = []
-        if place_id not in restaurants:
-            restaurants.append(place_id)
-            setattr(map, "rest_ids", restaurants)
-            db.commit()
-            db.refresh(map)
-    return collection_entry
+    map_id = db.execute(select(Map.map_id).where(Map.author == user_id).limit(1)).scalar()
+    if map_id is not None and add_map_restaurant(db, map_id, place_id):
+        extend_map_extent(db, map_id, place_id)
+        db.commit()
+    return inserted
 
 def uncollect_restaurant(db: Session, user_id: int, place_id: str):
-    collection_entry = db.query(UserRestCollect).filter(UserRestCollect.user_id == user_id, UserRestCollect.rest_id == place_id).first()
-    if collection_entry:
-        db.delete(collection_entry)
+    if remove_relation(db, UserRestCollect, user_id, place_id):
+        adjust_counters(db, place_id, collect_cnt=-1)
         db.commit()
-    map = db.query(Map).filter(Map.author == user_id).first()
-    if map:
-        if isinstance(map.rest_ids, list):
-            restaurants = map.rest_ids.copy()
-        else:
-            restaurants = []
-        if place_id in restaurants:
-            restaurants.remove(place_id)
-            setattr(map, "rest_ids", restaurants)
-            db.commit()
-            db.refresh(map)
-
-def like_restaurant(db: Session, user_id: int, place_id: str):
-    existing_dislike = db.query(UserRestDislike).filter_by(user_id=user_id, rest_id=place_id).first()
-    if existing_dislike:
-        db.delete(existing_dislike)
+    map_id = db.execute(select(Map.map_id).where(Map.author == user_id).limit(1)).scalar()
+    if map_id is not None and remove_map_restaurant(db, map_id, place_id):
+        shrink_map_extent(db, map_id, place_id)
+        db.commit()
+
+def like_restaurant(db: Session, user_id: int, place_id: str) -> bool:
+    """Like the place (replacing a dislike); True if it was not liked by the user before."""
+    removed_dislike = remove_relation(db, UserRestDislike, user_id, place_id)
     existing_like = db.query(UserRestLike).filter_by(user_id=user_id, rest_id=place_id).first()
     if not existing_like:
         like_entry = UserRestLike(user_id=user_id, rest_id=place_id)
         db.add(like_entry)
+    adjust_counters(db, place_id, like_cnt=0 if existing_like else 1, dislike_cnt=-1 if removed_dislike else 0)
     try:
         db.commit()
     except Exception as e:
         db.rollback()  # Rollback in case of any error
         raise Exception(f"Failed to like the restaurant: {e}")
-    return f"Restaurant {place_id} liked successfully!"
+    return existing_like is None
 
 
 def unlike_restaurant(db: Session, user_id: int, place_id: str):
-    like_entry = db.query(UserRestLike).filter(UserRestLike.user_id == user_id, UserRestLike.rest_id == place_id).first()
-    if like_entry:
-        db.delete(like_entry)
+    if remove_relation(db, UserRestLike, user_id, place_id):
+        adjust_counters(db, place_id, like_cnt=-1)
         db.commit()
 
 def dislike_restaurant(db: Session, user_id: int, place_id: str):
-    existing_like = db.query(UserRestLike).filter_by(user_id=user_id, rest_id=place_id).first()
-    if existing_like:
-        db.delete(existing_like)
+    removed_like = remove_relation(db, UserRestLike, user_id, place_id)
     existing_dislike = db.query(UserRestDislike).filter_by(user_id=user_id, rest_id=place_id).first()
     if not existing_dislike:
         dislike_entry = UserRestDislike(user_id=user_id, rest_id=place_id)
         db.add(dislike_entry)
+    adjust_counters(db, place_id, dislike_cnt=0 if existing_dislike else 1, like_cnt=-1 if removed_like else 0)
     try:
         db.commit()
     except Exception as e:
@@ -245,7 +530,6 @@ def dislike_restaurant(db: Session, user_id: int, place_id: str):
     return f"Restaurant {place_id} disliked successfully!"
 
 def undislike_restaurant(db: Session, user_id: int, place_id: str):
-    dislike_entry = db.query(UserRestDislike).filter(UserRestDislike.user_id == user_id, UserRestDislike.rest_id == place_id).first()
-    if dislike_entry:
-        db.delete(dislike_entry)
+    if remove_relation(db, UserRestDislike, user_id, place_id):
+        adjust_counters(db, place_id, dislike_cnt=-1)
         db.commit()
@@ -0,0 +1,70 @@
+"""
+Redis side effects of crud writes, applied once the write commits.
+
+Crud writes that change what a cached restaurant or diary detail shows
+(app.services.restaurant_cache, app.services.diary_cache) call mark_stale with the
+ids they touched; writes that feed other Redis structures, like the following
+timelines, register an on_commit effect. Both ride on the session until its
+transaction ends: a commit bumps the per-id versions the caches key their entries
+by and runs the effects, a rollback drops them. Since this happens where the write
+commits, the routers, the jobs and any other caller of the crud functions behave
+alike, and a Redis failure is logged instead of failing a write that committed.
+"""
+import logging
+from redis.exceptions import RedisError
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.db.redis import get_redis
+
+RESTAURANT = "restaurant"
+DIARY = "diary"
+
+_redis = None
+
+logger = logging.getLogger(__name__)
+
+def version_key(kind: str, id_) -> str:
+    # No TTL: a version restarting from a missing key would hand readers entries stored
+    # before the write. The old {kind}:ver:{id} keys had one and are left to expire.
+    return f"{kind}:version:{id_}"
+
+def mark_stale(db: Session, kind: str, *ids):
+    """Invalidate the cached details of ids once db commits."""
+    db.info.setdefault("stale", {}).setdefault(kind, set()).update(id_ for id_ in ids if id_ is not None)
+
+def on_commit(db: Session, effect, *args):
+    """Call effect(redis, *args) once db commits. Anything read from the database must be passed in args."""
+    db.info.setdefault("effects", []).append((effect, args))
+
+def bump_versions(redis, stale: dict):
+    pipe = redis.pipeline(transaction=False)
+    for kind, ids in stale.items():
+        for id_ in ids:
+            pipe.incr(version_key(kind, id_))
+    pipe.execute()
+
+@event.listens_for(Session, "after_commit")
+def apply_committed(session):
+    global _redis
+    stale = session.info.pop("stale", None)
+    effects = session.info.pop("effects", [])
+    if not stale and not effects:
+        return
+    if _redis is None:
+        _redis = get_redis()
+    if stale:
+        try:
+            bump_versions(_redis, stale)
+        except RedisError as e:
+            # The stale entries still expire after DETAIL_TTL
+            logger.warning(f"Invalidating cached details {stale} failed: {e}")
+    for effect, args in effects:
+        try:
+            effect(_redis, *args)
+        except RedisError as e:
+            logger.warning(f"{effect.__module__}.{effect.__name__} after commit failed: {e}")
+
+@event.listens_for(Session, "after_rollback")
+def forget_rolled_back(session):
+    session.info.pop("stale", None)
+    session.info.pop("effects", None)
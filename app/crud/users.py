@@ -1,11 +1,15 @@
 from sqlalchemy.orm import Session, aliased
-from app.models.dbModel import User, UserFollow, Diary, Map
+from app.models.dbModel import User, UserFollow, Diary, Map, Comment
 from sqlalchemy import func, select, exists, distinct
 from app.schemas.users import UserDisplay
 from app.schemas.diaries import SimplifiedDiary
 from app.crud.diaries import simplified_query
+from app.core.pagination import keyset, next_cursor, sort_tag
+from app.core import search
+from app.crud.flags import USER_FLAGS, merge_flags
+from app.crud.stale import DIARY, mark_stale
 
-def query_sql(user_id = None, auth_user_id: int = -1, name_match: str = None, order_by: str = None):
+def query_sql(user_id = None, name_match: str = None, order_by: str = None, cursor: str = None, reverse: bool = False):
     Followings = aliased(UserFollow)
     Followers = aliased(UserFollow)
 
@@ -16,12 +20,7 @@ def query_sql(user_id = None, auth_user_id: int = -1, name_match: str = None, or
         Map.map_id.label('mapId'),
         func.count(distinct(Followings.be_followed)).label('following'),
         func.count(distinct(Followers.follow)).label('followed'),
-        func.count(distinct(Diary.diary_id)).label('postCount'),
-        exists(
-            select(1).where(
-                UserFollow.follow == auth_user_id, UserFollow.be_followed == User.user_id
-            )
-        ).label('isFollowing')
+        func.count(distinct(Diary.diary_id)).label('postCount')
     ).outerjoin(Map, Map.author == User.user_id) \
     .outerjoin(Followings, Followings.follow == User.user_id) \
     .outerjoin(Followers, Followers.be_followed == User.user_id)  \
@@ -31,21 +30,23 @@ def query_sql(user_id = None, auth_user_id: int = -1, name_match: str = None, or
         stmt = stmt.where(User.user_id == user_id)
 
     if name_match:
-        stmt = stmt.where(User.user_name.like(f"%{name_match}%"))
+        stmt = stmt.where(search.name_match(User.user_name, name_match))
     
     stmt = stmt.group_by(User.user_id, Map.map_id)
-    if order_by:
-        if order_by == "following":
-            stmt = stmt.order_by(func.count(distinct(Followings.be_followed)).desc())
-        elif order_by == "createTime":
-            stmt = stmt.order_by(User.created.desc())
+    tag, descending = sort_tag(order_by, reverse), not reverse
+    if order_by == "relevance" and name_match:
+        stmt = keyset(stmt, tag, search.relevance(User.user_name, name_match), User.user_id, descending, cursor)
+    elif order_by == "following":
+        stmt = keyset(stmt, tag, func.count(distinct(Followings.be_followed)), User.user_id, descending, cursor, aggregate=True)
+    elif order_by == "createTime":
+        stmt = keyset(stmt, tag, User.created, User.user_id, descending, cursor)
     return stmt
 
 def get_user(db: Session, user_id: int, auth_user_id: int) -> User:
-    stmt = query_sql(user_id=user_id, auth_user_id=auth_user_id)
+    stmt = query_sql(user_id=user_id)
     result = db.execute(stmt).first()
     if result:
-        return UserDisplay(**result._asdict())
+        return UserDisplay(**merge_flags(db, USER_FLAGS, auth_user_id, [result], 'id')[0])
     else:
         return None
 
@@ -55,17 +56,22 @@ def get_user_by_email(db: Session, email: str) -> User:
 def get_user_by_id(db: Session, user_id: str) -> User:
     return db.query(User).filter(User.user_id == user_id).first()
 
-def get_users(db: Session, query) -> list[User]:
-    stmt = query_sql(auth_user_id=query["auth_user_id"], name_match=query["q"], order_by=query["orderBy"]).limit(query["limit"]).offset(query["offset"])
+def get_users(db: Session, query) -> tuple[list[UserDisplay], str]:
+    cursor = query.get("cursor")
+    reverse = query.get("reverse", False)
+    stmt = query_sql(name_match=query["q"], order_by=query["orderBy"], cursor=cursor, reverse=reverse).limit(query["limit"])
+    if not cursor:
+        stmt = stmt.offset(query["offset"])
     result = db.execute(stmt).all()
-    return [UserDisplay(**user._asdict()) for user in result]
+    users = [UserDisplay(**user) for user in merge_flags(db, USER_FLAGS, query["auth_user_id"], result, 'id')]
+    return users, next_cursor(result, query["limit"], sort_tag(query["orderBy"], reverse))
 
 def create_user(db: Session, user: dict) -> User:
     db_user = User(user_name=user['user_name'], email=user['email'])
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
-    db_map = Map(map_name="我的地圖", author=db_user.user_id, description="這裡收集了我喜愛的美食", rest_ids=[])
+    db_map = Map(map_name="我的地圖", author=db_user.user_id, description="這裡收集了我喜愛的美食")
     db.add(db_map)
     db.commit()
     db.refresh(db_map)
@@ -76,6 +82,11 @@ def update_user(db: Session, user_id: int, updates: dict) -> User:
     if user:
         for key, value in updates.items():
             setattr(user, key, value)
+        if "user_name" in updates or "avatar_url" in updates:
+            # Diary details show the names and avatars of the author and the repliers
+            written = select(Diary.diary_id).where(Diary.user_id == user_id)
+            replied = select(Comment.diary_id).where(Comment.author == user_id)
+            mark_stale(db, DIARY, *db.execute(written.union(replied)).scalars())
         db.commit()
         db.refresh(user)
     return user
@@ -1,4 +1,199 @@
+import logging
+from sqlalchemy import text
 from app.db.database import engine, Base
+from app.core.config import Config
+from app.core.geo import TILE_SIZE, TILE_COLS
+from app.core.search import SEARCH_COLUMNS, SEARCH_FUNCTIONS
+
+logger = logging.getLogger(__name__)
+
+# create_all only creates missing tables, so schema changes to existing tables
+# are applied here on startup. Each migration is (check, statements): check is a
+# catalog query that is true while the migration is still pending, so once the
+# schema is up to date a start only reads the catalogs and takes no table locks.
+# Indexes are built separately with CREATE INDEX CONCURRENTLY (see INDEXES).
+
+def column_present(table: str, column: str, condition: str = "TRUE") -> str:
+    return (
+        "EXISTS (SELECT 1 FROM information_schema.columns WHERE table_schema = current_schema() "
+        f"AND table_name = '{table}' AND column_name = '{column}' AND {condition})"
+    )
+
+def column_missing(table: str, column: str) -> str:
+    return f"NOT {column_present(table, column)}"
+
+def column_nullable(table: str, column: str) -> str:
+    return column_present(table, column, "is_nullable = 'YES'")
+
+def function_missing(name: str) -> str:
+    return f"NOT EXISTS (SELECT 1 FROM pg_proc WHERE proname = '{name}')"
+
+MIGRATIONS = [
+    (column_missing("restaurants", "tile_key"), [
+        "ALTER TABLE restaurants ADD COLUMN tile_key INTEGER",
+        f"""
+        UPDATE restaurants
+        SET tile_key = floor((lat + 90) / {TILE_SIZE})::int * {TILE_COLS} + floor((lng + 180) / {TILE_SIZE})::int
+        WHERE lat IS NOT NULL AND lng IS NOT NULL
+        """,
+    ]),
+    # Denormalized interaction counters, seeded once from the relation tables.
+    (column_missing("restaurants", "collect_cnt"), [
+        f"ALTER TABLE restaurants ADD COLUMN IF NOT EXISTS {column} INTEGER" for column in ("collect_cnt", "like_cnt", "dislike_cnt")
+    ]),
+    (column_nullable("restaurants", "collect_cnt"), [
+        """
+        UPDATE restaurants r
+        SET collect_cnt = (SELECT count(*) FROM user_rest_collect c WHERE c.rest_id = r.google_place_id),
+            like_cnt = (SELECT count(*) FROM user_rest_like l WHERE l.rest_id = r.google_place_id),
+            dislike_cnt = (SELECT count(*) FROM user_rest_dislike d WHERE d.rest_id = r.google_place_id)
+        WHERE r.collect_cnt IS NULL OR r.like_cnt IS NULL OR r.dislike_cnt IS NULL
+        """,
+        *[
+            f"ALTER TABLE restaurants ALTER COLUMN {column} SET DEFAULT 0, ALTER COLUMN {column} SET NOT NULL"
+            for column in ("collect_cnt", "like_cnt", "dislike_cnt")
+        ],
+    ]),
+    # View counters are flushed from Redis as view_cnt + delta, which needs them non-null
+    *[
+        (column_nullable(table, "view_cnt"), [
+            f"UPDATE {table} SET view_cnt = 0 WHERE view_cnt IS NULL",
+            f"ALTER TABLE {table} ALTER COLUMN view_cnt SET DEFAULT 0, ALTER COLUMN view_cnt SET NOT NULL",
+        ])
+        for table in ("restaurants", "maps")
+    ],
+    # Map.rest_ids (an array of place ids) moved to the map_restaurants table
+    (column_present("maps", "rest_ids"), [
+        """
+        INSERT INTO map_restaurants (map_id, place_id, position, added_at)
+        SELECT m.map_id, r.place_id, min(r.ord) - 1, coalesce(m.created, now())
+        FROM maps m, unnest(m.rest_ids) WITH ORDINALITY AS r(place_id, ord)
+        WHERE r.place_id IS NOT NULL
+        GROUP BY m.map_id, r.place_id, m.created
+        ON CONFLICT DO NOTHING
+        """,
+        "ALTER TABLE maps DROP COLUMN rest_ids",
+    ]),
+    # Map centroid and bounding box, maintained by crud.restaurants (update_map_extent and friends),
+    # and the number of located restaurants behind each centroid
+    (column_missing("maps", "min_lat"), [
+        *[f"ALTER TABLE maps ADD COLUMN {column} DOUBLE PRECISION" for column in ("min_lat", "min_lng", "max_lat", "max_lng")],
+        """
+        UPDATE maps m
+        SET lat = e.lat, lng = e.lng, min_lat = e.min_lat, min_lng = e.min_lng, max_lat = e.max_lat, max_lng = e.max_lng
+        FROM (
+            SELECT mr.map_id, avg(r.lat) AS lat, avg(r.lng) AS lng,
+                   min(r.lat) AS min_lat, min(r.lng) AS min_lng, max(r.lat) AS max_lat, max(r.lng) AS max_lng
+            FROM map_restaurants mr
+            JOIN restaurants r ON r.google_place_id = mr.place_id
+            GROUP BY mr.map_id
+        ) AS e
+        WHERE m.map_id = e.map_id
+        """,
+    ]),
+    (column_missing("maps", "extent_cnt"), [
+        "ALTER TABLE maps ADD COLUMN extent_cnt INTEGER NOT NULL DEFAULT 0",
+        """
+        UPDATE maps m SET extent_cnt = e.n
+        FROM (
+            SELECT mr.map_id, count(*) AS n
+            FROM map_restaurants mr
+            JOIN restaurants r ON r.google_place_id = mr.place_id
+            WHERE r.lat IS NOT NULL AND r.lng IS NOT NULL
+            GROUP BY mr.map_id
+        ) AS e
+        WHERE m.map_id = e.map_id
+        """,
+    ]),
+    # Character/bigram tokenizers for name search, see app.core.search. Changing one
+    # needs a manual rollout: the token indexes below are built on it.
+    (function_missing("search_query_tokens"), SEARCH_FUNCTIONS),
+]
+
+# name -> definition. Built with CREATE INDEX CONCURRENTLY, so writes to the table go on meanwhile.
+INDEXES = {
+    "ix_restaurants_tile_lat_lng": "restaurants (tile_key, lat, lng)",
+    "ix_restaurants_collect_cnt": "restaurants (collect_cnt)",
+    "ix_restaurants_like_cnt": "restaurants (like_cnt)",
+    "ix_restaurants_dislike_cnt": "restaurants (dislike_cnt)",
+    # Per-map collect counts for the leaderboard rebuild
+    "ix_user_map_collect_map_id": "user_map_collect (map_id)",
+    # Timeline fan-out, backfill and rebuilds (app.services.timeline)
+    "ix_user_follow_follow_be_followed": "user_follow (follow, be_followed)",
+    "ix_user_follow_be_followed": "user_follow (be_followed)",
+    "ix_diaries_user_id_created": "diaries (user_id, created)",
+    # Per-diary counts and replies of the diary detail
+    "ix_user_diary_like_diary_id": "user_diary_like (diary_id)",
+    "ix_user_diary_collect_diary_id": "user_diary_collect (diary_id)",
+    "ix_comments_diary_id_created": "comments (diary_id, created)",
+    # Keyset pagination seeks on (sort column, primary key).
+    "ix_restaurants_collect_cnt_place_id": "restaurants (collect_cnt, google_place_id)",
+    "ix_restaurants_created_place_id": "restaurants (created, google_place_id)",
+    "ix_maps_created_map_id": "maps (created, map_id)",
+    "ix_users_created_user_id": "users (created, user_id)",
+    "ix_diaries_created_diary_id": "diaries (created, diary_id)",
+    # Tag filters (app.core.tags) need GIN indexes; B-tree indexes on arrays cannot answer && or @>
+    "ix_maps_tags_gin": "maps USING gin (tags)",
+    "ix_diaries_items_gin": "diaries USING gin (items)",
+    "ix_diaries_rest_id": "diaries (rest_id)",
+    # Character/bigram indexes for name search
+    **{f"ix_{table}_{column}_tokens": f"{table} USING gin (search_tokens({column}))" for table, column in SEARCH_COLUMNS},
+}
+TRIGRAM_INDEXES = {f"ix_{table}_{column}_trgm": f"{table} USING gin ({column} gin_trgm_ops)" for table, column in SEARCH_COLUMNS}
+DROPPED_INDEXES = ["ix_maps_tags", "ix_diaries_items"]
+
+MIGRATION_LOCK = 20240501
+
+def index_valid(conn, name: str):
+    """True/False for a valid/invalid (half-built) index, None when it does not exist."""
+    return conn.execute(text(
+        "SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname = :name"
+    ), {"name": name}).scalar()
+
+def build_indexes(conn, indexes: dict):
+    """conn must be in autocommit mode: CONCURRENTLY cannot run inside a transaction."""
+    for name in DROPPED_INDEXES:
+        if index_valid(conn, name) is not None:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    for name, definition in indexes.items():
+        valid = index_valid(conn, name)
+        if valid:
+            continue
+        if valid is False:
+            # Left behind by an interrupted concurrent build
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        logger.info(f"Building index {name}")
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}"))
+
+def enable_trigram_search(conn) -> bool:
+    """Install pg_trgm if possible; search falls back to the bigram indexes otherwise."""
+    if Config.SEARCH_BACKEND == "bigram":
+        return False
+    if conn.execute(text("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")).scalar():
+        return True
+    try:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        return True
+    except Exception as e:
+        logger.warning(f"pg_trgm unavailable, name search uses the bigram indexes only: {e}")
+        return False
+
+def run_migrations():
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # All uvicorn workers start at once; serialize them on a session advisory lock,
+        # held across the schema transaction and the concurrent index builds.
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK})
+        try:
+            with engine.begin() as tx:
+                for check, statements in MIGRATIONS:
+                    if tx.execute(text(f"SELECT {check}")).scalar():
+                        for statement in statements:
+                            tx.execute(text(statement))
+            trigram = enable_trigram_search(conn)
+            build_indexes(conn, {**INDEXES, **(TRIGRAM_INDEXES if trigram else {})})
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK})
 
 def create_tables():
-    Base.metadata.create_all(bind=engine)    
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)    
+    run_migrations()
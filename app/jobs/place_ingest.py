@@ -0,0 +1,52 @@
+"""
+Ingestion of the remaining Nearby Search pages of a grid cell.
+
+The request that misses the cache only waits for the first page. If Google
+reports more, the rest are followed here in the background: each page token
+becomes valid about two seconds after it is issued, and every page is upserted
+and appended to the cell's cache entry as soon as it arrives. The entry is
+marked complete after the last page, which gives it the full cache TTL; until
+then it expires after a short lease so an interrupted cell gets searched again.
+"""
+import asyncio
+import logging
+from app.db.redis import get_redis
+from app.jobs.place_refresh import save_place_details
+from app.schemas.restaurants import CreateRestaurant
+from app.services.places_api import search_nearby_restaurants, PageTokenNotReady
+from app.services.redis_query import set_cached_places
+
+PAGE_TOKEN_DELAY = 2  # seconds before a next_page_token can be used
+PAGE_TOKEN_RETRIES = 3
+
+logger = logging.getLogger(__name__)
+_tasks = set()
+
+async def fetch_next_page(page_token):
+    for attempt in range(PAGE_TOKEN_RETRIES):
+        await asyncio.sleep(PAGE_TOKEN_DELAY)
+        try:
+            return await search_nearby_restaurants(None, None, None, page_token=page_token)
+        except PageTokenNotReady:
+            if attempt == PAGE_TOKEN_RETRIES - 1:
+                raise
+
+async def ingest_remaining_pages(lat, lng, keyword, radius, places, page_token):
+    redis = get_redis()
+    try:
+        places = list(places)
+        while page_token:
+            page, page_token = await fetch_next_page(page_token)
+            await asyncio.to_thread(save_place_details, [CreateRestaurant(**place) for place in page])
+            places.extend(page)
+            set_cached_places(redis, lat, lng, keyword, radius, places, complete=not page_token)
+    except Exception as e:
+        logger.warning(f"Ingesting Nearby Search pages around ({lat}, {lng}) failed: {e}")
+    finally:
+        redis.close()
+
+def schedule_remaining_pages(lat, lng, keyword, radius, places, page_token):
+    # Keep a reference so the task is not garbage collected while it runs
+    task = asyncio.create_task(ingest_remaining_pages(lat, lng, keyword, radius, places, page_token))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
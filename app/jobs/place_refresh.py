@@ -0,0 +1,65 @@
+"""
+Stale-while-revalidate refresh of place details.
+
+GET /api/v1/restaurants/{place_id} answers from the restaurants table and only
+enqueues the place here when its details are older than a day. Every worker
+runs the loop below; the queue is a Redis set, so repeated views of the same
+place collapse into one entry and SPOP hands each entry to a single worker.
+"""
+import asyncio
+import logging
+from app.crud.restaurants import bulk_insert
+from app.db.database import SessionLocal
+from app.db.redis import get_redis
+from app.services.places_api import get_place_details
+from app.services.redis_query import clear_place_queried
+
+REFRESH_QUEUE = "refresh:places"
+REFRESH_BATCH = 20
+REFRESH_INTERVAL = 2  # seconds between polls of an empty queue
+
+logger = logging.getLogger(__name__)
+
+def enqueue_place_refresh(redis, place_id):
+    redis.sadd(REFRESH_QUEUE, place_id)
+
+def save_place_details(restaurants):
+    db = SessionLocal()
+    try:
+        return bulk_insert(db, restaurants)
+    finally:
+        db.close()
+
+async def refresh_places(redis, place_ids: list[str]) -> int:
+    """Fetch a batch of places concurrently and upsert them in a single statement."""
+    results = await asyncio.gather(*(get_place_details(place_id) for place_id in place_ids), return_exceptions=True)
+    fresh = []
+    for place_id, result in zip(place_ids, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Refreshing place {place_id} failed: {result}")
+            clear_place_queried(redis, place_id)
+        else:
+            fresh.append(result)
+    if fresh:
+        try:
+            await asyncio.to_thread(save_place_details, fresh)
+        except Exception:
+            for restaurant in fresh:
+                clear_place_queried(redis, restaurant.place_id)
+            raise
+    return len(fresh)
+
+async def run_place_refresh_worker():
+    redis = get_redis()
+    try:
+        while True:
+            try:
+                place_ids = [place_id.decode() for place_id in redis.spop(REFRESH_QUEUE, REFRESH_BATCH)]
+                if place_ids:
+                    await refresh_places(redis, place_ids)
+                    continue
+            except Exception as e:
+                logger.error(f"Place refresh worker error: {e}")
+            await asyncio.sleep(REFRESH_INTERVAL)
+    finally:
+        redis.close()
@@ -0,0 +1,82 @@
+"""
+Rebuild the map collect leaderboard from Postgres and prune the trending boards,
+see app.services.leaderboard. Run it on cold start (the API does when the board
+is missing) and whenever Redis may have lost writes. Only one rebuild runs at a
+time; the others find the lock taken and leave the board to it:
+
+    python -m app.jobs.rebuild_leaderboards
+"""
+import uuid
+from app.crud.maps import collect_counts
+from app.db.database import SessionLocal
+from app.db.redis import get_redis
+from app.services.leaderboard import (
+    COLLECT_BOARD,
+    COLLECT_BOARD_LOCK,
+    COLLECT_BOARD_READY,
+    COLLECT_JOURNAL,
+    LEGACY_TRENDING_BOARDS,
+    RELEASE_SCRIPT,
+    SWAP_SCRIPT,
+    collect_score,
+    prune_trending,
+)
+
+ZADD_BATCH = 10000
+REBUILD_LEASE = 600  # seconds; a crashed rebuild blocks the next one at most this long
+
+def rebuild_collect_board(db, redis) -> int | None:
+    """
+    Build the board under a scratch key and swap it in, so readers never see a
+    partial board. Returns the number of ranked maps, or None when another rebuild
+    holds the lock (or this one outlived its lease and was abandoned).
+
+    Collects recorded while the lock is held are journaled and replayed onto the
+    snapshot as it is swapped in. A collect that commits before the snapshot but is
+    recorded after the lock was taken is counted twice until the next rebuild.
+    """
+    token = uuid.uuid4().hex
+    if not redis.set(COLLECT_BOARD_LOCK, token, nx=True, ex=REBUILD_LEASE):
+        return None
+    redis.delete(COLLECT_JOURNAL)
+    scratch = f"{COLLECT_BOARD}:rebuild:{token}"
+    try:
+        counts = collect_counts(db)
+        for start in range(0, len(counts), ZADD_BATCH):
+            redis.zadd(scratch, {map_id: collect_score(count, map_id) for map_id, count in counts[start:start + ZADD_BATCH]})
+    except Exception:
+        redis.delete(scratch)
+        redis.eval(RELEASE_SCRIPT, 1, COLLECT_BOARD_LOCK, token)
+        raise
+    if not redis.eval(SWAP_SCRIPT, 5, scratch, COLLECT_BOARD, COLLECT_BOARD_READY, COLLECT_BOARD_LOCK, COLLECT_JOURNAL, token):
+        return None
+    return len(counts)
+
+def ensure_leaderboards():
+    """Build the collect board unless another process already did or is doing it."""
+    redis = get_redis()
+    db = SessionLocal()
+    try:
+        if not redis.exists(COLLECT_BOARD_READY, COLLECT_BOARD_LOCK):
+            rebuild_collect_board(db, redis)
+    finally:
+        db.close()
+        redis.close()
+
+def main():
+    redis = get_redis()
+    db = SessionLocal()
+    try:
+        ranked = rebuild_collect_board(db, redis)
+        pruned = prune_trending(redis)
+        redis.delete(*LEGACY_TRENDING_BOARDS)
+        if ranked is None:
+            print(f"Another rebuild holds {COLLECT_BOARD_LOCK}, pruned {pruned} stale trending entries")
+        else:
+            print(f"Ranked {ranked} collected maps, pruned {pruned} stale trending entries")
+    finally:
+        db.close()
+        redis.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+"""
+Rebuild the denormalized restaurant counters (collect_cnt, like_cnt, dislike_cnt)
+from the user_rest_* relation tables.
+
+    python -m app.jobs.reconcile_counters
+"""
+from app.db.database import SessionLocal
+from app.crud.restaurants import rebuild_counters
+
+def main():
+    db = SessionLocal()
+    try:
+        fixed = rebuild_counters(db)
+        print(f"Reconciled counters of {fixed} restaurants")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Buffered view counters of maps and restaurants.
+
+Detail endpoints only HINCRBY a Redis hash per kind. Every worker runs the flusher
+below: it renames the hash to a key of its own, so views counted meanwhile go to a
+fresh hash and no two flushers take the same deltas, then adds all deltas of the
+batch to view_cnt in one UPDATE ... FROM (VALUES ...) statement.
+"""
+import asyncio
+import logging
+import uuid
+from redis.exceptions import ResponseError
+from app.crud import maps as crud_map
+from app.crud import restaurants as crud_rest
+from app.db.database import SessionLocal
+from app.db.redis import get_redis
+from app.services.leaderboard import bump_trending
+
+VIEW_KEYS = {"maps": "views:maps", "restaurants": "views:restaurants"}
+FLUSH_INTERVAL = 30  # seconds
+
+logger = logging.getLogger(__name__)
+
+def record_view(redis, kind: str, id_):
+    redis.hincrby(VIEW_KEYS[kind], id_, 1)
+
+def take_views(redis, kind: str) -> dict:
+    """Atomically take the buffered deltas of a kind as {id: delta}."""
+    key = VIEW_KEYS[kind]
+    batch_key = f"{key}:flush:{uuid.uuid4().hex}"
+    try:
+        redis.rename(key, batch_key)
+    except ResponseError:  # no views since the last flush
+        return {}
+    deltas = {field.decode(): int(value) for field, value in redis.hgetall(batch_key).items()}
+    redis.delete(batch_key)
+    return deltas
+
+def restore_views(redis, kind: str, deltas: dict):
+    """Put deltas that could not be written back into the buffer."""
+    pipe = redis.pipeline(transaction=False)
+    for id_, delta in deltas.items():
+        pipe.hincrby(VIEW_KEYS[kind], id_, delta)
+    pipe.execute()
+
+def save_views(kind: str, deltas: dict) -> int:
+    db = SessionLocal()
+    try:
+        if kind == "maps":
+            return crud_map.add_view_counts(db, {int(map_id): delta for map_id, delta in deltas.items()})
+        return crud_rest.add_view_counts(db, deltas)
+    finally:
+        db.close()
+
+async def flush_views(redis) -> int:
+    flushed = 0
+    for kind in VIEW_KEYS:
+        deltas = take_views(redis, kind)
+        if not deltas:
+            continue
+        try:
+            flushed += await asyncio.to_thread(save_views, kind, deltas)
+        except Exception:
+            restore_views(redis, kind, deltas)
+            raise
+        bump_trending(redis, kind, deltas, "view")
+    return flushed
+
+async def run_view_flusher():
+    redis = get_redis()
+    try:
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await flush_views(redis)
+            except Exception as e:
+                logger.error(f"View counter flush error: {e}")
+    finally:
+        redis.close()
@@ -4,15 +4,27 @@ This module initializes a FastAPI application and sets up CORS middleware.
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.v1.routers import users, maps, restaurants, comments, diaries, bots, collections
+from app.api.v1.routers import users, maps, restaurants, comments, diaries, bots, collections, metrics
 from app.db.init_db import create_tables
+from app.services import places_api
+from app.jobs.place_refresh import run_place_refresh_worker
+from app.jobs.view_counts import run_view_flusher
+from app.jobs.rebuild_leaderboards import ensure_leaderboards
 from contextlib import asynccontextmanager
+import asyncio
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_tables()
+    ensure_leaderboards()
+    places_api.init_client()
+    refresh_worker = asyncio.create_task(run_place_refresh_worker())
+    view_flusher = asyncio.create_task(run_view_flusher())
     yield
+    refresh_worker.cancel()
+    view_flusher.cancel()
+    await places_api.close_client()
     # await database.disconnect()
 
 
@@ -29,6 +41,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count"],
 )
 
 
@@ -41,6 +54,7 @@ app.include_router(comments.router)
 app.include_router(diaries.router)
 app.include_router(bots.router)
 app.include_router(collections.router)
+app.include_router(metrics.router)
 
 # Optional: Simple root endpoint to check API status
 @app.get("/") 
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Float, String, DateTime, Boolean, ARRAY, ForeignKey
+from sqlalchemy import Column, Integer, Float, String, DateTime, Boolean, ARRAY, ForeignKey, Index
 from datetime import datetime
 from app.db.database import Base
 
@@ -10,6 +10,9 @@ class User(Base):
     avatar_url = Column(String, index=True)
     created = Column(DateTime, default=datetime.now)
     map_id = Column(Integer, index=True)
+    __table_args__ = (
+        Index("ix_users_created_user_id", "created", "user_id"),
+    )
 
 class Map(Base):
     __tablename__ = "maps"
@@ -17,14 +20,34 @@ class Map(Base):
     map_name = Column(String, index=True)
     lat = Column(Float, index=True)
     lng = Column(Float, index=True)
+    # Bounding box of the map's restaurants; lat/lng hold their centroid
+    min_lat = Column(Float)
+    min_lng = Column(Float)
+    max_lat = Column(Float)
+    max_lng = Column(Float)
+    extent_cnt = Column(Integer, default=0, server_default="0", nullable=False)  # restaurants in the centroid
     icon_url = Column(String, index=True)
     author = Column(Integer, ForeignKey("users.user_id"),nullable=False)
-    tags =  Column(ARRAY(String), index=True)
+    tags =  Column(ARRAY(String))
     created = Column(DateTime, default=datetime.now)
-    rest_ids =  Column(ARRAY(String), index=True)
-    view_cnt = Column(Integer, default=0,index=True)
+    view_cnt = Column(Integer, default=0, server_default="0", nullable=False, index=True)
     description = Column(String, index=True)
+    __table_args__ = (
+        Index("ix_maps_created_map_id", "created", "map_id"),
+        Index("ix_maps_tags_gin", "tags", postgresql_using="gin"),
+    )
     
+class MapRestaurant(Base):
+    __tablename__ = "map_restaurants"
+    map_id = Column(Integer, ForeignKey("maps.map_id", ondelete="CASCADE"), primary_key=True)
+    place_id = Column(String, primary_key=True)
+    position = Column(Integer, nullable=False)
+    added_at = Column(DateTime, default=datetime.now)
+    __table_args__ = (
+        Index("ix_map_restaurants_map_id_position", "map_id", "position"),
+        Index("ix_map_restaurants_place_id", "place_id"),
+    )
+
 class Restaurant(Base):
     __tablename__ = "restaurants"
     google_place_id = Column(String, primary_key=True, index=True)
@@ -36,7 +59,16 @@ class Restaurant(Base):
     rating = Column(Float, index=True)
     photo_url = Column(String, index=True)
     created = Column(DateTime, default=datetime.now)
-    view_cnt = Column(Integer, default=0, index=True)
+    view_cnt = Column(Integer, default=0, server_default="0", nullable=False, index=True)
+    collect_cnt = Column(Integer, default=0, server_default="0", nullable=False, index=True)
+    like_cnt = Column(Integer, default=0, server_default="0", nullable=False, index=True)
+    dislike_cnt = Column(Integer, default=0, server_default="0", nullable=False, index=True)
+    tile_key = Column(Integer)
+    __table_args__ = (
+        Index("ix_restaurants_tile_lat_lng", "tile_key", "lat", "lng"),
+        Index("ix_restaurants_collect_cnt_place_id", "collect_cnt", "google_place_id"),
+        Index("ix_restaurants_created_place_id", "created", "google_place_id"),
+    )
 
 class Comment(Base):
     __tablename__ = "comments"
@@ -45,6 +77,9 @@ class Comment(Base):
     author = Column(Integer, ForeignKey("users.user_id"), nullable=False)
     content = Column(String, index=True)
     created = Column(DateTime, default=datetime.now)
+    __table_args__ = (
+        Index("ix_comments_diary_id_created", "diary_id", "created"),
+    )
     
 class Diary(Base):
     __tablename__ = "diaries"
@@ -52,9 +87,15 @@ class Diary(Base):
     user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
     rest_id = Column(String, ForeignKey("restaurants.google_place_id"), nullable=False)
     created = Column(DateTime, default=datetime.now)
-    items = Column(ARRAY(String), index=True)
+    items = Column(ARRAY(String))
     content = Column(String, index=True)
     photos = Column(ARRAY(String), index=True)
+    __table_args__ = (
+        Index("ix_diaries_created_diary_id", "created", "diary_id"),
+        Index("ix_diaries_items_gin", "items", postgresql_using="gin"),
+        Index("ix_diaries_rest_id", "rest_id"),
+        Index("ix_diaries_user_id_created", "user_id", "created"),
+    )
     
 
 class UserRestCollect(Base):
@@ -83,16 +124,26 @@ class UserFollow(Base):
     follow_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     follow = Column(Integer, ForeignKey("users.user_id"), nullable=False)
     be_followed = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    __table_args__ = (
+        Index("ix_user_follow_follow_be_followed", "follow", "be_followed"),
+        Index("ix_user_follow_be_followed", "be_followed"),
+    )
 
 class UserDiaryCollect(Base):
     __tablename__ = "user_diary_collect"
     user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True,nullable=False)
     diary_id = Column(Integer, ForeignKey("diaries.diary_id"), primary_key=True,nullable=False)
+    __table_args__ = (
+        Index("ix_user_diary_collect_diary_id", "diary_id"),
+    )
 
 class UserDiaryLike(Base):
     __tablename__ = "user_diary_like"
     user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True,nullable=False)
     diary_id = Column(Integer, ForeignKey("diaries.diary_id"), primary_key=True,nullable=False)
+    __table_args__ = (
+        Index("ix_user_diary_like_diary_id", "diary_id"),
+    )
 
 class UserMapCollect(Base):
     __tablename__ = "user_map_collect"
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, HttpUrl
-from typing import List
+from typing import List, Optional
 class SimplifiedMap(BaseModel):
     """For simplified maps in the Get_Maps listing"""
     id: int
@@ -62,6 +62,7 @@ class PaginatedMapResponse(BaseModel):
     maps: List[SimplifiedMap]
     limit: int
     offset: int
+    nextCursor: Optional[str] = Field(None, description="Opaque cursor for the next page, null on the last page")
 
 class CompleteMap(SimplifiedMap):
     """For complete maps in the Get_Maps listing"""
@@ -1,10 +1,10 @@
 from pydantic import BaseModel, Field, HttpUrl
 from app.schemas.diaries import SimplifiedDiary
-from typing import List
+from typing import List, Optional
 class SimplifiedRestaurant(BaseModel):
     name: str
     location: dict
-    rating: float = Field(None, ge=0, le=5)
+    rating: Optional[float] = Field(None, ge=0, le=5)
     placeId: str
     viewCount: int = Field(0, ge=0)  
     collectCount: int = Field(..., ge=0)
@@ -14,6 +14,7 @@ class SimplifiedRestaurant(BaseModel):
     hasLiked: bool = Field(..., description="Flag indicating if the restaurant is currently being liked by the authenticated user")
     hasDisliked: bool = Field(..., description="Flag indicating if the restaurant is currently being disliked by the authenticated user")
     photoUrl: str = Field(None)
+    distance: Optional[float] = Field(None, description="Distance in meters from the search center, only set when ordered by distance")
 
 SimplifiedRestaurant_Ex = [
     {
@@ -85,6 +86,23 @@ class PaginatedRestaurantResponse(BaseModel):
     restaurants: List[SimplifiedRestaurant]
     limit: int
     offset: int
+    nextCursor: Optional[str] = Field(None, description="Opaque cursor for the next page, null on the last page")
+
+class ClusterRepresentative(BaseModel):
+    placeId: str
+    name: str
+    rating: float = Field(None, ge=0, le=5)
+    photoUrl: str = Field(None)
+
+class RestaurantCluster(BaseModel):
+    count: int = Field(..., ge=1)
+    center: dict = Field(..., description="Centroid of the restaurants in the cluster")
+    representative: ClusterRepresentative = Field(..., description="Top-rated restaurant of the cluster")
+
+class RestaurantClusterResponse(BaseModel):
+    zoom: int
+    cellSize: float = Field(..., description="Side of the grid cells the clusters were built from, in degrees")
+    clusters: List[RestaurantCluster]
 
 class Restaurant(SimplifiedRestaurant):
     telephone: str
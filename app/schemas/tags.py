@@ -0,0 +1,5 @@
+from pydantic import BaseModel
+
+class TagCount(BaseModel):
+    tag: str
+    count: int
@@ -0,0 +1,23 @@
+"""
+Short-lived cache of listing totals. Pages are cheap once they are limited in SQL,
+but an exact count(*) still visits every matching row, so the total is computed
+at most once per COUNT_TTL for each combination of filters.
+"""
+import hashlib
+import json
+
+COUNT_TTL = 60
+
+def count_key(scope: str, filters: dict) -> str:
+    digest = hashlib.sha1(json.dumps(filters, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+    return f"count:{scope}:{digest}"
+
+def cached_count(redis, scope: str, filters: dict, count) -> int:
+    """The cached total of a listing, calling count() to compute it on a miss."""
+    key = count_key(scope, filters)
+    cached = redis.get(key)
+    if cached is not None:
+        return int(cached)
+    total = count()
+    redis.set(key, total, ex=COUNT_TTL)
+    return total
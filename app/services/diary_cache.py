@@ -0,0 +1,34 @@
+"""
+Cache of the user-independent part of GET /api/v1/diaries/{id}: the diary, its
+counts and its replies, as built by crud.diaries.get_diary_detail.
+
+Same scheme as app.services.restaurant_cache: entries live under
+diary:v<FORMAT>:<diary_id>:<version>, committed writes bump the version
+(app.crud.stale), and the viewer's hasFavorited/hasCollected flags are overlaid
+from one small query.
+"""
+from app.crud import diaries as crud_diary
+from app.crud.flags import DIARY_FLAGS, resolve_flags
+from app.crud.stale import DIARY, version_key
+from app.schemas.diaries import DiaryDisplay
+from app.services.metrics import incr_metric
+
+DETAIL_FORMAT = 2  # bump when the cached DiaryDisplay layout changes
+DETAIL_TTL = 3600
+
+def detail_key(diary_id: int, version) -> str:
+    return f"diary:v{DETAIL_FORMAT}:{diary_id}:{int(version or 0)}"
+
+def get_diary_detail(db, redis, diary_id: int, user_id: int) -> DiaryDisplay:
+    version = redis.get(version_key(DIARY, diary_id))
+    cached = redis.get(detail_key(diary_id, version))
+    if cached is not None:
+        incr_metric(redis, "diary_detail", "hit")
+        diary = DiaryDisplay.model_validate_json(cached)
+    else:
+        incr_metric(redis, "diary_detail", "miss")
+        diary = crud_diary.get_diary_detail(db, diary_id)
+        redis.set(detail_key(diary_id, version), diary.model_dump_json(exclude_none=True), ex=DETAIL_TTL)
+    if user_id == -1:
+        return diary
+    return diary.model_copy(update=resolve_flags(db, DIARY_FLAGS, user_id, [diary_id])[diary_id])
@@ -0,0 +1,161 @@
+"""
+Leaderboards of maps and restaurants in Redis sorted sets.
+
+rank:maps:collect holds every map with at least one collect, scored
+count * 2**32 + map_id, so ZREVRANGE returns exactly the SQL keyset order
+(collect count desc, map_id desc) and position i on the board is position i of
+the full listing. Collects and uncollects move the score by 2**32. The board is
+only trusted (and maintained) once app.jobs.rebuild_leaderboards has built it.
+A rebuild holds rank:maps:collect:rebuild; while it does, collects are also
+journaled, and the journal is replayed onto the rebuilt board in the same script
+that swaps it in (SWAP_SCRIPT), so collects made during the rebuild are not lost.
+
+rank:{kind}:trending:log holds recently active maps and restaurants. An event is
+worth weight * 2 ** ((now - TRENDING_EPOCH) / TRENDING_HALF_LIFE): newer events
+count exponentially more, which ranks exactly like decaying every older score,
+without rewriting them. That weight grows by ~2**122 a year, so the boards store
+log2 of the sum instead and add events with a log-add-exp (TRENDING_SCRIPT); the
+log score only grows by ~122 a year. prune_trending drops members whose activity
+has decayed away.
+"""
+import math
+import time
+
+COLLECT_BOARD = "rank:maps:collect"
+COLLECT_BOARD_READY = "rank:maps:collect:ready"
+COLLECT_BOARD_LOCK = "rank:maps:collect:rebuild"
+COLLECT_JOURNAL = "rank:maps:collect:journal"
+TRENDING_BOARDS = {"maps": "rank:maps:trending:log", "restaurants": "rank:restaurants:trending:log"}
+LEGACY_TRENDING_BOARDS = ["rank:maps:trending", "rank:restaurants:trending"]  # linear scores, overflow-prone
+ID_SPACE = 2 ** 32
+
+TRENDING_EPOCH = 1704067200  # 2024-01-01 UTC
+TRENDING_HALF_LIFE = 3 * 86400
+TRENDING_FLOOR = 2 ** -10  # pruned once worth less than this share of a fresh collect
+TRENDING_WEIGHTS = {"collect": 3.0, "like": 1.0, "view": 0.1}
+
+# Lua: add delta collects to map_id on board. Members whose count drops to zero leave the board.
+APPLY_COLLECT = f"""
+local function apply_collect(board, map_id, delta)
+    local step = tonumber(delta) * {ID_SPACE}
+    local current = redis.call("zscore", board, map_id)
+    local score = current and tonumber(current) + step or step + tonumber(map_id)
+    if score < {ID_SPACE} then
+        redis.call("zrem", board, map_id)
+    else
+        redis.call("zadd", board, score, map_id)
+    end
+end
+"""
+
+# KEYS: board, ready marker, rebuild lock, journal. ARGV: map_id, collect delta.
+COLLECT_SCRIPT = APPLY_COLLECT + """
+if redis.call("exists", KEYS[3]) == 1 then
+    redis.call("hincrby", KEYS[4], ARGV[1], ARGV[2])
+    redis.call("pexpire", KEYS[4], redis.call("pttl", KEYS[3]))
+end
+if redis.call("exists", KEYS[2]) == 0 then
+    return false
+end
+apply_collect(KEYS[1], ARGV[1], ARGV[2])
+return 1
+"""
+
+# KEYS: rebuilt board, board, ready marker, rebuild lock, journal. ARGV: lock token.
+# Swaps the rebuilt board in, replays the journal and ends the rebuild, unless the
+# lock's lease ran out (and another rebuild may have started meanwhile).
+SWAP_SCRIPT = APPLY_COLLECT + """
+if redis.call("get", KEYS[4]) ~= ARGV[1] then
+    redis.call("del", KEYS[1])
+    return false
+end
+if redis.call("exists", KEYS[1]) == 1 then
+    redis.call("rename", KEYS[1], KEYS[2])
+else
+    redis.call("del", KEYS[2])
+end
+local journal = redis.call("hgetall", KEYS[5])
+for i = 1, #journal, 2 do
+    apply_collect(KEYS[2], journal[i], journal[i + 1])
+end
+redis.call("del", KEYS[4], KEYS[5])
+redis.call("set", KEYS[3], 1)
+return #journal / 2
+"""
+
+# KEYS: rebuild lock. ARGV: lock token. Ends a failed rebuild without touching another's lock.
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# ARGV: member, log2 of the event weight. score = log2(2**score + 2**event), computed
+# around the larger of the two so neither power can overflow.
+TRENDING_SCRIPT = """
+local event = tonumber(ARGV[2])
+local current = redis.call("zscore", KEYS[1], ARGV[1])
+local score = event
+if current then
+    current = tonumber(current)
+    local high = math.max(current, event)
+    local low = math.min(current, event)
+    score = high + math.log(1 + 2 ^ (low - high)) / math.log(2)
+end
+redis.call("zadd", KEYS[1], score, ARGV[1])
+return 1
+"""
+
+def collect_score(count: int, map_id: int) -> int:
+    return count * ID_SPACE + map_id
+
+def record_map_collect(redis, map_id: int, delta: int):
+    redis.eval(COLLECT_SCRIPT, 4, COLLECT_BOARD, COLLECT_BOARD_READY, COLLECT_BOARD_LOCK, COLLECT_JOURNAL, map_id, delta)
+
+def remove_map(redis, map_id: int):
+    pipe = redis.pipeline(transaction=False)
+    pipe.zrem(COLLECT_BOARD, map_id)
+    pipe.zrem(TRENDING_BOARDS["maps"], map_id)
+    pipe.execute()
+
+def trending_weight(now: float = None) -> float:
+    """log2 of the weight of an event happening now."""
+    return ((now or time.time()) - TRENDING_EPOCH) / TRENDING_HALF_LIFE
+
+def bump_trending(redis, kind: str, counts: dict, event: str):
+    """Add {id: number of events} to the trending board of maps or restaurants."""
+    step = math.log2(TRENDING_WEIGHTS[event]) + trending_weight()
+    pipe = redis.pipeline(transaction=False)
+    for id_, times in counts.items():
+        if times <= 0:
+            continue
+        pipe.eval(TRENDING_SCRIPT, 1, TRENDING_BOARDS[kind], id_, step + math.log2(times))
+    pipe.execute()
+
+def prune_trending(redis) -> int:
+    floor = math.log2(TRENDING_WEIGHTS["collect"] * TRENDING_FLOOR) + trending_weight()
+    return sum(redis.zremrangebyscore(board, "-inf", floor) for board in TRENDING_BOARDS.values())
+
+def collect_page(redis, offset: int, limit: int, reverse: bool = False) -> list[int] | None:
+    """
+    Map ids of a collectCount page, or None when the board cannot answer it: not
+    built yet, or the page reaches past the maps with collects (or, reversed, starts
+    among the uncollected ones), which only SQL can order.
+    """
+    pipe = redis.pipeline(transaction=False)
+    pipe.exists(COLLECT_BOARD_READY)
+    pipe.zcard(COLLECT_BOARD)
+    ready, size = pipe.execute()
+    if not ready or reverse or offset + limit > size:
+        return None
+    return [int(member) for member in redis.zrevrange(COLLECT_BOARD, offset, offset + limit - 1)]
+
+def trending_page(redis, kind: str, offset: int, limit: int, reverse: bool = False) -> tuple[int, list[str]]:
+    """(number of trending items, ids of the page)."""
+    board = TRENDING_BOARDS[kind]
+    pipe = redis.pipeline(transaction=False)
+    pipe.zcard(board)
+    pipe.zrange(board, offset, offset + limit - 1, desc=not reverse)
+    total, members = pipe.execute()
+    return total, [member.decode() for member in members]
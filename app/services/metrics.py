@@ -0,0 +1,18 @@
+"""
+Process-independent counters kept in Redis hashes (metrics:<group> -> field -> count),
+so numbers from every replica and worker add up in one place.
+"""
+
+def incr_metric(redis, group: str, field: str, amount: int = 1):
+    redis.hincrby(f"metrics:{group}", field, amount)
+
+def get_metrics(redis) -> dict[str, dict[str, int]]:
+    metrics = {}
+    for key in redis.scan_iter(match="metrics:*"):
+        group = key.decode().split(":", 1)[1]
+        counters = {field.decode(): int(value) for field, value in redis.hgetall(key).items()}
+        if "hit" in counters or "miss" in counters:
+            lookups = counters.get("hit", 0) + counters.get("miss", 0)
+            counters["hit_ratio"] = round(counters.get("hit", 0) / lookups, 4)
+        metrics[group] = counters
+    return metrics
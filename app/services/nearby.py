@@ -0,0 +1,35 @@
+from starlette.concurrency import run_in_threadpool
+from app.core.geo import tile_center
+from app.crud.restaurants import bulk_insert
+from app.schemas.restaurants import CreateRestaurant
+from app.services.places_api import search_nearby_restaurants
+from app.services.redis_query import get_cached_places, set_cached_places, get_places_cache_key, radius_bucket
+from app.services.single_flight import single_flight
+from app.jobs.place_ingest import schedule_remaining_pages
+
+async def get_nearby_places(db, redis, keyword, lat, lng, radius=1000):
+    """
+    Nearby Search results for the grid cell containing (lat, lng), served from the
+    shared Redis cache. On a miss a single worker across all replicas searches the
+    cell center, upserts the results and fills the cache; concurrent callers for
+    the same cell wait for that result instead of calling Google themselves.
+    Only the first page is awaited; further pages are ingested in the background.
+    """
+    places = get_cached_places(redis, lat, lng, keyword, radius)
+    if places is not None:
+        return places
+
+    async def fetch():
+        center_lat, center_lng = tile_center(lat, lng)
+        places, page_token = await search_nearby_restaurants(keyword, center_lat, center_lng, radius_bucket(radius))
+        await run_in_threadpool(bulk_insert, db, [CreateRestaurant(**place) for place in places])
+        set_cached_places(redis, lat, lng, keyword, radius, places, complete=not page_token)
+        if page_token:
+            schedule_remaining_pages(lat, lng, keyword, radius, places, page_token)
+        return places
+
+    def fallback():
+        return get_cached_places(redis, lat, lng, keyword, radius) or []
+
+    key = get_places_cache_key(lat, lng, keyword, radius)
+    return await single_flight(redis, "places", key, fetch, fallback)
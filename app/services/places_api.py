@@ -1,6 +1,6 @@
-import googlemaps
-import requests
-import json
+import asyncio
+import random
+import httpx
 from app.schemas.restaurants import FullCreateRestaurant
 from app.core.config import Config
 
@@ -8,20 +8,74 @@ api_key = Config.GOOGLE_MAPS_API_KEY
 if not api_key:
     raise ValueError("No API key provided. Set GOOGLE_MAPS_API_KEY environment variable.")
 
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.2  # seconds; retry n sleeps uniformly in [0, BACKOFF_BASE * 2**n]
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_client: httpx.AsyncClient = None
+
+class PageTokenNotReady(Exception):
+    pass
+
+def init_client():
+    """Create the shared Places HTTP client. Called once per worker from the app lifespan."""
+    global _client
+    _client = httpx.AsyncClient(
+        base_url=Config.PLACES_API_URL,
+        timeout=httpx.Timeout(5.0, connect=2.0),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30),
+    )
+    return _client
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def get_client() -> httpx.AsyncClient:
+    return _client or init_client()
+
+async def places_request(path: str, params: dict) -> dict:
+    """
+    GET a Places web service endpoint with the shared client.
+    Transport errors, 429/5xx responses and UNKNOWN_ERROR bodies are retried
+    with exponential backoff and full jitter.
+    """
+    client = get_client()
+    for attempt in range(MAX_RETRIES + 1):
+        last_attempt = attempt == MAX_RETRIES
+        try:
+            response = await client.get(path, params={**params, 'key': api_key})
+        except httpx.TransportError:
+            if last_attempt:
+                raise
+        else:
+            if response.status_code not in RETRY_STATUSES or last_attempt:
+                response.raise_for_status()
+                body = response.json()
+                if body.get('status') != 'UNKNOWN_ERROR' or last_attempt:
+                    return body
+        await asyncio.sleep(random.uniform(0, BACKOFF_BASE * 2 ** attempt))
+
 async def get_places(lat, lng, radius):
     """
     Get places around a given latitude and longitude with a given radius.
     """
-    gmaps = googlemaps.Client(key=api_key)
-    places = gmaps.places(query="restaurant", location=f"{lat},{lng}", radius=radius)
-    return places
+    return await places_request('/textsearch/json', {
+        'query': 'restaurant',
+        'location': f'{lat},{lng}',
+        'radius': radius,
+    })
 
 async def get_place_details(place_id):
     """
     Get details about a specific place.
     """
-    gmaps = googlemaps.Client(key=api_key)
-    place = gmaps.place(place_id, language='zh-TW')['result']
+    body = await places_request('/details/json', {'place_id': place_id, 'language': 'zh-TW'})
+    if body.get('status') != 'OK':
+        raise ValueError(f"Place details for {place_id} failed: {body.get('status')}")
+    place = body['result']
     place_id = place['place_id']
     location = place['geometry']['location']
     name = place.get('name', '')
@@ -40,20 +94,30 @@ async def get_place_details(place_id):
         photo_url=photoUrl
     )
 
-def search_nearby_restaurants(keyword, lat, lng, radius=1000):
-    url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
-    params = {
-        'keyword': keyword,
-        'language': 'zh-TW',
-        'location': f'{lat},{lng}',
-        'radius': 1000 if keyword else radius,
-        'type': 'restaurant',
-        'key': api_key,
-        'opennow': True,
-    }
+async def search_nearby_restaurants(keyword, lat, lng, radius=1000, page_token=None):
+    """
+    One page (up to 20 places) of Nearby Search results.
+    Returns the places and the token of the next page, or None on the last page.
+    Google rejects a fresh token with INVALID_REQUEST until it becomes valid a
+    couple of seconds later; that status is raised as PageTokenNotReady.
+    """
+    if page_token:
+        params = {'pagetoken': page_token}
+    else:
+        params = {
+            'language': 'zh-TW',
+            'location': f'{lat},{lng}',
+            'radius': 1000 if keyword else radius,
+            'type': 'restaurant',
+            'opennow': 'true',
+        }
+        if keyword:
+            params['keyword'] = keyword
     
-    response = requests.get(url, params=params)
-    results = response.json().get('results', [])
+    body = await places_request('/nearbysearch/json', params)
+    if page_token and body.get('status') == 'INVALID_REQUEST':
+        raise PageTokenNotReady(page_token)
+    results = body.get('results', [])
     filtered_results = [
         {
             'name': result.get('name', ''),
@@ -67,5 +131,4 @@ def search_nearby_restaurants(keyword, lat, lng, radius=1000):
         } 
         for result in results
     ]
-    return filtered_results
-
+    return filtered_results, body.get('next_page_token')
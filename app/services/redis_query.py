@@ -1,26 +1,59 @@
+import json
 import time
+from app.core.geo import tile_key
 
-def get_redis_key(lat, lng):
-    """Generate a Redis key based on rounded latitude and longitude."""
-    return f"query:{round(lat, 2)}:{round(lng, 2)}"
+PLACES_CACHE_TTL = 86400
+PLACES_INGEST_LEASE = 60
+RADIUS_BUCKETS = [500, 1000, 2000, 5000, 10000, 20000, 50000]
 
-def need_query_position(redis, lat, lng):
-    """Check if the coordinates have been queried in the last day."""
-    key = get_redis_key(lat, lng)
-    last_queried = redis.get(key)
-    if last_queried is None or (time.time() - float(last_queried)) > 86400:
-        redis.set(key, time.time())
-        return True
-    return False
+def radius_bucket(radius: int) -> int:
+    """Round the search radius up to a fixed bucket so similar radii share cache entries."""
+    for bucket in RADIUS_BUCKETS:
+        if radius <= bucket:
+            return bucket
+    return RADIUS_BUCKETS[-1]
+
+def get_places_cache_key(lat, lng, keyword, radius):
+    """Generate the Places cache key for a grid cell, search keyword and radius bucket."""
+    keyword = (keyword or "").strip().lower()
+    return f"places:{tile_key(lat, lng)}:{radius_bucket(radius)}:{keyword}"
+
+def get_cached_places(redis, lat, lng, keyword, radius):
+    """Return the cached Nearby Search results for the cell, or None on a miss."""
+    cached = redis.get(get_places_cache_key(lat, lng, keyword, radius))
+    if cached is None:
+        return None
+    return json.loads(cached)['places']
+
+def set_cached_places(redis, lat, lng, keyword, radius, places, complete=True):
+    """
+    Cache the filtered Nearby Search results of the cell.
+    A complete cell is kept for a day; a cell whose remaining pages are still being
+    ingested only for PLACES_INGEST_LEASE, so it is searched again if ingestion dies.
+    """
+    key = get_places_cache_key(lat, lng, keyword, radius)
+    value = json.dumps({'complete': complete, 'places': places}, ensure_ascii=False)
+    redis.set(key, value, ex=PLACES_CACHE_TTL if complete else PLACES_INGEST_LEASE)
+
+def query_key(place_id):
+    # v2: the unversioned query:{place_id} keys were written without a TTL and never
+    # expire, which would make SET NX below fail forever for every place seen before.
+    return f"query:v2:{place_id}"
 
 def need_query_place(redis, place_id):
-    """Check if the place has been queried in the last day."""
-    key = f"query:{place_id}"
-    last_queried = redis.get(key)
-    if last_queried is None or (time.time() - float(last_queried)) > 86400:
-        redis.set(key, time.time())
-        return True
-    return False
+    """
+    Check if the place has been queried in the last day.
+    SET NX makes the check-and-mark atomic, so only one caller per day gets True.
+    """
+    return bool(redis.set(query_key(place_id), time.time(), nx=True, ex=86400))
+
+def mark_place_queried(redis, place_id):
+    """Record that the place details were just fetched."""
+    redis.set(query_key(place_id), time.time(), ex=86400)
+
+def clear_place_queried(redis, place_id):
+    """Forget the last fetch so the next view schedules another refresh."""
+    redis.delete(query_key(place_id))
 
 def set_token_cache(redis, token, user_id):
     """Cache the token for 1 hours."""
@@ -0,0 +1,38 @@
+"""
+Cache of the user-independent part of GET /api/v1/restaurants/{place_id}.
+
+Entries live under restaurant:v<FORMAT>:<place_id>:<version>. The crud writes
+invalidate by bumping the per-place version on commit (app.crud.stale) instead of
+deleting the entry, so a reader that loaded the restaurant from the database before
+a write cannot store its stale copy under the key later readers look up. The
+per-user flags and the view count are never cached: views are flushed every 30
+seconds and would keep invalidating the most viewed places, so both are overlaid
+from small queries.
+"""
+from app.crud import restaurants as crud_rest
+from app.crud.stale import RESTAURANT, version_key
+from app.schemas.restaurants import Restaurant
+from app.services.metrics import incr_metric
+
+DETAIL_FORMAT = 2  # bump when the cached Restaurant layout changes
+DETAIL_TTL = 3600
+
+def detail_key(place_id: str, version) -> str:
+    return f"restaurant:v{DETAIL_FORMAT}:{place_id}:{int(version or 0)}"
+
+def get_restaurant_detail(db, redis, place_id: str, user_id: int) -> Restaurant:
+    version = redis.get(version_key(RESTAURANT, place_id))
+    cached = redis.get(detail_key(place_id, version))
+    if cached is not None:
+        incr_metric(redis, "restaurant_detail", "hit")
+        restaurant = Restaurant.model_validate_json(cached)
+        restaurant.viewCount = crud_rest.get_view_count(db, place_id)
+    else:
+        incr_metric(redis, "restaurant_detail", "miss")
+        restaurant = crud_rest.get_restaurant(db, place_id, -1)
+        if restaurant is None:
+            return None
+        redis.set(detail_key(place_id, version), restaurant.model_dump_json(exclude_none=True, exclude={"viewCount"}), ex=DETAIL_TTL)
+    if user_id == -1:
+        return restaurant
+    return restaurant.model_copy(update=crud_rest.get_restaurant_flags(db, place_id, user_id))
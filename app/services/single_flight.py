@@ -0,0 +1,74 @@
+import asyncio
+import json
+from uuid import uuid4
+from app.services.metrics import incr_metric
+
+LOCK_LEASE = 15  # seconds; a crashed leader blocks the key for at most this long
+LEASE_RENEWAL = LOCK_LEASE / 3  # a live leader extends its lease this often, however long fetch() takes
+RESULT_TTL = 30
+WAIT_TIMEOUT = 10
+POLL_INTERVAL = 0.05
+
+# Delete the lock only if we still own it, so a leader whose lease ran out
+# cannot release the lock of the leader that replaced it.
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+RENEW_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("expire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+async def keep_lease(redis, lock_key: str, token: str):
+    """Renew the lock until cancelled, so it cannot expire under a slow but live leader."""
+    while True:
+        await asyncio.sleep(LEASE_RENEWAL)
+        if not redis.eval(RENEW_SCRIPT, 1, lock_key, token, LOCK_LEASE):
+            return
+
+async def single_flight(redis, name: str, key: str, fetch, fallback=None):
+    """
+    Run `fetch` on exactly one worker across all replicas for the same key.
+
+    The first caller takes a leased Redis lock, awaits fetch() and publishes its
+    JSON-serializable result for a short while. Everyone else waits for that
+    result; if the leader fails or the wait times out they return fallback()
+    instead (or None). The leader renews its lease while fetch() runs, since the
+    Places retries alone can outlast LOCK_LEASE. Exceptions from fetch() propagate
+    to the leader's caller. Outcomes are counted under metrics:single_flight as
+    <name>:leader, <name>:shared and <name>:fallback.
+    """
+    lock_key = f"flight:lock:{key}"
+    result_key = f"flight:result:{key}"
+    token = uuid4().hex
+
+    if redis.set(lock_key, token, nx=True, ex=LOCK_LEASE):
+        incr_metric(redis, "single_flight", f"{name}:leader")
+        renewal = asyncio.create_task(keep_lease(redis, lock_key, token))
+        try:
+            result = await fetch()
+            redis.set(result_key, json.dumps(result, ensure_ascii=False), ex=RESULT_TTL)
+            return result
+        finally:
+            renewal.cancel()
+            redis.eval(RELEASE_SCRIPT, 1, lock_key, token)
+
+    deadline = asyncio.get_running_loop().time() + WAIT_TIMEOUT
+    while asyncio.get_running_loop().time() < deadline:
+        shared = redis.get(result_key)
+        if shared is not None:
+            incr_metric(redis, "single_flight", f"{name}:shared")
+            return json.loads(shared)
+        if not redis.exists(lock_key):
+            # The leader gave up without publishing a result
+            break
+        await asyncio.sleep(POLL_INTERVAL)
+
+    incr_metric(redis, "single_flight", f"{name}:fallback")
+    return fallback() if fallback else None
@@ -0,0 +1,32 @@
+import json
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from app.models.dbModel import Map, Diary
+from app.services.metrics import incr_metric
+
+# Facet counts are allowed to lag behind writes by up to FACET_TTL seconds
+FACET_TTL = 300
+FACET_SIZE = 100
+TAG_COLUMNS = {"maps": Map.tags, "diaries": Diary.items}
+
+def count_tags(db: Session, column, limit: int = FACET_SIZE) -> list[dict]:
+    """The most used tags of an array column and how often each is used."""
+    tag = func.unnest(column).label('tag')
+    tags = select(tag).where(column.is_not(None)).subquery()
+    stmt = select(tags.c.tag, func.count().label('count')) \
+        .group_by(tags.c.tag) \
+        .order_by(func.count().desc(), tags.c.tag) \
+        .limit(limit)
+    return [row._asdict() for row in db.execute(stmt).all()]
+
+def get_tag_facets(db: Session, redis, kind: str, limit: int) -> list[dict]:
+    """The top `limit` (at most FACET_SIZE) tags of maps or diaries, cached for FACET_TTL."""
+    key = f"tags:{kind}"
+    cached = redis.get(key)
+    if cached is not None:
+        incr_metric(redis, "tag_facets", "hit")
+        return json.loads(cached)[:limit]
+    incr_metric(redis, "tag_facets", "miss")
+    facets = count_tags(db, TAG_COLUMNS[kind])
+    redis.set(key, json.dumps(facets, ensure_ascii=False), ex=FACET_TTL)
+    return facets[:limit]
@@ -0,0 +1,121 @@
+"""
+Following feeds kept in Redis (fan-out on write).
+
+timeline:{user_id} is a sorted set of the diary ids by the users user_id follows,
+scored by creation time and capped at TIMELINE_SIZE. A new diary is pushed to the
+timeline of every follower, a deleted one is taken back out, following backfills
+the followee's recent diaries and unfollowing prunes them.
+
+Authors with more than CELEBRITY_FOLLOWERS followers are not fanned out: they join
+timeline:celebrities, and their diaries are merged into the feed at read time.
+Timelines are built from SQL on the first read and expire after TIMELINE_TTL
+without reads; fan-out only touches timelines that have been built.
+
+fan_out, retract, backfill and prune are registered by the crud writes in
+app.crud.diaries and app.crud.follow and run once the write commits
+(app.crud.stale.on_commit), so they get what they need from SQL as arguments.
+"""
+from datetime import datetime
+import app.crud.feed as crud_feed
+
+TIMELINE_SIZE = 500
+TIMELINE_TTL = 7 * 86400
+CELEBRITY_FOLLOWERS = 5000
+CELEBRITIES = "timeline:celebrities"
+
+# KEYS: (timeline, ready marker) per follower. ARGV: score, diary id, size.
+# The timeline expires with its ready marker, so it never outlives it.
+FAN_OUT_SCRIPT = """
+for i = 1, #KEYS, 2 do
+    local ttl = redis.call("pttl", KEYS[i + 1])
+    if ttl > 0 then
+        redis.call("zadd", KEYS[i], ARGV[1], ARGV[2])
+        redis.call("zremrangebyrank", KEYS[i], 0, -tonumber(ARGV[3]) - 1)
+        redis.call("pexpire", KEYS[i], ttl)
+    end
+end
+return 1
+"""
+
+def timeline_key(user_id: int) -> str:
+    return f"timeline:{user_id}"
+
+def ready_key(user_id: int) -> str:
+    return f"timeline:{user_id}:ready"
+
+def score(created: datetime) -> float:
+    return created.timestamp()
+
+def fan_out(redis, author_id: int, followers: list[int], diary_id: int, created: datetime):
+    if len(followers) > CELEBRITY_FOLLOWERS:
+        # Once a celebrity, always merged on read: their older diaries may still sit in timelines
+        redis.sadd(CELEBRITIES, author_id)
+        return
+    if not followers:
+        return
+    keys = [key for follower in followers for key in (timeline_key(follower), ready_key(follower))]
+    redis.eval(FAN_OUT_SCRIPT, len(keys), *keys, score(created), diary_id, TIMELINE_SIZE)
+
+def retract(redis, followers: list[int], diary_id: int):
+    pipe = redis.pipeline(transaction=False)
+    for follower in followers:
+        pipe.zrem(timeline_key(follower), diary_id)
+    pipe.execute()
+
+def backfill(redis, follower: int, followee: int, diaries: list[tuple[int, datetime]]):
+    """Add followee's newest diaries (as from crud.feed.author_diaries) to follower's timeline."""
+    if not diaries or redis.sismember(CELEBRITIES, followee):
+        return
+    ttl = redis.pttl(ready_key(follower))
+    if ttl <= 0:
+        return
+    key = timeline_key(follower)
+    pipe = redis.pipeline(transaction=False)
+    pipe.zadd(key, {diary_id: score(created) for diary_id, created in diaries})
+    pipe.zremrangebyrank(key, 0, -TIMELINE_SIZE - 1)
+    pipe.pexpire(key, ttl)
+    pipe.execute()
+
+def prune(redis, follower: int, diaries: list[tuple[int, datetime]]):
+    if diaries:
+        redis.zrem(timeline_key(follower), *[diary_id for diary_id, _ in diaries])
+
+def rebuild(db, redis, user_id: int, celebrities: list[int]):
+    diaries = crud_feed.followed_diaries(db, user_id, TIMELINE_SIZE, exclude=celebrities)
+    key = timeline_key(user_id)
+    pipe = redis.pipeline()
+    pipe.delete(key)  # members left from an earlier build may have been deleted or unfollowed since
+    if diaries:
+        pipe.zadd(key, {diary_id: score(created) for diary_id, created in diaries})
+        pipe.zremrangebyrank(key, 0, -TIMELINE_SIZE - 1)
+        pipe.expire(key, TIMELINE_TTL)
+    pipe.set(ready_key(user_id), 1, ex=TIMELINE_TTL)
+    pipe.execute()
+
+def feed_page(db, redis, user_id: int, offset: int, limit: int) -> list[int] | None:
+    """
+    Diary ids of a page of user_id's following feed, newest first, or None when the
+    page reaches past the timeline and only SQL can answer it.
+    """
+    end = offset + limit
+    if end > TIMELINE_SIZE:
+        return None
+    key = timeline_key(user_id)
+    pipe = redis.pipeline(transaction=False)
+    pipe.exists(ready_key(user_id))
+    pipe.smembers(CELEBRITIES)
+    pipe.zrange(key, 0, end - 1, desc=True, withscores=True)
+    pipe.expire(key, TIMELINE_TTL)
+    pipe.expire(ready_key(user_id), TIMELINE_TTL)
+    ready, celebrities, entries, *_ = pipe.execute()
+    celebrities = [int(member) for member in celebrities]
+    if not ready:
+        rebuild(db, redis, user_id, celebrities)
+        entries = redis.zrange(key, 0, end - 1, desc=True, withscores=True)
+
+    feed = {int(member): created for member, created in entries}
+    if celebrities:
+        for diary_id, created in crud_feed.followed_diaries(db, user_id, end, only=celebrities):
+            feed[diary_id] = score(created)
+    ranked = sorted(feed.items(), key=lambda item: (item[1], item[0]), reverse=True)
+    return [diary_id for diary_id, _ in ranked[offset:end]]
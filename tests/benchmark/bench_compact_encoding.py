@@ -0,0 +1,59 @@
+"""
+Encoding cost of a 100-row restaurant page: the regular PaginatedRestaurantResponse
+JSON vs. the columnar JSON and MessagePack layouts of app.core.compact.
+
+Runs without a database: the rows are synthetic result rows shaped like
+crud.restaurants.query_restaurants output (nested location for the regular path,
+flat lat/lng for the compact one).
+"""
+import json
+import random
+from collections import namedtuple
+from fastapi.responses import JSONResponse
+from app.core import compact
+from app.schemas.restaurants import PaginatedRestaurantResponse, SimplifiedRestaurant
+from tests.benchmark.common import measure, report
+
+PAGE = 100
+RUNS = 2000
+
+FIELDS = ["name", "rating", "placeId", "photoUrl", "viewCount", "collectCount", "likeCount", "dislikeCount", "hasCollected", "hasLiked", "hasDisliked"]
+JsonRow = namedtuple("JsonRow", FIELDS + ["location"])
+
+def rows():
+    rng = random.Random(1)
+    for i in range(PAGE):
+        values = dict(
+            name=f"台北牛肉麵 {i}",
+            rating=round(rng.uniform(1, 5), 1),
+            placeId=f"ChIJ{rng.getrandbits(96):024x}",
+            photoUrl="AUGGfZ" + "x" * 400,  # photo references are a few hundred characters long
+            viewCount=rng.randrange(1000),
+            collectCount=rng.randrange(100),
+            likeCount=rng.randrange(100),
+            dislikeCount=rng.randrange(10),
+            hasCollected=rng.random() < 0.1,
+            hasLiked=rng.random() < 0.1,
+            hasDisliked=False,
+        )
+        lat, lng = rng.uniform(24.9, 25.1), rng.uniform(121.4, 121.6)
+        # the compact path gets plain dicts: result rows with the user's flags merged in
+        yield JsonRow(**values, location={"lat": lat, "lng": lng}), {**values, "lat": lat, "lng": lng}
+
+def regular(json_rows):
+    """What the endpoint does today: build the models, then FastAPI serializes the response_model to a JSONResponse."""
+    restaurants = [SimplifiedRestaurant(**row._asdict()) for row in json_rows]
+    page = PaginatedRestaurantResponse(total=1000, restaurants=restaurants, limit=PAGE, offset=0)
+    return JSONResponse(page.model_dump(mode="json")).body
+
+def main():
+    json_rows, compact_rows = zip(*rows())
+    encoders = [("pydantic JSON", lambda: regular(json_rows))]
+    encoders.append(("columnar JSON", lambda: compact.restaurant_page(compact.COLUMNAR_JSON, compact_rows, total=1000, limit=PAGE, offset=0).body))
+    encoders.append(("columnar MessagePack", lambda: compact.restaurant_page(compact.MSGPACK, compact_rows, total=1000, limit=PAGE, offset=0).body))
+    for name, encode in encoders:
+        report(name, measure(lambda i: encode(), RUNS))
+        print(f"{'':<32} payload={len(encode())} bytes")
+
+if __name__ == "__main__":
+    main()
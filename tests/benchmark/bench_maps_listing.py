@@ -0,0 +1,85 @@
+"""
+GET /api/v1/maps page cost at 100k maps: crud.maps.get_maps (page and window count
+in one statement) against the listing it replaced, which fetched every map and
+sliced the page out in Python, and against a page query followed by count(*).
+
+Seeds a scratch database with bench users and maps (a few collects each) and
+removes them afterwards.
+"""
+import random
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+from app.db.database import Base
+from app.crud.maps import count_maps, get_maps, query_sql
+from tests.benchmark.common import get_engine, measure, report
+
+USERS = 1000
+MAPS = 100_000
+COLLECTS_PER_MAP = 3
+PAGE_SIZE = 10
+RUNS = 50
+MARKER = "bench_maps"
+
+def seed(conn):
+    rng = random.Random(11)
+    conn.execute(text(
+        "INSERT INTO users (user_name, email) "
+        "SELECT :marker || '_user_' || i, :marker || '_' || i || '@example.com' FROM generate_series(1, :n) AS i"
+    ), {"marker": MARKER, "n": USERS})
+    user_ids = conn.execute(text("SELECT user_id FROM users WHERE user_name LIKE :marker || '\\_user\\_%'"), {"marker": MARKER}).scalars().all()
+    conn.execute(text(
+        "INSERT INTO maps (map_name, author, created, view_cnt, tags) "
+        "SELECT :marker || '_map_' || i, (:users)[1 + i % cardinality(:users)], now() - i * interval '1 minute', 0, '{}' "
+        "FROM generate_series(1, :n) AS i"
+    ), {"marker": MARKER, "users": user_ids, "n": MAPS})
+    map_ids = conn.execute(text("SELECT map_id FROM maps WHERE map_name LIKE :marker || '\\_map\\_%'"), {"marker": MARKER}).scalars().all()
+    collects = {(rng.choice(user_ids), map_id) for map_id in map_ids for _ in range(COLLECTS_PER_MAP)}
+    conn.execute(
+        text("INSERT INTO user_map_collect (user_id, map_id) VALUES (:user_id, :map_id)"),
+        [{"user_id": user_id, "map_id": map_id} for user_id, map_id in collects]
+    )
+    conn.execute(text("ANALYZE maps; ANALYZE user_map_collect"))
+    conn.commit()
+
+def cleanup(conn):
+    conn.execute(text(
+        "DELETE FROM user_map_collect WHERE map_id IN (SELECT map_id FROM maps WHERE map_name LIKE :marker || '\\_map\\_%')"
+    ), {"marker": MARKER})
+    conn.execute(text("DELETE FROM maps WHERE map_name LIKE :marker || '\\_map\\_%'"), {"marker": MARKER})
+    conn.execute(text("DELETE FROM users WHERE user_name LIKE :marker || '\\_user\\_%'"), {"marker": MARKER})
+    conn.commit()
+
+def main():
+    engine = get_engine()
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    with engine.connect() as conn:
+        cleanup(conn)
+        print(f"Seeding {MAPS} maps...")
+        seed(conn)
+
+        rng = random.Random(3)
+        offsets = [rng.randrange(0, MAPS - PAGE_SIZE) for _ in range(RUNS)]
+        for order_by in ("favCount", "createTime"):
+            query = {"q": None, "orderBy": order_by, "limit": PAGE_SIZE, "auth_user_id": -1}
+
+            def fetch_all_and_slice(i):
+                # The old router: every map from the database, page sliced in Python
+                rows = db.execute(query_sql(order_by=order_by)).all()
+                return len(rows), rows[offsets[i]:offsets[i] + PAGE_SIZE]
+
+            def page_then_count(i):
+                rows = db.execute(query_sql(order_by=order_by).limit(PAGE_SIZE).offset(offsets[i])).all()
+                return count_maps(db), rows
+
+            report(f"{order_by} fetch all + slice", measure(fetch_all_and_slice, RUNS // 10))
+            report(f"{order_by} page + count(*)", measure(page_then_count, RUNS))
+            report(f"{order_by} page + window count", measure(lambda i: get_maps(db, {**query, "offset": offsets[i]}), RUNS))
+            first = get_maps(db, {**query, "offset": 0})
+            report(f"{order_by} cursor page", measure(lambda i: get_maps(db, {**query, "offset": 0, "cursor": first[2]}), RUNS))
+
+        cleanup(conn)
+    db.close()
+
+if __name__ == "__main__":
+    main()
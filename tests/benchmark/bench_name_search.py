@@ -0,0 +1,83 @@
+"""
+Name search benchmark: leading-wildcard LIKE vs. the bigram token index vs. pg_trgm.
+
+Builds a synthetic 1M-row table of Traditional Chinese restaurant names (plus some
+Latin ones) and runs the same one- to four-character queries through each plan,
+using the search functions that init_db installs. The pg_trgm plan is skipped
+when the extension cannot be installed.
+"""
+import random
+from sqlalchemy import text
+from app.core.search import SEARCH_FUNCTIONS
+from tests.benchmark.common import get_engine, measure, report
+
+ROWS = 1_000_000
+RUNS = 200
+PREFIXES = ["台北", "高雄", "阿婆", "老張", "永和", "鼎", "春水", "度小月", "Mr.", "The"]
+DISHES = ["牛肉麵", "拉麵", "小籠包", "鹽酥雞", "滷肉飯", "豆漿", "火鍋", "咖哩", "Pizza", "Burger", "Sushi", "Cafe"]
+SUFFIXES = ["", "店", "專賣店", "本舖", "食堂", " Kitchen", " House", "總店"]
+
+SETUP = [
+    "DROP TABLE IF EXISTS bench_names",
+    "CREATE UNLOGGED TABLE bench_names (id SERIAL PRIMARY KEY, name VARCHAR)",
+]
+
+def names(n):
+    rng = random.Random(3)
+    for i in range(n):
+        yield f"{rng.choice(PREFIXES)}{rng.choice(DISHES)}{rng.choice(SUFFIXES)}{i % 997}"
+
+def queries(n):
+    rng = random.Random(5)
+    pool = ["麵", "拉麵", "小籠", "鹽酥雞", "滷肉飯", "永和豆漿", "pizza", "kitchen", "sus", "本舖"]
+    return [rng.choice(pool) for _ in range(n)]
+
+LIKE_SQL = "SELECT id FROM bench_names WHERE name ILIKE :pattern LIMIT 50"
+TOKENS_SQL = """
+    SELECT id FROM bench_names
+    WHERE search_tokens(name) @> search_query_tokens(:q) AND name ILIKE :pattern LIMIT 50
+"""
+
+def main():
+    engine = get_engine()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        print(f"Building bench_names with {ROWS} rows...")
+        for statement in SETUP + SEARCH_FUNCTIONS:
+            conn.execute(text(statement))
+        batch = []
+        for name in names(ROWS):
+            batch.append({"name": name})
+            if len(batch) == 10_000:
+                conn.execute(text("INSERT INTO bench_names (name) VALUES (:name)"), batch)
+                batch = []
+        conn.execute(text("VACUUM ANALYZE bench_names"))
+
+        params = [{"q": q, "pattern": f"%{q}%"} for q in queries(RUNS)]
+        like, tokens = text(LIKE_SQL), text(TOKENS_SQL)
+
+        report("ILIKE seq scan", measure(lambda i: conn.execute(like, params[i]).all(), RUNS))
+
+        conn.execute(text("CREATE INDEX bench_names_tokens ON bench_names USING gin (search_tokens(name))"))
+        conn.execute(text("ANALYZE bench_names"))
+        report("bigram token GIN", measure(lambda i: conn.execute(tokens, params[i]).all(), RUNS))
+
+        try:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        except Exception as e:
+            print(f"pg_trgm unavailable, skipping: {e}")
+        else:
+            conn.execute(text("CREATE INDEX bench_names_trgm ON bench_names USING gin (name gin_trgm_ops)"))
+            conn.execute(text("ANALYZE bench_names"))
+            report("pg_trgm GIN", measure(lambda i: conn.execute(like, params[i]).all(), RUNS))
+            cjk = conn.execute(text("SELECT cardinality(show_trgm('台北車站')) > 0")).scalar()
+            print(f"pg_trgm extracts trigrams from CJK text in this locale: {cjk}")
+
+        for name, query in (("bigram tokens", tokens), ("ILIKE", like)):
+            print(f"\nEXPLAIN ANALYZE ({name}, q={params[0]['q']}):")
+            plan = conn.execute(text("EXPLAIN (ANALYZE, BUFFERS) " + query.text), params[0]).scalars()
+            print("\n".join(plan))
+
+        conn.execute(text("DROP TABLE bench_names"))
+
+if __name__ == "__main__":
+    main()
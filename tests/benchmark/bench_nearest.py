@@ -0,0 +1,68 @@
+"""
+Nearest-k benchmark: haversine over a plain lat/lng range vs. the tile_key pre-filter
+used by crud.restaurants for orderBy=distance.
+
+Reuses the synthetic 1M-row table of bench_spatial_index and asks for the 20 nearest
+restaurants within 1 km and 5 km of random points.
+"""
+import random
+from sqlalchemy import text
+from app.core.geo import covering_ranges, radius_bbox
+from tests.benchmark.bench_spatial_index import SETUP, LAT_RANGE, LNG_RANGE, ROWS
+from tests.benchmark.common import get_engine, measure, report
+
+RUNS = 500
+LIMIT = 20
+RADII = [1000, 5000]
+
+DISTANCE_SQL = """
+    12742017.6 * asin(sqrt(
+        power(sin(radians(lat - :lat) * 0.5), 2) +
+        cos(radians(:lat)) * cos(radians(lat)) * power(sin(radians(lng - :lng) * 0.5), 2)
+    ))
+"""
+
+def nearest_sql(ranges=None):
+    cells = f"({' OR '.join(f'tile_key BETWEEN {first} AND {last}' for first, last in ranges)}) AND " if ranges else ""
+    return f"""
+        SELECT google_place_id, rest_name, rating, {DISTANCE_SQL} AS distance FROM bench_restaurants
+        WHERE {cells}lat BETWEEN :sw_lat AND :ne_lat AND lng BETWEEN :sw_lng AND :ne_lng
+            AND {DISTANCE_SQL} <= :radius
+        ORDER BY distance, google_place_id LIMIT {LIMIT}
+    """
+
+def points(n, radius):
+    rng = random.Random(11)
+    for _ in range(n):
+        lat, lng = rng.uniform(*LAT_RANGE), rng.uniform(*LNG_RANGE)
+        sw_lat, sw_lng, ne_lat, ne_lng = radius_bbox(lat, lng, radius)
+        yield {"lat": lat, "lng": lng, "radius": radius, "sw_lat": sw_lat, "sw_lng": sw_lng, "ne_lat": ne_lat, "ne_lng": ne_lng}
+
+def main():
+    engine = get_engine()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        print(f"Building bench_restaurants with {ROWS} rows...")
+        for statement in SETUP:
+            conn.execute(text(statement))
+
+        for radius in RADII:
+            params = list(points(RUNS, radius))
+            plain = text(nearest_sql())
+            tiled = [
+                text(nearest_sql(covering_ranges(p["sw_lat"], p["sw_lng"], p["ne_lat"], p["ne_lng"])))
+                for p in params
+            ]
+            for p in params[:20]:
+                conn.execute(plain, p).all()
+            report(f"{radius}m lat/lng range", measure(lambda i: conn.execute(plain, params[i]).all(), RUNS))
+            report(f"{radius}m tile_key pre-filter", measure(lambda i: conn.execute(tiled[i], params[i]).all(), RUNS))
+
+        print("\nEXPLAIN ANALYZE (tile_key pre-filter, 1000m):")
+        p = next(points(1, 1000))
+        query = nearest_sql(covering_ranges(p["sw_lat"], p["sw_lng"], p["ne_lat"], p["ne_lng"]))
+        print("\n".join(conn.execute(text("EXPLAIN (ANALYZE, BUFFERS) " + query), p).scalars()))
+
+        conn.execute(text("DROP TABLE bench_restaurants"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Places client concurrency benchmark against a local stub of the Places web service.
+
+Fires 200 simultaneous viewport searches, first the way the old client did
+(blocking requests.get inside async handlers), then through the shared
+httpx.AsyncClient, and reports wall time and per-request latency.
+
+    python -m tests.benchmark.bench_places_client
+"""
+import asyncio
+import os
+import statistics
+import threading
+import time
+
+STUB_PORT = 8765
+STUB_LATENCY = 0.1  # seconds per Google round-trip
+CONCURRENCY = 200
+
+os.environ.setdefault("GOOGLE_MAPS_API_KEY", "bench")
+os.environ["PLACES_API_URL"] = f"http://127.0.0.1:{STUB_PORT}"
+
+import requests
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from app.services import places_api
+from tests.benchmark.common import percentile
+
+async def nearby_search(request):
+    await asyncio.sleep(STUB_LATENCY)
+    lat, lng = (float(v) for v in request.query_params["location"].split(","))
+    results = [
+        {
+            "name": f"stub {i}",
+            "place_id": f"stub_{lat}_{lng}_{i}",
+            "rating": 4.0,
+            "geometry": {"location": {"lat": lat, "lng": lng}},
+        }
+        for i in range(20)
+    ]
+    return JSONResponse({"status": "OK", "results": results})
+
+def start_stub():
+    app = Starlette(routes=[Route("/nearbysearch/json", nearby_search)])
+    server = uvicorn.Server(uvicorn.Config(app, port=STUB_PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+async def blocking_search(lat, lng):
+    # Previous implementation: a synchronous request issued from an async route.
+    response = requests.get(
+        f"{os.environ['PLACES_API_URL']}/nearbysearch/json",
+        params={"location": f"{lat},{lng}", "radius": 1000, "type": "restaurant"},
+    )
+    return response.json()["results"]
+
+async def run(name, search):
+    latencies = []
+    start = time.perf_counter()
+
+    async def one(i):
+        # All requests arrive together, so latency is measured from the start of the burst.
+        await search(25.0 + i * 0.001, 121.5)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(one(i) for i in range(CONCURRENCY)))
+    wall = time.perf_counter() - start
+    print(
+        f"{name:<28} wall={wall:7.2f}s  "
+        f"mean={statistics.mean(latencies):8.1f}ms  p95={percentile(latencies, 95):8.1f}ms  "
+        f"throughput={CONCURRENCY / wall:7.1f} req/s"
+    )
+
+async def main():
+    start_stub()
+    print(f"{CONCURRENCY} concurrent viewport searches, stub latency {STUB_LATENCY * 1000:.0f}ms")
+    await run("blocking requests.get", blocking_search)
+    places_api.init_client()
+    try:
+        await run("shared httpx.AsyncClient", lambda lat, lng: places_api.search_nearby_restaurants(None, lat, lng))
+    finally:
+        await places_api.close_client()
+
+if __name__ == "__main__":
+    asyncio.run(main())
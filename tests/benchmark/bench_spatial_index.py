@@ -0,0 +1,95 @@
+"""
+Viewport query benchmark: independent lat/lng B-tree indexes vs. the tile_key grid index.
+
+Builds a synthetic 1M-row copy of the restaurants table spread over Taiwan and runs the
+same random map viewports through both plans.
+"""
+import random
+from sqlalchemy import text
+from app.core.geo import TILE_SIZE, TILE_COLS, covering_ranges
+from tests.benchmark.common import get_engine, measure, report
+
+ROWS = 1_000_000
+RUNS = 200
+VIEWPORT = 0.02  # degrees, roughly one phone screen at street zoom
+LAT_RANGE = (21.9, 25.3)
+LNG_RANGE = (120.0, 122.0)
+
+SETUP = [
+    "DROP TABLE IF EXISTS bench_restaurants",
+    """
+    CREATE UNLOGGED TABLE bench_restaurants (
+        google_place_id VARCHAR PRIMARY KEY,
+        rest_name VARCHAR,
+        lat DOUBLE PRECISION,
+        lng DOUBLE PRECISION,
+        rating DOUBLE PRECISION,
+        tile_key INTEGER
+    )
+    """,
+    f"""
+    INSERT INTO bench_restaurants (google_place_id, rest_name, lat, lng, rating)
+    SELECT 'place_' || i, 'restaurant ' || i,
+        {LAT_RANGE[0]} + random() * {LAT_RANGE[1] - LAT_RANGE[0]},
+        {LNG_RANGE[0]} + random() * {LNG_RANGE[1] - LNG_RANGE[0]},
+        round((random() * 5)::numeric, 1)
+    FROM generate_series(1, {ROWS}) AS i
+    """,
+    f"""
+    UPDATE bench_restaurants
+    SET tile_key = floor((lat + 90) / {TILE_SIZE})::int * {TILE_COLS} + floor((lng + 180) / {TILE_SIZE})::int
+    """,
+    "CREATE INDEX ON bench_restaurants (lat)",
+    "CREATE INDEX ON bench_restaurants (lng)",
+    "CREATE INDEX ON bench_restaurants (tile_key, lat, lng)",
+    "VACUUM ANALYZE bench_restaurants",
+]
+
+BETWEEN_SQL = """
+    SELECT google_place_id, rest_name, lat, lng, rating FROM bench_restaurants
+    WHERE lat BETWEEN :sw_lat AND :ne_lat AND lng BETWEEN :sw_lng AND :ne_lng
+    ORDER BY rating DESC LIMIT 100
+"""
+
+def tile_sql(ranges):
+    cells = " OR ".join(f"tile_key BETWEEN {first} AND {last}" for first, last in ranges)
+    return f"""
+        SELECT google_place_id, rest_name, lat, lng, rating FROM bench_restaurants
+        WHERE ({cells}) AND lat BETWEEN :sw_lat AND :ne_lat AND lng BETWEEN :sw_lng AND :ne_lng
+        ORDER BY rating DESC LIMIT 100
+    """
+
+def viewports(n):
+    rng = random.Random(42)
+    for _ in range(n):
+        sw_lat = rng.uniform(LAT_RANGE[0], LAT_RANGE[1] - VIEWPORT)
+        sw_lng = rng.uniform(LNG_RANGE[0], LNG_RANGE[1] - VIEWPORT)
+        yield {"sw_lat": sw_lat, "sw_lng": sw_lng, "ne_lat": sw_lat + VIEWPORT, "ne_lng": sw_lng + VIEWPORT}
+
+def main():
+    engine = get_engine()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        print(f"Building bench_restaurants with {ROWS} rows...")
+        for statement in SETUP:
+            conn.execute(text(statement))
+
+        boxes = list(viewports(RUNS))
+        tile_queries = [text(tile_sql(covering_ranges(**box))) for box in boxes]
+        between_query = text(BETWEEN_SQL)
+
+        # Warm the buffer cache so both plans are measured on equal footing.
+        for box in boxes[:20]:
+            conn.execute(between_query, box).all()
+
+        report("lat/lng between()", measure(lambda i: conn.execute(between_query, boxes[i]).all(), RUNS))
+        report("tile_key covering ranges", measure(lambda i: conn.execute(tile_queries[i], boxes[i]).all(), RUNS))
+
+        for name, query in (("between()", between_query), ("tile_key", tile_queries[0])):
+            print(f"\nEXPLAIN ANALYZE ({name}):")
+            plan = conn.execute(text("EXPLAIN (ANALYZE, BUFFERS) " + query.text), boxes[0]).scalars()
+            print("\n".join(plan))
+
+        conn.execute(text("DROP TABLE bench_restaurants"))
+
+if __name__ == "__main__":
+    main()
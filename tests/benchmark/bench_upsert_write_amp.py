@@ -0,0 +1,119 @@
+"""
+Write amplification of repeated viewport fetches: unconditional upsert vs. the
+change-aware crud.restaurants.bulk_insert.
+
+Seeds the restaurants table of a scratch database with synthetic places, then
+replays the same random Nearby Search pages (20 places each, a small fraction of
+them with a changed rating) through both statements and reports rows rewritten,
+HOT updates, dead tuples and WAL generated by each.
+"""
+import random
+import time
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects.postgresql import insert
+from app.db.database import Base
+from app.core.geo import tile_key
+from app.models.dbModel import Restaurant
+from app.crud.restaurants import bulk_insert
+from app.schemas.restaurants import CreateRestaurant
+from tests.benchmark.common import get_engine, measure, report
+
+CELLS = 500
+PLACES_PER_CELL = 60
+PAGE_SIZE = 20
+FETCHES = 2000
+CHANGE_RATE = 0.02  # share of fetched places whose rating moved since the last fetch
+
+STATS_SQL = """
+    SELECT n_tup_upd, n_tup_hot_upd, n_dead_tup, pg_current_wal_lsn() AS lsn
+    FROM pg_stat_user_tables WHERE relname = 'restaurants'
+"""
+
+def make_place(cell, index, rating):
+    return CreateRestaurant(
+        name=f"bench restaurant {cell}-{index}",
+        location={"lat": 22.0 + cell * 0.01, "lng": 120.0 + index * 0.0001},
+        rating=rating,
+        place_id=f"bench_{cell}_{index}",
+        photo_url=f"bench_photo_{cell}_{index}",
+    )
+
+def pages(ratings):
+    """Replayable Nearby Search pages; ratings is mutated to the values last written."""
+    rng = random.Random(7)
+    result = []
+    for _ in range(FETCHES):
+        cell = rng.randrange(CELLS)
+        start = rng.randrange(0, PLACES_PER_CELL, PAGE_SIZE)
+        page = []
+        for index in range(start, start + PAGE_SIZE):
+            if rng.random() < CHANGE_RATE:
+                ratings[cell, index] = round(rng.uniform(1, 5), 1)
+            page.append(make_place(cell, index, ratings[cell, index]))
+        result.append(page)
+    return result
+
+def unconditional_upsert(db, restaurants):
+    """bulk_insert before it compared rows: every conflicting row is rewritten."""
+    stmt = insert(Restaurant).values([{
+        "google_place_id": restaurant.place_id,
+        "rest_name": restaurant.name,
+        "lat": restaurant.location["lat"],
+        "lng": restaurant.location["lng"],
+        "tile_key": tile_key(restaurant.location["lat"], restaurant.location["lng"]),
+        "rating": restaurant.rating,
+        "photo_url": restaurant.photo_url,
+    } for restaurant in restaurants])
+    stmt = stmt.on_conflict_do_update(
+        constraint="restaurants_pkey",
+        set_={column: getattr(stmt.excluded, column) for column in ("rest_name", "lat", "lng", "tile_key", "rating", "photo_url")}
+    )
+    db.execute(stmt)
+    db.commit()
+
+def snapshot(conn):
+    try:
+        conn.execute(text("SELECT pg_stat_force_next_flush()"))  # PostgreSQL 15+
+    except Exception:
+        conn.rollback()
+        time.sleep(1)
+    conn.execute(text("SELECT pg_stat_clear_snapshot()"))
+    return conn.execute(text(STATS_SQL)).one()
+
+def run(name, upsert, db, conn, fetches):
+    before = snapshot(conn)
+    report(name, measure(lambda i: upsert(db, fetches[i]), len(fetches)))
+    after = snapshot(conn)
+    wal = conn.execute(text("SELECT pg_wal_lsn_diff(:after, :before)"), {"after": after.lsn, "before": before.lsn}).scalar()
+    print(
+        f"{'':<32} rows rewritten={after.n_tup_upd - before.n_tup_upd:<8} "
+        f"hot={after.n_tup_hot_upd - before.n_tup_hot_upd:<8} "
+        f"dead tuples={after.n_dead_tup - before.n_dead_tup:<8} "
+        f"wal={wal / 1024 / 1024:.1f}MB"
+    )
+
+def main():
+    engine = get_engine()
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    with engine.connect() as conn:
+        conn.execute(text("DELETE FROM restaurants WHERE google_place_id LIKE 'bench\\_%'"))
+        conn.commit()
+        print(f"Seeding {CELLS * PLACES_PER_CELL} places...")
+        ratings = {(cell, index): 3.0 for cell in range(CELLS) for index in range(PLACES_PER_CELL)}
+        for cell in range(CELLS):
+            bulk_insert(db, [make_place(cell, index, 3.0) for index in range(PLACES_PER_CELL)])
+
+        # Both variants replay identical pages starting from the same stored ratings.
+        run("unconditional upsert", unconditional_upsert, db, conn, pages(dict(ratings)))
+        db.execute(text("UPDATE restaurants SET rating = 3.0 WHERE google_place_id LIKE 'bench\\_%'"))
+        db.commit()
+        run("change-aware bulk_insert", bulk_insert, db, conn, pages(dict(ratings)))
+
+        conn.execute(text("DELETE FROM restaurants WHERE google_place_id LIKE 'bench\\_%'"))
+        conn.commit()
+    db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Shared helpers for the benchmark scripts in this directory.
+Benchmarks are not collected by pytest; run them against a scratch database, e.g.
+
+    DATABASE_URL=postgresql://... python -m tests.benchmark.bench_spatial_index
+"""
+import os
+import statistics
+import time
+from sqlalchemy import create_engine
+
+def get_engine():
+    url = os.getenv("BENCH_DATABASE_URL") or os.getenv("DATABASE_URL")
+    if not url:
+        raise ValueError("Set BENCH_DATABASE_URL (or DATABASE_URL) to a scratch database.")
+    return create_engine(url)
+
+def measure(fn, runs: int) -> list[float]:
+    """Call fn `runs` times and return the wall time of each call in milliseconds."""
+    samples = []
+    for i in range(runs):
+        start = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def report(name: str, samples: list[float]):
+    print(
+        f"{name:<32} n={len(samples):<5} "
+        f"mean={statistics.mean(samples):8.2f}ms "
+        f"p50={percentile(samples, 50):8.2f}ms "
+        f"p95={percentile(samples, 95):8.2f}ms "
+        f"max={max(samples):8.2f}ms"
+    )
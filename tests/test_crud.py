@@ -4,13 +4,42 @@ from pytest_postgresql.janitor import DatabaseJanitor
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from app.db.database import Base, engine, SessionLocal
-from app.crud import users, restaurants, maps, follow, diaries, collections, comments
+from app.crud import users, restaurants, maps, follow, diaries, collections, comments, feed
 from app.models.dbModel import *
-from app.schemas.restaurants import FullCreateRestaurant
+from app.schemas.restaurants import CreateRestaurant, FullCreateRestaurant
 from app.schemas.diaries import DiaryCreate, DiaryUpdate
 from app.schemas.comments import CommentCreate, CommentUpdate
 from app.schemas.maps import MapCreate
 from app.schemas.users import UserLoginInfo
+from app.core.geo import tile_key
+from app.core import compact
+from app.db.redis import get_redis
+from app.services import redis_query, timeline
+from app.crud import stale
+from redis.exceptions import RedisError
+from starlette.requests import Request
+
+class StubRedis:
+    """Stands in for Redis in the crud tests, recording the commands the commit hooks send."""
+    def __init__(self):
+        self.commands = []
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        return []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((name, *args))
+        return command
+
+@pytest.fixture(autouse=True)
+def stub_redis(monkeypatch):
+    redis = StubRedis()
+    monkeypatch.setattr(stale, "_redis", redis)
+    return redis
 
 class TestUser:
     def setup_class(self):
@@ -118,6 +147,26 @@ class TestUser:
         for diary in diaries:
             assert diary.id == id
 
+    @pytest.mark.parametrize(
+        ("order_by", "reverse"),
+        [
+            ("createTime", False),
+            ("following", False),
+            ("createTime", True),
+            ("following", True)
+        ],
+    )
+    def test_get_users_cursor(self, order_by, reverse):
+        query = {"orderBy": order_by, "offset": 0, "limit": 2, "q": None, "reverse": reverse, "auth_user_id": -1}
+        first_page, cursor = users.get_users(self.session, query)
+        offset_page, _ = users.get_users(self.session, {**query, "offset": 2})
+        if cursor is None:
+            assert len(first_page) < 2
+            return
+        cursor_page, _ = users.get_users(self.session, {**query, "cursor": cursor})
+        assert [user.id for user in cursor_page] == [user.id for user in offset_page]
+        assert not {user.id for user in first_page} & {user.id for user in cursor_page}
+
 class TestRestaurant:
     def setup_class(self):
         Base.metadata.create_all(engine)
@@ -193,10 +242,184 @@ class TestRestaurant:
         assert insert_restaurant.telephone == answer.telephone
         assert insert_restaurant.rating == answer.rating
         assert insert_restaurant.view_cnt == answer.view_cnt
+        assert answer.tile_key == tile_key(answer.lat, answer.lng)
         update_restaurant = restaurants.create_update_restaurant(self.session, update)
         answer = self.session.query(Restaurant).filter(Restaurant.google_place_id == restaurant.place_id).first()
         assert update_restaurant.rest_name == answer.rest_name
     
+    @pytest.mark.parametrize(
+        ("query"),
+        [
+            {
+                "orderBy": "rating",
+                "offset": 0,
+                "limit": 10,
+                "sw_lat": 22.72,
+                "sw_lng": 120.27,
+                "ne_lat": 22.74,
+                "ne_lng": 120.29
+            }
+        ],
+    )
+    def test_query_restaurants_bbox(self, query):
+        count, rest_list, next_cursor = restaurants.query_restaurants(self.session, query)
+        assert count >= len(rest_list)
+        assert "test_restaurant_place_id" in [rest.placeId for rest in rest_list]
+        for rest in rest_list:
+            assert query["sw_lat"] <= rest.location["lat"] <= query["ne_lat"]
+            assert query["sw_lng"] <= rest.location["lng"] <= query["ne_lng"]
+
+    @pytest.mark.parametrize(
+        ("query"),
+        [
+            {
+                "orderBy": "distance",
+                "offset": 0,
+                "limit": 10,
+                "lat": 22.73,
+                "lng": 120.28,
+                "distance": 1000
+            }
+        ],
+    )
+    def test_query_restaurants_distance(self, query):
+        count, rest_list, _ = restaurants.query_restaurants(self.session, query)
+        assert count >= len(rest_list)
+        assert rest_list[0].placeId == "test_restaurant_place_id"
+        distances = [rest.distance for rest in rest_list]
+        assert distances == sorted(distances)
+        assert distances[0] < 1 and distances[-1] <= query["distance"]
+
+    @pytest.mark.parametrize(
+        ("query"),
+        [
+            {
+                "orderBy": "collectCount",
+                "offset": 0,
+                "limit": 5,
+                "compact": True
+            }
+        ],
+    )
+    def test_query_restaurants_compact(self, query):
+        _, rows, _ = restaurants.query_restaurants(self.session, query)
+        _, rest_list, _ = restaurants.query_restaurants(self.session, {**query, "compact": False})
+        columns = compact.restaurant_columns(rows)
+        assert columns["placeId"] == [rest.placeId for rest in rest_list]
+        assert columns["lat"] == [rest.location["lat"] for rest in rest_list]
+        assert all(0 <= flags < 8 for flags in columns["flags"])
+
+    @pytest.mark.parametrize(
+        ("accept", "media_type"),
+        [
+            (None, None),
+            ("*/*", None),
+            ("application/msgpack", compact.MSGPACK),
+            ("application/x-msgpack;q=0, application/json", None),
+            ("application/msgpack;q=0.5, application/json", None),
+            ("application/json;q=0.5, application/msgpack", compact.MSGPACK),
+            ("application/vnd.restaurants.columnar+json, application/msgpack;q=0.9", compact.COLUMNAR_JSON),
+        ],
+    )
+    def test_negotiate(self, accept, media_type):
+        headers = [(b"accept", accept.encode())] if accept else []
+        assert compact.negotiate(Request({"type": "http", "headers": headers})) == media_type
+
+    @pytest.mark.parametrize(
+        ("query", "cell_size"),
+        [
+            (
+                {
+                    "orderBy": "rating",
+                    "offset": 0,
+                    "limit": 10,
+                    "sw_lat": 22.6,
+                    "sw_lng": 120.2,
+                    "ne_lat": 22.8,
+                    "ne_lng": 120.4
+                },
+                0.04
+            )
+        ],
+    )
+    def test_cluster_restaurants(self, query, cell_size):
+        count, _, _ = restaurants.query_restaurants(self.session, query)
+        clusters = restaurants.cluster_restaurants(
+            self.session, query["sw_lat"], query["sw_lng"], query["ne_lat"], query["ne_lng"], cell_size
+        )
+        assert sum(cluster.count for cluster in clusters) == count
+        assert len(clusters) <= 6 * 6
+
+    @pytest.mark.parametrize(
+        ("order_by", "reverse"),
+        [
+            ("collectCount", False),
+            ("createTime", False),
+            ("name", False),
+            ("rating", False),
+            ("collectCount", True),
+            ("rating", True)
+        ],
+    )
+    def test_query_restaurants_cursor(self, order_by, reverse):
+        query = {"orderBy": order_by, "offset": 0, "limit": 2, "reverse": reverse}
+        _, first_page, cursor = restaurants.query_restaurants(self.session, query)
+        _, offset_page, _ = restaurants.query_restaurants(self.session, {**query, "offset": 2})
+        if cursor is None:
+            assert len(first_page) < 2
+            return
+        _, cursor_page, _ = restaurants.query_restaurants(self.session, {**query, "cursor": cursor})
+        assert [rest.placeId for rest in cursor_page] == [rest.placeId for rest in offset_page]
+        assert not {rest.placeId for rest in first_page} & {rest.placeId for rest in cursor_page}
+
+    @pytest.mark.parametrize("reverse", [False, True])
+    def test_query_restaurants_cursor_nulls(self, reverse):
+        for place_id in ("test_null_rating_1", "test_null_rating_2"):
+            if not self.session.get(Restaurant, place_id):
+                self.session.add(Restaurant(google_place_id=place_id, rest_name=place_id, lat=0, lng=0, photo_url="", rating=None))
+        self.session.commit()
+        query = {"orderBy": "rating", "offset": 0, "limit": 2, "reverse": reverse}
+        total, page, cursor = restaurants.query_restaurants(self.session, query)
+        seen = [rest.placeId for rest in page]
+        while cursor:
+            _, page, cursor = restaurants.query_restaurants(self.session, {**query, "cursor": cursor})
+            seen += [rest.placeId for rest in page]
+        assert len(seen) == len(set(seen)) == total
+        assert {"test_null_rating_1", "test_null_rating_2"} <= set(seen)
+
+    @pytest.mark.parametrize(
+        ("q"),
+        [
+            "test_restaurant",
+            "TEST_RESTAURANT_UPDATE",
+            "_update",
+            "t"
+        ],
+    )
+    def test_query_restaurants_search(self, q):
+        query = {"orderBy": "relevance", "offset": 0, "limit": 10, "q": q}
+        count, rest_list, _ = restaurants.query_restaurants(self.session, query)
+        assert count >= len(rest_list)
+        assert all(q.lower() in rest.name.lower() for rest in rest_list)
+        if len(q) > 1:
+            assert rest_list[0].placeId == "test_restaurant_place_id"
+
+    @pytest.mark.parametrize("q", ["relevance tie", "relevance t"])
+    def test_query_restaurants_relevance_ties(self, q):
+        # Equal names score equal relevance, so every page boundary falls inside a tie
+        for i in range(5):
+            if not self.session.get(Restaurant, f"test_relevance_tie_{i}"):
+                self.session.add(Restaurant(google_place_id=f"test_relevance_tie_{i}", rest_name="relevance tie", lat=0, lng=0, photo_url=""))
+        self.session.commit()
+        query = {"orderBy": "relevance", "offset": 0, "limit": 2, "q": q}
+        total, page, cursor = restaurants.query_restaurants(self.session, query)
+        seen = [rest.placeId for rest in page]
+        while cursor:
+            _, page, cursor = restaurants.query_restaurants(self.session, {**query, "cursor": cursor})
+            seen += [rest.placeId for rest in page]
+        assert len(seen) == len(set(seen)) == total
+        assert {f"test_relevance_tie_{i}" for i in range(5)} <= set(seen)
+
     @pytest.mark.parametrize(
         ("restaurant_id", "update"),
         [
@@ -213,6 +436,38 @@ class TestRestaurant:
         answer = self.session.query(Restaurant).filter(Restaurant.google_place_id == restaurant_id).first()
         assert update_restaurant.telephone == answer.telephone
 
+    @pytest.mark.parametrize(
+        ("restaurant_id", "expected"),
+        [
+            ("test_restaurant_place_id", True),
+            ("test_missing_place_id", False)
+        ],
+    )
+    def test_has_place_details(self, restaurant_id, expected):
+        assert restaurants.has_place_details(self.session, restaurant_id) == expected
+
+    @pytest.mark.parametrize(
+        ("restaurant"),
+        [
+            CreateRestaurant(
+                name="test_bulk_restaurant",
+                location={
+                    "lat": 22.73,
+                    "lng": 120.28
+                },
+                rating=4,
+                place_id="test_bulk_place_id",
+                photo_url="test_bulk_photo_url"
+            )
+        ],
+    )
+    def test_bulk_insert(self, restaurant):
+        assert restaurants.bulk_insert(self.session, [restaurant]) == (["test_bulk_place_id"], [])
+        assert restaurants.bulk_insert(self.session, [restaurant]) == ([], [])
+        changed = restaurant.model_copy(update={"rating": 4.5})
+        assert restaurants.bulk_insert(self.session, [changed, changed]) == ([], ["test_bulk_place_id"])
+        restaurants.delete_restaurant(self.session, "test_bulk_place_id")
+
     @pytest.mark.parametrize(
         ("restaurant_id"),
         [
@@ -233,8 +488,63 @@ class TestRestaurant:
         user_id = users.get_user_by_email(self.session, user).user_id
         user_map = self.session.query(Map).filter(Map.author == user_id).first()
         collect = restaurants.collect_restaurant(self.session, user_id, place_id)
+        # Collecting again inserts nothing
+        assert not restaurants.collect_restaurant(self.session, user_id, place_id)
         assert self.session.query(UserRestCollect).filter(UserRestCollect.user_id == user_id, UserRestCollect.rest_id == place_id).first() is not None
-        assert place_id in user_map.rest_ids
+        assert place_id in maps.map_place_ids(self.session, user_map.map_id)
+        restaurant = self.session.query(Restaurant).filter(Restaurant.google_place_id == place_id).first()
+        assert user_map.min_lat <= restaurant.lat <= user_map.max_lat
+        assert user_map.min_lng <= restaurant.lng <= user_map.max_lng
+        assert user_map.min_lat <= user_map.lat <= user_map.max_lat
+        # The incremental update agrees with a full recompute
+        incremental = (user_map.lat, user_map.lng, user_map.extent_cnt)
+        restaurants.update_map_extent(self.session, user_map.map_id)
+        self.session.commit()
+        self.session.refresh(user_map)
+        assert incremental == pytest.approx((user_map.lat, user_map.lng, user_map.extent_cnt))
+
+    @pytest.mark.parametrize(
+        ("user", "place_id"),
+        [
+            ("pohan.ho@gmail.com", "ChIJycu5coupQjQRl9dmANfpHuw")
+        ],
+    )
+    def test_move_restaurant(self, user, place_id):
+        user_id = users.get_user_by_email(self.session, user).user_id
+        user_map = self.session.query(Map).filter(Map.author == user_id).first()
+        restaurant = self.session.query(Restaurant).filter(Restaurant.google_place_id == place_id).first()
+        lat = restaurant.lat
+        # The maps holding a moved restaurant follow it
+        restaurants.update_restaurant(self.session, place_id, {"lat": lat + 1})
+        self.session.refresh(user_map)
+        assert user_map.max_lat == pytest.approx(lat + 1)
+        restaurants.update_restaurant(self.session, place_id, {"lat": lat})
+        self.session.refresh(user_map)
+        assert user_map.min_lat <= lat <= user_map.max_lat < lat + 1
+
+    @pytest.mark.parametrize(
+        ("place_id", "views"),
+        [
+            ("ChIJycu5coupQjQRl9dmANfpHuw", 3)
+        ],
+    )
+    def test_add_view_counts(self, place_id, views):
+        before = self.session.query(Restaurant).filter(Restaurant.google_place_id == place_id).first().view_cnt
+        assert restaurants.add_view_counts(self.session, {place_id: views, "not_a_place": 1}) == 1
+        after = self.session.query(Restaurant).filter(Restaurant.google_place_id == place_id).first().view_cnt
+        assert after == before + views
+
+    @pytest.mark.parametrize(
+        ("user", "place_id"),
+        [
+            ("pohan.ho@gmail.com", "ChIJycu5coupQjQRl9dmANfpHuw")
+        ],
+    )
+    def test_get_restaurant_flags(self, user, place_id):
+        user_id = users.get_user_by_email(self.session, user).user_id
+        flags = restaurants.get_restaurant_flags(self.session, place_id, user_id)
+        detail = restaurants.get_restaurant(self.session, place_id, user_id)
+        assert flags == {"hasCollected": True, "hasLiked": detail.hasLiked, "hasDisliked": detail.hasDisliked}
 
     @pytest.mark.parametrize(
         ("user", "place_id"),
@@ -247,7 +557,13 @@ class TestRestaurant:
         user_map = self.session.query(Map).filter(Map.author == user_id).first()
         uncollect = restaurants.uncollect_restaurant(self.session, user_id, place_id)
         assert self.session.query(UserRestCollect).filter(UserRestCollect.user_id == user_id, UserRestCollect.rest_id == place_id).first() is None
-        assert place_id not in user_map.rest_ids
+        assert place_id not in maps.map_place_ids(self.session, user_map.map_id)
+        self.session.refresh(user_map)
+        incremental = (user_map.lat, user_map.lng, user_map.min_lat, user_map.max_lat, user_map.extent_cnt)
+        restaurants.update_map_extent(self.session, user_map.map_id)
+        self.session.commit()
+        self.session.refresh(user_map)
+        assert incremental == pytest.approx((user_map.lat, user_map.lng, user_map.min_lat, user_map.max_lat, user_map.extent_cnt))
 
     @pytest.mark.parametrize(
         ("user", "place_id"),
@@ -258,6 +574,7 @@ class TestRestaurant:
     def test_like_restaurant(self, user, place_id):
         user_id = users.get_user_by_email(self.session, user).user_id
         like = restaurants.like_restaurant(self.session, user_id, place_id)
+        assert not restaurants.like_restaurant(self.session, user_id, place_id)
         assert self.session.query(UserRestLike).filter(UserRestLike.user_id == user_id, UserRestLike.rest_id == place_id).first() is not None
     
     @pytest.mark.parametrize(
@@ -293,6 +610,23 @@ class TestRestaurant:
         undislike = restaurants.undislike_restaurant(self.session, user_id, place_id)
         assert self.session.query(UserRestDislike).filter(UserRestDislike.user_id == user_id, UserRestDislike.rest_id == place_id).first() is None
 
+    @pytest.mark.parametrize(
+        ("user", "place_id"),
+        [
+            ("pohan.ho@gmail.com", "ChIJycu5coupQjQRl9dmANfpHuw")
+        ],
+    )
+    def test_interaction_counters(self, user, place_id):
+        user_id = users.get_user_by_email(self.session, user).user_id
+        restaurants.like_restaurant(self.session, user_id, place_id)
+        restaurants.dislike_restaurant(self.session, user_id, place_id)
+        restaurants.undislike_restaurant(self.session, user_id, place_id)
+        answer = self.session.query(Restaurant).filter(Restaurant.google_place_id == place_id).first()
+        self.session.refresh(answer)
+        assert answer.like_cnt == self.session.query(UserRestLike).filter(UserRestLike.rest_id == place_id).count()
+        assert answer.dislike_cnt == self.session.query(UserRestDislike).filter(UserRestDislike.rest_id == place_id).count()
+        assert restaurants.rebuild_counters(self.session) == 0
+
 class TestMap:
     def setup_class(self):
         Base.metadata.create_all(engine)
@@ -349,12 +683,74 @@ class TestMap:
         ],
     )
     def test_get_maps(self, query):
-        mapList = maps.get_maps(self.session, query)
+        total, mapList, next_cursor = maps.get_maps(self.session, query)
+        assert total >= len(mapList)
         if mapList != []:
             assert mapList[0] != None
         else:
             assert mapList == []
 
+    @pytest.mark.parametrize(
+        ("order_by"),
+        [
+            "favCount",
+            "createTime"
+        ],
+    )
+    def test_get_maps_pages(self, order_by):
+        query = {"auth_user_id": 1, "q": None, "orderBy": order_by, "limit": 2, "offset": 0}
+        total, first_page, _ = maps.get_maps(self.session, query)
+        _, second_page, _ = maps.get_maps(self.session, {**query, "offset": 2})
+        _, everything, _ = maps.get_maps(self.session, {**query, "limit": 100})
+        _, reversed_all, _ = maps.get_maps(self.session, {**query, "limit": 100, "reverse": True})
+        assert total == len(everything)
+        assert [m.id for m in first_page + second_page] == [m.id for m in everything[:4]]
+        assert [m.id for m in reversed_all] == [m.id for m in everything][::-1]
+
+    def test_get_maps_by_ids(self):
+        query = {"auth_user_id": 1, "q": None, "orderBy": "favCount", "limit": 5, "offset": 0}
+        _, page, _ = maps.get_maps(self.session, query)
+        ids = [m.id for m in page][::-1]
+        by_ids, _ = maps.get_maps_by_ids(self.session, ids, query)
+        assert [m.id for m in by_ids] == ids
+
+    def test_collect_counts(self):
+        counts = dict(maps.collect_counts(self.session))
+        for map_id, count in counts.items():
+            assert count == self.session.query(UserMapCollect).filter(UserMapCollect.map_id == map_id).count()
+            assert count > 0
+
+    @pytest.mark.parametrize(
+        ("map_id", "views"),
+        [
+            (1, 2)
+        ],
+    )
+    def test_add_view_counts(self, map_id, views):
+        before = self.session.query(Map).filter(Map.map_id == map_id).first().view_cnt
+        maps.add_view_counts(self.session, {map_id: views})
+        answer = maps.get_map(self.session, map_id, -1)
+        assert answer.viewCount == before + views
+
+    @pytest.mark.parametrize(
+        ("tags", "tag_mode", "matches"),
+        [
+            (["test_tag_a"], "any", True),
+            (["test_tag_a", "test_tag_c"], "any", True),
+            (["test_tag_a", "test_tag_b"], "all", True),
+            (["test_tag_a", "test_tag_c"], "all", False)
+        ],
+    )
+    def test_get_maps_tags(self, tags, tag_mode, matches):
+        user_id = users.get_user_by_email(self.session, "pohan.ho@gmail.com").user_id
+        userInfo = UserLoginInfo(userId=user_id, isNew=False)
+        map_id = maps.create_map(self.session, MapCreate(description="tag_description", name="tag_name", tags=["test_tag_a", "test_tag_b"]), userInfo)
+        query = {"auth_user_id": user_id, "q": None, "orderBy": "createTime", "limit": 100, "offset": 0, "tags": tags, "tagMode": tag_mode}
+        total, mapList, _ = maps.get_maps(self.session, query)
+        maps.delete_map(self.session, map_id)
+        assert (map_id in [m.id for m in mapList]) == matches
+        assert total == len(mapList)
+
     @pytest.mark.parametrize(
         ("user", "mapCreate"),
         [
@@ -377,7 +773,7 @@ class TestMap:
         assert answer.map_name == mapCreate.name
         assert answer.icon_url == mapCreate.iconUrl
         assert answer.tags == mapCreate.tags
-        assert answer.rest_ids == mapCreate.restaurants
+        assert maps.map_place_ids(self.session, new_map) == mapCreate.restaurants
 
     @pytest.mark.parametrize(
         ("user", "map_name"),
@@ -438,17 +834,46 @@ class TestMap:
                 "orderBy": "collectCount",
                 "q": "rest",
                 "auth_user_id": 1
+            }),
+            (1,{
+                "orderBy": "createTime",
+                "q": None,
+                "auth_user_id": 1,
+                "sw_lat": 20.0,
+                "sw_lng": 118.0,
+                "ne_lat": 27.0,
+                "ne_lng": 123.0
             })
         ],
     )
     def test_get_restaurants(self, map_id, query):
-        count, rest_list = maps.get_restaurants(self.session, map_id, query)
-        answer = self.session.query(Map).filter(Map.map_id == map_id).first().rest_ids
-        assert count == len(rest_list)
+        count, rest_list, next_cursor = maps.get_restaurants(self.session, map_id, query)
+        answer = maps.map_place_ids(self.session, map_id)
+        assert count >= len(rest_list)
         for rest in rest_list:
             rest_id = self.session.query(Restaurant).filter(Restaurant.rest_name == rest.name).first().google_place_id
             assert rest_id in answer
     
+    @pytest.mark.parametrize(
+        ("map_id", "order_by"),
+        [
+            (1, "favCount"),
+            (1, None)
+        ],
+    )
+    def test_get_restaurants_pages(self, map_id, order_by):
+        query = {"orderBy": order_by, "q": None, "limit": 1, "offset": 0}
+        total, everything, _ = maps.get_restaurants(self.session, map_id, {**query, "limit": 100})
+        _, first_page, cursor = maps.get_restaurants(self.session, map_id, query)
+        _, second_page, _ = maps.get_restaurants(self.session, map_id, {**query, "offset": 1})
+        _, reversed_all, _ = maps.get_restaurants(self.session, map_id, {**query, "limit": 100, "reverse": True})
+        assert total == len(everything)
+        assert [r.placeId for r in first_page + second_page] == [r.placeId for r in everything[:2]]
+        assert [r.placeId for r in reversed_all] == [r.placeId for r in everything][::-1]
+        if cursor:
+            _, cursor_page, _ = maps.get_restaurants(self.session, map_id, {**query, "cursor": cursor})
+            assert [r.placeId for r in cursor_page] == [r.placeId for r in second_page]
+
     @pytest.mark.parametrize(
         ("user", "map_id"),
         [
@@ -458,6 +883,7 @@ class TestMap:
     def test_collect_map(self, user, map_id):
         user_id = users.get_user_by_email(self.session, user).user_id
         maps.collect_map(self.session, user_id, map_id)
+        assert not maps.collect_map(self.session, user_id, map_id)
         assert self.session.query(UserMapCollect).filter(UserMapCollect.map_id == map_id, UserMapCollect.user_id == user_id).first() is not None
 
     @pytest.mark.parametrize(
@@ -581,12 +1007,34 @@ class TestDiaryComment:
         ],
     )
     def test_get_diaries(self, user_id, query):
-        diaryList = diaries.get_diaries(self.session, user_id, query)
+        diaryList, next_cursor = diaries.get_diaries(self.session, user_id, query)
+        assert len(diaryList) <= query["limit"]
+        assert diaries.count_diaries(self.session, user_id, query) >= len(diaryList)
         if diaryList != []:
             assert diaryList[0] != None
         else:
             assert diaryList == []
 
+
+    def test_stream_diaries(self):
+        query = {"auth_user_id": 1, "q": None, "orderBy": "createTime", "limit": 1000, "offset": 0, "following": False}
+        page, _ = diaries.get_diaries(self.session, 1, query)
+        streamed = list(diaries.stream_diaries(self.session, 1, query, batch_size=2))
+        assert [d.id for d in streamed][:len(page)] == [d.id for d in page]
+        assert len(streamed) == diaries.count_diaries(self.session, 1, query)
+
+    def test_get_diaries_by_ids(self):
+        query = {"auth_user_id": 1, "q": None, "orderBy": "createTime", "limit": 3, "offset": 0, "following": False}
+        page, _ = diaries.get_diaries(self.session, 1, query)
+        ids = [d.id for d in page]
+        hydrated, _ = diaries.get_diaries_by_ids(self.session, ids[::-1], 3)
+        assert [d.id for d in hydrated] == ids
+
+    def test_author_diaries(self):
+        user_id = users.get_user_by_email(self.session, "pohan.ho@gmail.com").user_id
+        recent = feed.author_diaries(self.session, user_id, 10)
+        answer = self.session.query(Diary).filter(Diary.user_id == user_id).order_by(Diary.created.desc(), Diary.diary_id.desc()).limit(10)
+        assert [diary_id for diary_id, _ in recent] == [d.diary_id for d in answer]
     @pytest.mark.parametrize(
         ("user", "rest_id", "update"),
         [
@@ -666,6 +1114,14 @@ class TestDiaryComment:
         update_comment = comments.update_comment(self.session, user_id, comment_id, comment)
         answer = self.session.query(Comment).filter(Comment.comment_id == update_comment.id).first()
         assert answer.content == comment.content
+
+    def test_get_diary_replies(self):
+        diary_id = self.session.query(Comment).first().diary_id
+        detail = diaries.get_diary_detail(self.session, diary_id)
+        answer = self.session.query(Comment).filter(Comment.diary_id == diary_id).order_by(Comment.created, Comment.comment_id).all()
+        assert [reply.id for reply in detail.replies] == [c.comment_id for c in answer]
+        assert [reply.content for reply in detail.replies] == [c.content for c in answer]
+        assert not detail.hasFavorited and not detail.hasCollected
     
     @pytest.mark.parametrize(
         ("user", "rest_id"),
@@ -778,6 +1234,12 @@ class TestFollow:
         assert answer.be_followed == following.be_followed
         assert answer.follow == following.follow
 
+    def test_follower_ids(self):
+        assert 1 in follow.follower_ids(self.session, 3)
+        assert follow.follower_ids(self.session, 1) == [
+            f.follow for f in self.session.query(UserFollow).filter(UserFollow.be_followed == 1)
+        ]
+
     @pytest.mark.parametrize(
         ("follower", "followee"),
         [
@@ -786,10 +1248,14 @@ class TestFollow:
             (4, 9)
         ],
     )
-    def test_delete_follow(self, follower, followee):
+    def test_delete_follow(self, follower, followee, stub_redis):
         following = follow.delete_follow(self.session, follower=follower, followee=followee)
         answer = self.session.query(UserFollow).filter(UserFollow.follow == follower, UserFollow.be_followed == followee).first()
         assert answer is None
+        # The followee's diaries leave the follower's timeline once the unfollow commits
+        diary_ids = [diary_id for diary_id, _ in feed.author_diaries(self.session, followee, timeline.TIMELINE_SIZE)]
+        if diary_ids:
+            assert ("zrem", timeline.timeline_key(follower), *diary_ids) in stub_redis.commands
 
 class TestCollection:
     def setup_class(self):
@@ -872,4 +1338,96 @@ class TestCollection:
 
     
 
-    
\ No newline at end of file
+    
+
+class TestPlaceRefresh:
+    def setup_class(self):
+        self.redis = get_redis()
+        self.place_id = "test_place_refresh"
+
+    def teardown_class(self):
+        self.redis.delete(f"query:{self.place_id}", redis_query.query_key(self.place_id))
+        self.redis.close()
+
+    @pytest.mark.parametrize("legacy_key", [False, True])
+    def test_need_query_place(self, legacy_key):
+        redis_query.clear_place_queried(self.redis, self.place_id)
+        if legacy_key:
+            # Written by the old code without a TTL
+            self.redis.set(f"query:{self.place_id}", 0)
+        assert redis_query.need_query_place(self.redis, self.place_id)
+        assert not redis_query.need_query_place(self.redis, self.place_id)
+        assert 0 < self.redis.ttl(redis_query.query_key(self.place_id)) <= 86400
+        redis_query.clear_place_queried(self.redis, self.place_id)
+        assert redis_query.need_query_place(self.redis, self.place_id)
+
+class TestDetailInvalidation:
+    def setup_class(self):
+        Base.metadata.create_all(engine)
+        self.session = SessionLocal()
+
+    def teardown_class(self):
+        self.session.rollback()
+        self.session.close()
+
+    def version(self, redis, place_id):
+        return redis.commands.count(("incr", stale.version_key(stale.RESTAURANT, place_id)))
+
+    @pytest.mark.parametrize(
+        ("user", "place_id"),
+        [
+            ("pohan.ho@gmail.com", "ChIJycu5coupQjQRl9dmANfpHuw")
+        ],
+    )
+    def test_restaurant_writes(self, user, place_id, stub_redis):
+        user_id = users.get_user_by_email(self.session, user).user_id
+        restaurants.dislike_restaurant(self.session, user_id, place_id)
+        version = self.version(stub_redis, place_id)
+        restaurants.undislike_restaurant(self.session, user_id, place_id)
+        assert self.version(stub_redis, place_id) == version + 1
+        # Counters are consistent, so the reconcile job leaves the cached detail alone
+        restaurants.rebuild_counters(self.session)
+        assert self.version(stub_redis, place_id) == version + 1
+
+    @pytest.mark.parametrize(
+        ("place_id"),
+        [
+            "ChIJycu5coupQjQRl9dmANfpHuw"
+        ],
+    )
+    def test_view_counts(self, place_id, stub_redis):
+        # Views are overlaid on the cached detail rather than invalidating it
+        version = self.version(stub_redis, place_id)
+        views = restaurants.get_view_count(self.session, place_id)
+        restaurants.add_view_counts(self.session, {place_id: 2})
+        assert self.version(stub_redis, place_id) == version
+        assert restaurants.get_view_count(self.session, place_id) == views + 2
+
+    @pytest.mark.parametrize(
+        ("place_id"),
+        [
+            "ChIJycu5coupQjQRl9dmANfpHuw"
+        ],
+    )
+    def test_rolled_back_write(self, place_id, stub_redis):
+        version = self.version(stub_redis, place_id)
+        self.session.query(Restaurant).filter(Restaurant.google_place_id == place_id).first()
+        stale.mark_stale(self.session, stale.RESTAURANT, place_id)
+        self.session.rollback()
+        self.session.commit()
+        assert self.version(stub_redis, place_id) == version
+
+    @pytest.mark.parametrize(
+        ("place_id"),
+        [
+            "ChIJycu5coupQjQRl9dmANfpHuw"
+        ],
+    )
+    def test_redis_down(self, place_id, monkeypatch):
+        class DownRedis(StubRedis):
+            def execute(self):
+                raise RedisError("connection refused")
+        monkeypatch.setattr(stale, "_redis", DownRedis())
+        # The write has committed, so it must not fail because the invalidation did
+        restaurant = restaurants.update_restaurant(self.session, place_id, {})
+        assert restaurant.google_place_id == place_id